@@ -0,0 +1,252 @@
+import os
+import sys
+import io
+import json
+import time
+import platform
+import argparse
+import tracemalloc
+from contextlib import redirect_stdout
+import numpy as np
+import pandas as pd
+
+import bikeshare_zj_v3 as bikeshare
+
+# Benchmark suite for bikeshare_zj_v3.py:
+# generates synthetic city csv files in the layout of the CITY_DATA files, times loading,
+# the stats functions and browsing, and appends the results to a JSON lines file.
+
+# name of the synthetic city registered in CITY_DATA while benchmarking.
+BENCHMARK_CITY = 'benchmark'
+
+# number of rows generated and written at once.
+GENERATOR_CHUNK_ROWS = 1000000
+
+# number of stations of the synthetic cities.
+NO_OF_STATIONS = 600
+
+
+def generate_city_csv(csv_path, rows, user_data=True, seed=0):
+    """
+        Generate a synthetic city csv file with the columns of the CITY_DATA files.
+        Trips start in the first six months of 2017, like the original data.
+        The file is written in chunks, so files larger than memory can be generated.
+
+        Args:
+            (str) csv_path - path of the csv file to write.
+            (int) rows - number of trips.
+            (bool) user_data - add the Gender and Birth Year columns (like chicago and new york city),
+                               otherwise trip durations have fractions of seconds (like washington).
+            (int) seed - seed of the random generator.
+
+        Returns: NONE
+    """
+    rng = np.random.default_rng(seed)
+    stations = np.array(["Station {}".format(i) for i in range(NO_OF_STATIONS)])
+    # some stations are much more popular than others.
+    station_weights = rng.pareto(1.5, NO_OF_STATIONS) + 1
+    station_weights /= station_weights.sum()
+
+    first_start = np.datetime64('2017-01-01T00:00:00', 's')
+    written = 0
+    with open(csv_path, 'w') as f:
+        while written < rows:
+            n = min(GENERATOR_CHUNK_ROWS, rows - written)
+            start = first_start + rng.integers(0, 181 * 86400, n).astype('m8[s]')
+            duration = np.round(rng.lognormal(6.5, 0.8, n)).astype(np.int64) + 60
+            end = start + duration.astype('m8[s]')
+
+            df = pd.DataFrame({'Start Time': np.char.replace(np.datetime_as_string(start, unit='s'), 'T', ' '),
+                               'End Time': np.char.replace(np.datetime_as_string(end, unit='s'), 'T', ' '),
+                               'Trip Duration': duration if user_data else duration + rng.integers(0, 1000, n) / 1000,
+                               'Start Station': stations[rng.choice(NO_OF_STATIONS, n, p=station_weights)],
+                               'End Station': stations[rng.choice(NO_OF_STATIONS, n, p=station_weights)],
+                               'User Type': rng.choice(['Subscriber', 'Customer'], n, p=[0.8, 0.2])},
+                              index=np.arange(written, written + n))
+            if user_data:
+                df['Gender'] = rng.choice(np.array(['Male', 'Female', None], dtype=object), n, p=[0.6, 0.25, 0.15])
+                df['Birth Year'] = np.where(rng.random(n) < 0.15, np.nan, rng.integers(1940, 2002, n))
+
+            df.to_csv(f, header=(written == 0))
+            written += n
+
+
+def measure(step, function, track_memory):
+    """
+        Run one benchmark step and measure it.
+
+        Args:
+            (str) step - name of the step.
+            (function) function - step to run, without arguments.
+            (bool) track_memory - measure the peak memory allocated (tracemalloc), slows down the step.
+
+        Returns:
+            (dict) step, seconds, peak_bytes (None without memory tracking) and the result of the function.
+    """
+    if track_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    result = function()
+    seconds = time.perf_counter() - start
+    peak_bytes = None
+    if track_memory:
+        peak_bytes = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return {'step': step, 'seconds': seconds, 'peak_bytes': peak_bytes, 'result': result}
+
+
+def run_benchmark(csv_path, rows, user_data, track_memory, pages, workers=None):
+    """
+        Benchmark the bikeshare functions on a synthetic city csv file:
+        * load_cold - load_data() parsing the csv file and building the cache
+        * load_warm - load_data() from the cache (frame cache cleared)
+        * load_filtered - load_data() for one month and day from the cache
+        * compute_stats - the statistics engine on all rows
+        * time_stats, station_stats, trip_duration_stats, user_stats - reporting from the statistics
+        * trend_stats - reporting from the cached time-series rollups
+        * usage_stats - the bikes-in-use sweep line, on the loaded data
+        * browse_page - rendering pages at the start, middle and end of the data
+        Files larger than STREAM_FILE_SIZE are never loaded (see city_stats()), the steps are then:
+        * city_stats, city_stats_filtered - statistics in streaming mode (in parallel with more than one worker),
+          for all data and for one month and day
+        * time_stats, station_stats, trip_duration_stats, user_stats - reporting from the statistics
+
+        Args:
+            (str) csv_path - path of the synthetic csv file.
+            (int) rows - number of rows of the file.
+            (bool) user_data - the file has Gender and Birth Year columns.
+            (bool) track_memory - measure the peak memory of each step.
+            (int) pages - number of pages rendered per browse position.
+            (int) workers - number of worker processes in streaming mode, PARALLEL_WORKERS if not given.
+
+        Returns:
+            (list) of result dicts, one per step.
+    """
+    bikeshare.CITY_DATA[BENCHMARK_CITY] = csv_path
+    bikeshare.CITY_SCHEMA[BENCHMARK_CITY] = bikeshare.TRIP_SCHEMA if user_data else \
+        dict(bikeshare.TRIP_SCHEMA, **{'Trip Duration': 'float64'})
+
+    # start cold: no cache on disk, nothing in memory.
+    meta_file = os.path.join(bikeshare.cache_dir(csv_path), 'meta.json')
+    if os.path.exists(meta_file):
+        os.remove(meta_file)
+    bikeshare.frame_cache_evict(csv_path)
+
+    results = []
+    if os.path.getsize(csv_path) > bikeshare.STREAM_FILE_SIZE:
+        df = None
+        results.append(measure('city_stats', lambda: bikeshare.city_stats(BENCHMARK_CITY, 'all', 'all', __file__,
+                                                                          workers=workers), track_memory))
+        stats = results[-1]['result']
+        results.append(measure('city_stats_filtered', lambda: bikeshare.city_stats(BENCHMARK_CITY, 'June', 'Monday', __file__,
+                                                                                   workers=workers), track_memory))
+        # the other stats functions need the trip rows or the cache.
+        stats_functions = [bikeshare.STATS_FUNCTIONS[name] for name in ['time', 'station', 'duration', 'user']]
+    else:
+        results.append(measure('load_cold', lambda: bikeshare.load_data(BENCHMARK_CITY, 'all', 'all', __file__), track_memory))
+        bikeshare.frame_cache_evict(csv_path)
+        results.append(measure('load_warm', lambda: bikeshare.load_data(BENCHMARK_CITY, 'all', 'all', __file__), track_memory))
+        df = results[-1]['result']
+        results.append(measure('load_filtered', lambda: bikeshare.load_data(BENCHMARK_CITY, 'June', 'Monday', __file__), track_memory))
+
+        results.append(measure('compute_stats', lambda: bikeshare.compute_stats(df), track_memory))
+        stats = results[-1]['result']
+        stats_functions = list(bikeshare.STATS_FUNCTIONS.values())
+
+    # the stats functions print their report: keep it out of the benchmark output.
+    for stats_function in stats_functions:
+        with redirect_stdout(io.StringIO()):
+            results.append(measure(stats_function.__name__,
+                                   lambda: stats_function(None, BENCHMARK_CITY, 'all', 'all', stats, plot=False),
+                                   track_memory))
+
+    def browse():
+        with redirect_stdout(io.StringIO()):
+            for position in (0, len(df) // 2, max(len(df) - pages * bikeshare.BATCH_SIZE, 0)):
+                for page in range(pages):
+                    bikeshare.print_page(df, None, position + page * bikeshare.BATCH_SIZE, bikeshare.BATCH_SIZE)
+    if df is not None:
+        results.append(measure('browse_page', browse, track_memory))
+        results[-1]['seconds'] /= 3 * pages
+
+    for result in results:
+        result.pop('result')
+        result['rows'] = rows
+        result['user_data'] = user_data
+        result['rows_per_second'] = rows / result['seconds'] if result['step'] != 'browse_page' and result['seconds'] > 0 else None
+    return results
+
+
+def environment_info():
+    """
+        Describe the environment of the benchmark run, stored with each result.
+
+        Args: NONE
+
+        Returns:
+            (dict) versions of python, pandas and numpy, host name and a timestamp.
+    """
+    return {'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'host': platform.node(),
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'numpy': np.__version__,
+            'pyarrow': bikeshare.pa is not None}
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Benchmark bikeshare_zj_v3.py on synthetic city data.")
+    parser.add_argument('--rows', nargs='+', type=int, default=[10000, 100000, 1000000],
+                        help="sizes of the synthetic data files, default: 10000 100000 1000000")
+    parser.add_argument('--no-user-data', action='store_true',
+                        help="generate files without Gender and Birth Year (like washington)")
+    parser.add_argument('--data-dir', default='benchmark_data',
+                        help="directory for the synthetic csv files, default: benchmark_data")
+    parser.add_argument('--results', default='benchmark_results.jsonl',
+                        help="JSON lines file the results are appended to, default: benchmark_results.jsonl")
+    parser.add_argument('--label', default='',
+                        help="label stored with the results, e.g. the version benchmarked")
+    parser.add_argument('--memory', action='store_true',
+                        help="also measure the peak memory of each step, in a separate run after the timing run "
+                             "(tracemalloc slows down the steps; allocations of worker processes are not seen)")
+    parser.add_argument('--pages', type=int, default=100,
+                        help="pages rendered per browse position, default: 100")
+    parser.add_argument('--stream-file-size', type=int, default=None,
+                        help="benchmark files larger than this number of bytes in streaming mode, "
+                             "default: STREAM_FILE_SIZE of bikeshare_zj_v3.py")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="number of worker processes in streaming mode, default: number of CPUs")
+    args = parser.parse_args(argv[1:])
+
+    if args.stream_file_size is not None:
+        bikeshare.STREAM_FILE_SIZE = args.stream_file_size
+    os.makedirs(args.data_dir, exist_ok=True)
+    user_data = not args.no_user_data
+    info = dict(environment_info(), label=args.label)
+
+    for rows in args.rows:
+        csv_path = os.path.join(args.data_dir, "synthetic_{}{}.csv".format(rows, '' if user_data else '_no_user_data'))
+        if not os.path.exists(csv_path):
+            print("Generating {} rows: {}...".format(rows, csv_path))
+            generate_city_csv(csv_path, rows, user_data)
+
+        print("Benchmarking {} rows...".format(rows))
+        results = run_benchmark(csv_path, rows, user_data, False, args.pages, args.workers)
+        if args.memory:
+            # timing and memory are measured in separate runs, so that tracemalloc does not distort the timings.
+            print("Measuring the memory of {} rows...".format(rows))
+            peaks = {result['step']: result['peak_bytes']
+                     for result in run_benchmark(csv_path, rows, user_data, True, args.pages, args.workers)}
+            for result in results:
+                result['peak_bytes'] = peaks[result['step']]
+        with open(args.results, 'a') as f:
+            for result in results:
+                f.write(json.dumps(dict(info, **result)) + '\n')
+                print("  {:20} {:10.4f} s{}".format(result['step'], result['seconds'],
+                      "" if result['peak_bytes'] is None else ", peak {:.1f} MB".format(result['peak_bytes'] / 1024**2)))
+
+    print("Results appended to {}.".format(os.path.abspath(args.results)))
+
+
+if __name__ == "__main__":
+    main(sys.argv)
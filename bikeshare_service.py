@@ -0,0 +1,330 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+from urllib.parse import urlsplit, parse_qs
+from concurrent.futures import ProcessPoolExecutor
+from collections import OrderedDict
+
+import bikeshare_zj_v3 as bikeshare
+
+# Local HTTP query service for bikeshare_zj_v3.py:
+# the cities of CITY_DATA are kept loaded in a pool of worker processes, which answer
+# GET requests with the results of the stats functions (as JSON), e.g.
+#     curl 'http://127.0.0.1:8080/time?city=chicago&month=june&day=monday'
+
+# endpoint -> builder of the structured result from the statistics (see time_result(), ...).
+STATS_ENDPOINTS = {'/time': bikeshare.time_result,
+                   '/station': bikeshare.station_result,
+                   '/duration': bikeshare.duration_result,
+                   '/user': bikeshare.user_result}
+
+# maximum number of records returned by one /browse request.
+MAX_PAGE_SIZE = 1000
+
+# Responses are cached per endpoint and parameters, as long as the data cache of the city does not change
+# (its state, see cache_state(), is part of the key: csv changes and ingested files both change it).
+# Least recently used responses are dropped first.
+RESPONSE_CACHE_MAX_ENTRIES = 10000
+RESPONSE_CACHE = OrderedDict()
+RESPONSE_CACHE_STATS = {'hits': 0, 'misses': 0}
+
+HTTP_STATUS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 500: 'Internal Server Error',
+               503: 'Service Unavailable'}
+
+
+# csv file (mtime, size) per city when the service last brought its data cache up to date, see refresh_cache().
+# The cache is only written by the service process, one city at a time (CACHE_LOCK).
+CSV_STATS = {}
+CACHE_LOCK = asyncio.Lock()
+
+
+class QueryError(Exception):
+    """Invalid request parameters, answered with status 400."""
+
+
+def build_caches():
+    """
+        Build (or update) the data caches of all cities in the service process, before the workers
+        start: the workers only read the caches, so they never write the same files at the same time.
+
+        Args: NONE
+
+        Returns:
+            (list) cities whose data is available.
+    """
+    available = []
+    for city, csv_path in bikeshare.CITY_DATA.items():
+        try:
+            stat = os.stat(csv_path)
+            bikeshare.update_cache(csv_path, bikeshare.city_schema(city))
+            CSV_STATS[city] = (stat.st_mtime, stat.st_size)
+            available.append(city)
+        except FileNotFoundError as e:
+            print("Data of {} not available: {}.".format(city, e))
+    return available
+
+
+async def refresh_cache(city):
+    """
+        Bring the data cache of a city up to date in the service process, when its csv file changed
+        since the last update (or the cache is missing): rows appended to the csv file are merged
+        into the cache, a changed file is parsed again, see update_cache(). Updates are serialized,
+        and run before the request is sent to the workers, which then read the updated cache.
+
+        Args:
+            (str) city - name of the city.
+
+        Returns:
+            (dict) meta data of the cache, see read_cache_meta().
+
+        Raises:
+            FileNotFoundError - the csv file of the city does not exist.
+            DataLoadError - the csv file cannot be parsed.
+    """
+    csv_path = bikeshare.CITY_DATA[city]
+    stat = os.stat(csv_path)
+    meta = bikeshare.read_cache_meta(csv_path)
+    if meta is None or CSV_STATS.get(city) != (stat.st_mtime, stat.st_size):
+        async with CACHE_LOCK:
+            meta = bikeshare.read_cache_meta(csv_path)
+            if meta is None or CSV_STATS.get(city) != (stat.st_mtime, stat.st_size):
+                await asyncio.get_running_loop().run_in_executor(None, bikeshare.update_cache, csv_path,
+                                                                 bikeshare.city_schema(city))
+                CSV_STATS[city] = (stat.st_mtime, stat.st_size)
+                meta = bikeshare.read_cache_meta(csv_path)
+    return meta
+
+
+def warm_up(cities):
+    """
+        Worker process initializer: load the complete data of the cities into the frame cache
+        of the worker (see read_city_data()), so that requests only slice it, and their
+        marginal tables (see read_city_marginals()), from which the statistics are answered.
+        The worker only reads the caches, which the service process keeps up to date, see
+        build_caches() and refresh_cache().
+
+        Args:
+            (list) cities - names of the cities to load.
+
+        Returns: NONE
+    """
+    bikeshare.CACHE_WRITABLE = False
+    for city in cities:
+        bikeshare.load_data(city, 'all', 'all', __file__)
+        bikeshare.read_city_stats(city, 'all', 'all')
+
+
+def query(endpoint, city, month, day, start, size):
+    """
+        Answer a request in a worker process.
+
+        Args:
+            (str) endpoint - '/time', '/station', '/duration', '/user' or '/browse'.
+            (str) city - name of the city.
+            (str) month - name of the month to filter by, or "all".
+            (str) day - name of the day of week to filter by, or "all".
+            (int) start - /browse only: position of the first record.
+            (int) size - /browse only: number of records.
+
+        Returns:
+            (dict) response body: result of the stats function, or the records of the page.
+    """
+    if endpoint == '/browse':
+        df = bikeshare.load_data(city, month, day, __file__)
+        page = df.iloc[start:start + size]
+        return {'report': 'browse', 'city': city, 'month': month, 'day': day,
+                'rows': len(df), 'start': start,
+                'records': json.loads(page.reset_index().to_json(orient='records', date_format='iso'))}
+
+    stats = bikeshare.city_stats(city, month, day, __file__, workers=1)
+    return bikeshare.plain(STATS_ENDPOINTS[endpoint](stats, city, month, day))
+
+
+def query_arguments(path, params):
+    """
+        Check the parameters of a request.
+
+        Args:
+            (str) path - endpoint requested.
+            (dict) params - query parameters, as returned by parse_qs().
+
+        Returns:
+            (tuple) city, month, day, start, size - arguments of query().
+    """
+    def param(name, default=None):
+        values = params.get(name)
+        if not values:
+            if default is None:
+                raise QueryError("missing parameter: {}".format(name))
+            return default
+        return values[0]
+
+    city = param('city').lower()
+    if city not in bikeshare.CITY_DATA:
+        raise QueryError("unknown city: {}, available: {}".format(city, ", ".join(bikeshare.CITY_DATA)))
+    try:
+        month = bikeshare.parse_month(param('month', 'all'))
+        day = bikeshare.parse_day(param('day', 'all'))
+        start = int(param('start', '0'))
+        size = int(param('size', str(bikeshare.BATCH_SIZE)))
+    except (argparse.ArgumentTypeError, ValueError) as e:
+        raise QueryError(str(e))
+    if start < 0 or not 0 < size <= MAX_PAGE_SIZE:
+        raise QueryError("start must be >= 0 and size between 1 and {}".format(MAX_PAGE_SIZE))
+
+    if path != '/browse':
+        start, size = 0, 0
+    return city, month, day, start, size
+
+
+async def answer(executor, path, params):
+    """
+        Answer a request, from the response cache or by a worker process.
+
+        Args:
+            (Executor) executor - worker pool.
+            (str) path - endpoint requested.
+            (dict) params - query parameters.
+
+        Returns:
+            (tuple) status, response body (dict) and whether it came from the response cache.
+    """
+    if path == '/cities':
+        return 200, {'cities': list(bikeshare.CITY_DATA.keys())}, False
+    if path == '/health':
+        return 200, {'status': 'ok', 'response_cache': dict(RESPONSE_CACHE_STATS, entries=len(RESPONSE_CACHE))}, False
+    if path not in STATS_ENDPOINTS and path != '/browse':
+        return 404, {'error': "unknown endpoint: {}".format(path)}, False
+
+    try:
+        arguments = query_arguments(path, params)
+    except QueryError as e:
+        return 400, {'error': str(e)}, False
+
+    try:
+        meta = await refresh_cache(arguments[0])
+    except FileNotFoundError as e:
+        return 503, {'error': "data of {} not available: {}".format(arguments[0], e)}, False
+    except bikeshare.DataLoadError as e:
+        return 503, {'error': str(e)}, False
+    key = (path,) + arguments + bikeshare.cache_state(meta)
+    if key in RESPONSE_CACHE:
+        RESPONSE_CACHE.move_to_end(key)
+        RESPONSE_CACHE_STATS['hits'] += 1
+        return 200, RESPONSE_CACHE[key], True
+
+    RESPONSE_CACHE_STATS['misses'] += 1
+    try:
+        body = await asyncio.get_running_loop().run_in_executor(executor, query, path, *arguments)
+    except bikeshare.DataLoadError as e:
+        return 503, {'error': str(e)}, False
+    RESPONSE_CACHE[key] = body
+    if len(RESPONSE_CACHE) > RESPONSE_CACHE_MAX_ENTRIES:
+        RESPONSE_CACHE.popitem(last=False)
+    return 200, body, False
+
+
+async def handle_connection(reader, writer, executor):
+    """
+        Serve the HTTP/1.1 requests of one connection (GET only, keep-alive supported).
+
+        Args:
+            (StreamReader) reader, (StreamWriter) writer - the connection.
+            (Executor) executor - worker pool.
+
+        Returns: NONE
+    """
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line:
+                break
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+
+            start_time = time.perf_counter()
+            parts = request_line.decode('latin-1').split()
+            cached = False
+            if len(parts) != 3:
+                status, body = 400, {'error': 'malformed request line'}
+            elif parts[0] != 'GET':
+                status, body = 405, {'error': 'only GET is supported'}
+            else:
+                url = urlsplit(parts[1])
+                try:
+                    status, body, cached = await answer(executor, url.path.rstrip('/') or '/', parse_qs(url.query))
+                except Exception as e:
+                    status, body = 500, {'error': "{}: {}".format(type(e).__name__, e)}
+
+            keep_alive = len(parts) == 3 and parts[2] == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+            payload = json.dumps(body).encode()
+            writer.write("HTTP/1.1 {} {}\r\n"
+                         "Content-Type: application/json\r\n"
+                         "Content-Length: {}\r\n"
+                         "Connection: {}\r\n"
+                         "X-Cache: {}\r\n"
+                         "X-Response-Time-Ms: {:.3f}\r\n\r\n".format(status, HTTP_STATUS[status], len(payload),
+                                                                     'keep-alive' if keep_alive else 'close',
+                                                                     'hit' if cached else 'miss',
+                                                                     (time.perf_counter() - start_time) * 1000).encode() + payload)
+            await writer.drain()
+            if not keep_alive:
+                break
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(host, port, workers, cities):
+    """
+        Run the service until interrupted.
+
+        Args:
+            (str) host, (int) port - address to listen on.
+            (int) workers - number of worker processes.
+            (list) cities - cities loaded by each worker on start.
+
+        Returns: NONE
+    """
+    available = build_caches()
+    cities = [city for city in cities if city in available]
+    with ProcessPoolExecutor(max_workers=workers, initializer=warm_up, initargs=(cities,)) as executor:
+        # start all workers now (each one loads the cities), not on the first requests.
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*[loop.run_in_executor(executor, time.sleep, 0.1) for worker in range(workers)])
+
+        server = await asyncio.start_server(lambda reader, writer: handle_connection(reader, writer, executor), host, port)
+        print("Serving {} on http://{}:{} with {} workers.".format(", ".join(cities), host, port, workers))
+        print("Endpoints: {} /browse /cities /health, parameters: city, month, day (/browse: start, size).".format(
+              " ".join(STATS_ENDPOINTS)))
+        async with server:
+            await server.serve_forever()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Serve US bikeshare statistics over HTTP (JSON), with the city data kept loaded.")
+    parser.add_argument('--host', default='127.0.0.1', help="address to listen on, default: 127.0.0.1")
+    parser.add_argument('--port', type=int, default=8080, help="port to listen on, default: 8080")
+    parser.add_argument('--workers', type=int, default=min(bikeshare.PARALLEL_WORKERS, 4),
+                        help="number of worker processes, each keeping the cities loaded, default: CPUs (at most 4)")
+    parser.add_argument('--city', nargs='+', choices=list(bikeshare.CITY_DATA.keys()), default=list(bikeshare.CITY_DATA.keys()),
+                        help="cities to load on start, default: all (other cities are loaded on first request)")
+    args = parser.parse_args(argv[1:])
+
+    try:
+        asyncio.run(serve(args.host, args.port, args.workers, args.city))
+    except KeyboardInterrupt:
+        print("Terminating service. Good bye...")
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -1,9 +1,38 @@
 import os
 import sys
+import pickle
 import time
+import json
+import hashlib
+import shutil
+import argparse
+import threading
+import tracemalloc
+import cProfile
+from contextlib import redirect_stdout, contextmanager
+import io
+from concurrent.futures import ProcessPoolExecutor
+from collections import OrderedDict
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+# pyarrow is optional: if available, the columnar cache is written as Feather file
+# and memory-mapped on load, otherwise pandas' pickle format is used.
+# It is also used to access the raw bytes of timestamp strings without copying.
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+except ImportError:
+    pa = None
+    feather = None
+
+
+class DataLoadError(Exception):
+    """The data of a city can not be loaded (unknown city or missing data file), see load_data()."""
+
 
 # dict to store the City/datafile combinations.
 # CSV files assumed in same directory as script file!!
@@ -36,9 +65,311 @@ WEEKDAYS = {0 : 'Monday',
             6 : 'Sunday',
             9 : 'all'}
 
+# directory the plots are stored in.
+PLOT_DIR = '.'
+
+# Pool of worker processes rendering the stored plots in the background (batch mode),
+# None to render them right away. See start_plot_workers() and wait_for_plots().
+PLOT_EXECUTOR = None
+PLOT_TASKS = []
+
+# name of the combined data of all cities in CITY_DATA, see load_combined_data().
+COMBINED_CITY = 'all cities'
+
 # number of records displayed in one batch, when browsing raw data.
 BATCH_SIZE = 3
 
+# Columnar cache of the parsed city data, stored in a directory next to the csv file.
+# The cache holds one file per month ('month_01', ...; 'month_00' for rows without start time),
+# with the rows of each month sorted by weekday, so that month/day filters only read matching rows.
+# New rows (appended to the csv file or ingested from other files) are merged into the cache
+# incrementally, see append_to_cache().
+# Bump CACHE_VERSION whenever the layout of the cached dataframe changes.
+CACHE_SUFFIX = '_cache'
+CACHE_VERSION = 15
+
+# Processes which only read the cache (e.g. the workers of bikeshare_service.py, while the cache
+# is built by the parent process) turn this off: a stale cache is then not updated, but bypassed.
+CACHE_WRITABLE = True
+
+# errors raised when reading a damaged cache file (e.g. a half-written file of an interrupted run):
+# the cache is treated as missing and rebuilt, see read_city_data().
+CACHE_READ_ERRORS = (OSError, ValueError, KeyError, EOFError, pickle.UnpicklingError) + \
+                    ((pa.ArrowException,) if pa is not None else ())
+
+# Files larger than this are analysed in streaming mode: read in chunks of STREAM_CHUNK_SIZE rows,
+# with the statistics of the chunks merged, so that memory does not grow with the file size.
+# With more than one worker, byte ranges of the file are read in parallel (see parallel_stats()).
+# Batch mode: --stream-file-mb.
+STREAM_FILE_SIZE = 4 * 1024**3
+STREAM_CHUNK_SIZE = 500000
+
+# number of worker processes used to calculate statistics in parallel (streaming mode and all cities).
+PARALLEL_WORKERS = os.cpu_count() or 1
+
+# In-process LRU cache of the complete (unfiltered) city dataframes, keyed by csv file.
+# Filter changes of an already loaded city are answered by slicing the cached dataframe.
+# Cities whose data is larger than FRAME_CACHE_MAX_BYTES are never cached, see set_frame_cache_limit().
+FRAME_CACHE_MAX_BYTES = 2 * 1024**3
+FRAME_CACHE = OrderedDict()
+FRAME_CACHE_STATS = {'hits': 0, 'misses': 0, 'evictions': 0, 'bytes': 0}
+
+# Trip durations are summarised with a mergeable, fixed size log-bucketed sketch (like DDSketch):
+# bucket i > 0 holds durations in (gamma^(i-1), gamma^i] seconds, bucket 0 durations up to 1 second,
+# with gamma = (1 + accuracy) / (1 - accuracy). Quantiles read from the sketch have a relative
+# error of at most DURATION_SKETCH_ACCURACY. 1024 buckets cover durations up to ~24 years.
+DURATION_SKETCH_ACCURACY = 0.01
+DURATION_SKETCH_BUCKETS = 1024
+DURATION_SKETCH_GAMMA = (1 + DURATION_SKETCH_ACCURACY) / (1 - DURATION_SKETCH_ACCURACY)
+
+# upper bounds (in minutes) of the log-bucketed trip duration histogram, see duration_histogram().
+DURATION_HISTOGRAM_MINUTES = [1, 2, 4, 8, 16, 32, 64, 128, 256]
+
+# percentiles of the trip duration reported.
+DURATION_PERCENTILES = [50, 90, 99]
+
+# frequency tables which can be approximated by a top-k summary (Space-Saving), see compute_stats().
+# These rankings can have millions of distinct values (routes) on multi-year data.
+TOPK_KEYS = ['start', 'end', 'route', 'birth_year']
+
+# station indexes loaded in this process, keyed by csv file, see read_station_index().
+STATION_INDEXES = {}
+
+# marginal tables loaded in this process, keyed by csv file, see read_city_marginals().
+MARGINALS = {}
+
+# keys identifying a structured result of the stats functions (see time_result(), ...),
+# kept as columns when results are stored as table, see result_rows().
+RESULT_ID_KEYS = ['report', 'city', 'month', 'day']
+
+# Instrumentation: named spans (csv read, timestamp parsing, filtering, each statistic, ...)
+# timed with a monotonic nanosecond clock, see start_span(). Off by default, see enable_tracing().
+TRACE_SETTINGS = {'enabled': False, 'memory': False, 'origin': 0}
+TRACE_EVENTS = []
+TRACE_STACK = []
+
+# Time-series rollups of the trips by start time: number of trips and trip duration sum per bucket
+# of each resolution (bucket width in seconds), stored in the cache, see build_rollups().
+# Weekly buckets start on Monday (1970-01-05 was a Monday).
+ROLLUP_RESOLUTIONS = {'15min': 15 * 60, 'hour': 3600, 'day': 86400, 'week': 7 * 86400}
+ROLLUP_WEEK_OFFSET = 4 * 86400
+
+# number of days of the rolling mean of the daily trips in the trend report, see trend_result().
+TREND_WINDOW_DAYS = 7
+
+# The bikes-in-use curve (number of trips underway over time, see usage_curve()) is sampled
+# in steps of USAGE_PROFILE_STEP seconds, for its average profile over the time of day.
+USAGE_PROFILE_STEP = 15 * 60
+
+# Column profiles (null counts, min/max, distinct values, data quality checks) are stored per
+# month partition of the cache, see build_profile(). The number of distinct values is estimated
+# with a mergeable k minimum values sketch: the PROFILE_SKETCH_SIZE smallest 64 bit hashes of the
+# values (relative error ~ 1/sqrt(PROFILE_SKETCH_SIZE)); below that size, the count is exact.
+PROFILE_SKETCH_SIZE = 1024
+
+# columns stored as categoricals in the cache (and in the loaded dataframe).
+CATEGORY_COLUMNS = ['Start Station', 'End Station', 'User Type', 'Gender']
+
+# Column types applied when reading the city csv files, to keep the loaded data compact.
+# Columns not found in a file (e.g. Gender and Birth Year for washington) are ignored.
+# Start Time and End Time are parsed to datetime in prepare_data().
+TRIP_SCHEMA = {'Unnamed: 0': 'int32',
+               'Trip Duration': 'int32',
+               'Start Station': 'category',
+               'End Station': 'category',
+               'User Type': 'category',
+               'Gender': 'category',
+               'Birth Year': 'Int16'}
+
+# schema per city, cities not listed use TRIP_SCHEMA.
+# washington records the trip duration with fractions of seconds.
+CITY_SCHEMA = {'chicago': TRIP_SCHEMA,
+               'new york city': TRIP_SCHEMA,
+               'washington': dict(TRIP_SCHEMA, **{'Trip Duration': 'float64'})}
+
+# types of the derived month, day and hour columns.
+MONTH_TYPE = pd.CategoricalDtype([value for key, value in MONTH.items() if key != 0], ordered=True)
+DAY_TYPE = pd.CategoricalDtype([value for key, value in WEEKDAYS.items() if key != 9], ordered=True)
+HOUR_TYPE = 'int8'
+
+# number of days per month (index 1..12) of a non leap year, used to validate parsed timestamps;
+# index 0 and 13 (out of range months) have no valid day.
+DAYS_IN_MONTH = np.array([0, 31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31, 0])
+
+# marginal tables stored in the cache: statistic -> columns it is counted by, in addition to month and day
+# (gender and birth_year only, if in the data). Each table holds the number of trips and the trip duration
+# count, sum, min and max per combination, which is enough to answer all statistics of the stats functions
+# for any month/day filter, see marginal_stats(). 'total' holds the trips per month and day only.
+MARGINAL_COLUMNS = {'total': [],
+                    'hour': ['hour'],
+                    'start': ['Start Station'],
+                    'end': ['End Station'],
+                    'route': ['Start Station', 'End Station'],
+                    'user_type': ['User Type'],
+                    'gender': ['Gender'],
+                    'birth_year': ['Birth Year']}
+
+def enable_tracing(memory=False):
+    """
+        Start recording spans (see start_span()), e.g. to find out where time goes under large data sizes.
+        
+        Args:
+            (bool) memory - also track the memory allocated within each span (tracemalloc), slows down the script.
+        
+        Returns: NONE
+    """
+    TRACE_SETTINGS['enabled'] = True
+    TRACE_SETTINGS['memory'] = memory
+    TRACE_SETTINGS['origin'] = time.perf_counter_ns()
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def start_span(name, **args):
+    """
+        Start a named span. Spans can be nested, and have to be ended in reverse order.
+        Without tracing enabled, nothing is recorded.
+        
+        Args:
+            (str) name - name of the span, e.g. 'read_csv'.
+            args - details stored with the span, e.g. city=city.
+        
+        Returns:
+            (dict) the span to pass to end_span(), None if tracing is not enabled.
+    """
+    if not TRACE_SETTINGS['enabled']:
+        return None
+    
+    span = {'name': name, 'args': args, 'peak': 0}
+    if TRACE_SETTINGS['memory']:
+        # the peak of the enclosing span is kept, before the peak is reset for this span.
+        current, peak = tracemalloc.get_traced_memory()
+        if TRACE_STACK:
+            TRACE_STACK[-1]['peak'] = max(TRACE_STACK[-1]['peak'], peak)
+        span['memory_start'] = current
+        tracemalloc.reset_peak()
+    TRACE_STACK.append(span)
+    span['start'] = time.perf_counter_ns()
+    return span
+
+
+def end_span(span):
+    """
+        End a span started with start_span() and record it.
+        
+        Args:
+            (dict) span - span as returned by start_span(), None is ignored.
+        
+        Returns: NONE
+    """
+    if span is None:
+        return
+    end = time.perf_counter_ns()
+    TRACE_STACK.pop()
+    
+    event = {'name': span['name'],
+             'start_ns': span['start'] - TRACE_SETTINGS['origin'],
+             'duration_ns': end - span['start'],
+             'depth': len(TRACE_STACK),
+             'pid': os.getpid(),
+             'tid': threading.get_ident(),
+             'args': span['args']}
+    
+    if TRACE_SETTINGS['memory']:
+        current, peak = tracemalloc.get_traced_memory()
+        peak = max(span['peak'], peak)
+        event['memory_bytes'] = current - span['memory_start']
+        event['memory_peak_bytes'] = peak - span['memory_start']
+        if TRACE_STACK:
+            TRACE_STACK[-1]['peak'] = max(TRACE_STACK[-1]['peak'], peak)
+        tracemalloc.reset_peak()
+    
+    TRACE_EVENTS.append(event)
+
+
+@contextmanager
+def trace_span(name, **args):
+    """
+        Record the enclosed block as span, see start_span().
+        
+        Args:
+            (str) name - name of the span.
+            args - details stored with the span.
+    """
+    span = start_span(name, **args)
+    try:
+        yield span
+    finally:
+        end_span(span)
+
+
+def traced_task(settings, function, *args):
+    """
+        Run a task in a worker process with the trace settings of the parent process,
+        and return the spans recorded with the result, as spans of worker processes
+        are not seen by the parent otherwise (see task_result()).
+        
+        Args:
+            (dict) settings - TRACE_SETTINGS of the parent process.
+            (function) function - task to run.
+            args - arguments of the task.
+        
+        Returns:
+            (tuple) result of the task, (list) spans recorded while it ran.
+    """
+    TRACE_SETTINGS.update(settings)
+    if settings['memory'] and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    del TRACE_EVENTS[:]
+    result = function(*args)
+    events = list(TRACE_EVENTS)
+    del TRACE_EVENTS[:]
+    return result, events
+
+
+def task_result(task):
+    """
+        Get the result of a traced_task() run by a worker process, adding its spans to the trace.
+        
+        Args:
+            (Future) task - task submitted with traced_task().
+        
+        Returns:
+            result of the task.
+    """
+    result, events = task.result()
+    TRACE_EVENTS.extend(events)
+    return result
+
+
+def write_trace(path):
+    """
+        Export the recorded spans:
+        * as Chrome trace (for chrome://tracing or Perfetto), if the file name ends with '.json'
+        * as JSON lines (one span per line) otherwise
+        
+        Args:
+            (str) path - file to write.
+        
+        Returns: NONE
+    """
+    with open(path, 'w') as f:
+        if path.endswith('.json'):
+            trace_events = [{'name': event['name'],
+                             'cat': 'bikeshare',
+                             'ph': 'X',
+                             'ts': event['start_ns'] / 1000,
+                             'dur': event['duration_ns'] / 1000,
+                             'pid': event['pid'],
+                             'tid': event['tid'],
+                             'args': dict(event['args'], **{key: event[key] for key in ('memory_bytes', 'memory_peak_bytes') if key in event})}
+                            for event in TRACE_EVENTS]
+            json.dump({'traceEvents': trace_events, 'displayTimeUnit': 'ms'}, f, default=str)
+        else:
+            for event in TRACE_EVENTS:
+                f.write(json.dumps(event, default=str) + '\n')
+
+
 def clear_screen():
     """
         Execute "clear screen" command suitable for OS the script is running in.
@@ -58,13 +389,14 @@ def print_line():
     """
         Little function to print horizontal dashed line on terminal,
         with proper length (terminal columns).
-        Requires import of module os.
+        Falls back to 80 columns, if not running in a terminal (e.g. batch mode).
+        Requires import of module shutil.
         
         Args: NONE
         
         Returns: NONE
     """
-    terminal_cols , terminal_lines = os.get_terminal_size()
+    terminal_cols , terminal_lines = shutil.get_terminal_size()
     #print(terminal_cols , terminal_lines)
     print()
     print("-" * terminal_cols)
@@ -90,10 +422,11 @@ def get_filters():
     print("City selection first. Your choices are: ")
     for key , value in CITY_DATA.items():
         print("  {}".format(key))
+    print("  {} (combined, with breakdown per city)".format(COMBINED_CITY))
     print()
     
     city = ""
-    city_list = list(CITY_DATA.keys())
+    city_list = list(CITY_DATA.keys()) + [COMBINED_CITY]
     while city not in city_list:
         city = input("For which City do you want to analyse data? Please choose from the above set. ")
         city = city.lower()
@@ -198,17 +531,33 @@ def print_filter_settings(city, month, day):
     print("... with the following filter settings applied: city: {}, month: {}, day: {}.\n".format(city, month, day))
 
 
-def dataframe_overview(df):
-    """ Display basic properties of the loaded dataframe.
+def dataframe_overview(df, city=None, month='all', day='all'):
+    """ Display basic properties of the loaded dataframe and its column profile
+        (see build_profile()). Without day filter, the profile is read from the cache
+        of the city instead of scanning the dataframe.
     
         Args:
             (df) df - dataframe holding data loaded.
+            (str) city, month, day - filter the data was loaded with (city None: profile the dataframe).
             
-        Returns: NONE
+        Returns:
+            (dict) result with report ('overview'), city, month, day, rows, memory_bytes, columns (column ->
+            {'dtype', 'non_null', 'nulls', 'distinct', 'min', 'max', 'memory_bytes'}), columns_with_nan
+            and the data quality counts invalid_timestamps (column -> NaT values), end_before_start
+            and negative_duration.
     
     """
-    print("Dataframe basic infos:")
-    print(df.info())
+    profile = read_city_profile(city, month) if city is not None and day == 'all' else None
+    if profile is None or profile['rows'] != len(df):
+        profile = build_profile(df)
+    memory = df.memory_usage(deep=True, index=False)
+    
+    print("Dataframe basic infos: {} rows, {} columns, {:.1f} MB.".format(len(df), len(df.columns), memory.sum() / 1024**2))
+    print("{:<15} {:<16} {:>10} {:>8} {:>9}  {:<20} {:<20}".format('Column', 'Dtype', 'Non-Null', 'Nulls', 'Distinct', 'Min', 'Max'))
+    for col, entry in profile['columns'].items():
+        print("{:<15} {:<16} {:>10} {:>8} {:>9}  {:<20} {:<20}".format(
+              col, entry['dtype'], profile['rows'] - entry['nulls'], entry['nulls'], distinct_estimate(entry['sketch'], profile['rows'] - entry['nulls']),
+              str(entry['min'])[:20], str(entry['max'])[:20]))
     print()
     
     print("Dataframe first 5 rows:")
@@ -216,363 +565,4125 @@ def dataframe_overview(df):
     print()
     
     # List of columns with NULL or NaN values
-    columns_with_nan = [col for col in df.columns if df[col].isnull().any()]
+    columns_with_nan = [col for col, entry in profile['columns'].items() if entry['nulls'] > 0]
 
     print("Columns with NULL or NaN values:", columns_with_nan)
     
+    invalid_timestamps = {col: profile['columns'][col]['nulls'] for col in ['Start Time', 'End Time'] if col in profile['columns']}
+    print("Data quality: {} missing or invalid timestamps ({}), {} trips ending before they start, "
+          "{} negative trip durations.".format(sum(invalid_timestamps.values()),
+                                               ", ".join("{}: {}".format(col, n) for col, n in invalid_timestamps.items()),
+                                               profile['end_before_start'], profile['negative_duration']))
+    
     print_line()
+    
+    return {'report': 'overview', 'city': city, 'month': month, 'day': day,
+            'rows': len(df),
+            'memory_bytes': memory.sum(),
+            'columns': {col: {'dtype': entry['dtype'], 'non_null': profile['rows'] - entry['nulls'],
+                              'nulls': entry['nulls'], 'distinct': distinct_estimate(entry['sketch'], profile['rows'] - entry['nulls']),
+                              'min': entry['min'], 'max': entry['max'], 'memory_bytes': memory[col]}
+                        for col, entry in profile['columns'].items()},
+            'columns_with_nan': columns_with_nan,
+            'invalid_timestamps': invalid_timestamps,
+            'end_before_start': profile['end_before_start'],
+            'negative_duration': profile['negative_duration']}
 
 
-def load_data(city, month, day, script_name):
+def city_schema(city):
     """
-        Loads data for the specified city and filters by month and day if applicable.
-        The function also adds 4 columns required in the stats functions later on.
-        * month
-        * day
-        * hour
-        * StationsCombined
-    
+        Get the column types to apply when reading the csv file of a city.
+        
+        Args:
+            (str) city - name of the city
+        
+        Returns:
+            (dict) column name -> type, see TRIP_SCHEMA.
+    """
+    return CITY_SCHEMA.get(city, TRIP_SCHEMA)
 
+
+def timestamp_chars(series, width):
+    """
+        Get the characters of a column of fixed-width strings as 2-dimensional byte array.
+        With pyarrow the bytes are taken from the arrow string buffer without conversion,
+        otherwise the strings are converted to a numpy bytes array.
+        
         Args:
-            (str) city - name of the city to analyze
-            (str) month - name of the month to filter by, or "all" to apply no month filter
-            (str) day - name of the day of week to filter by, or "all" to apply no day filter
+            (Series) series - column of strings.
+            (int) width - expected length of each string.
         
         Returns:
-            df - Pandas DataFrame containing city data filtered by month and day
+            (ndarray) uint8 array of shape (rows, width), None if not all values are strings of that width.
     """
-    #city = 'test'
-    # load data based in city and CITY_DATA.
-    # if somehow an invalid city is encountered, terminate script.
-    pathname = os.path.dirname(script_name)
-    full_path = os.path.abspath(pathname)
+    if len(series) == 0:
+        return None
     
-    if city in CITY_DATA.keys():
+    if pa is not None:
         try:
-            df = pd.read_csv(CITY_DATA[city])
-        except FileNotFoundError as e:
-            print("Error while laoding data: {}.".format(e))
-            print("Check location of script and data files.")
-            print("They should all be located in the same directory!!")
-            print("Current working directory is: {}.".format(full_path))
-            print("Terminating script...")
-            exit()
-            
-        #print(df.head())
-    else:
-        print("City \'{}\' not found.".format(city))
-        print("Please check against config in CITY_DATA:")
-        print(CITY_DATA)
-        print("Script terminated...")
-        exit()
-    
-    # convert Start Time and End Time columns to datetime.
-    df['Start Time'] = pd.to_datetime(df['Start Time'])
-    df['End Time'] = pd.to_datetime(df['End Time'])
-    
-    # For later usage in the stats functions:
-    # - extract month, day of week and hour from the Start Time column and make them
-    #   columns on their own.
-    # - add column 'StationsCombined', by concatenating 'Start Station' and 'End Station' 
-    #   agg() function used to create new column 'StationsCombined'
-    df['month'] = df['Start Time'].dt.month_name()
-    df['day'] = df['Start Time'].dt.day_name()
-    df['hour'] = df['Start Time'].dt.hour
-    
-    df['StationsCombined'] = df[['Start Station', 'End Station']].agg('/'.join, axis=1)
-    #print(df.head())
-    
-    # apply the date filters.
-    #print("Filter the dataframe with day = {} and month = {}.".format(day, month))
-    if day != 'all':
-        df = df[df['day'] == day]
+            strings = pa.array(series)
+        except (pa.ArrowException, TypeError, ValueError):
+            return None
+        if isinstance(strings, pa.ChunkedArray):
+            strings = strings.combine_chunks()
+        if strings.null_count > 0 or not pa.types.is_string(strings.type) and not pa.types.is_large_string(strings.type):
+            return None
+        
+        strings = strings.cast(pa.large_string())
+        offsets = np.frombuffer(strings.buffers()[1], dtype=np.int64)[strings.offset:strings.offset + len(strings) + 1]
+        if not (np.diff(offsets) == width).all():
+            return None
+        return np.frombuffer(strings.buffers()[2], dtype=np.uint8)[offsets[0]:offsets[-1]].reshape(-1, width)
     
-    if month != 'all':
-        df = df[df['month'] == month]
-
-    return df
+    raw = series.to_numpy().astype('S')
+    if raw.dtype.itemsize != width:
+        return None
+    return raw.view(np.uint8).reshape(-1, width)
 
 
-def time_stats(df, city, month, day):
-    """Displays statistics on the most frequent times of travel.
-       This function calculates the most frequent travel times based on the filters chosen and 
-       offers a plot of the most popular starting hours.
-       
+def parse_timestamps(series):
+    """
+        Parse a column of timestamps in the fixed 'YYYY-MM-DD HH:MM:SS' layout of the datasets.
+        The digits are converted with vectorized integer arithmetic on the raw bytes,
+        no format inference is done. Values with fields out of range (month not in 1..12,
+        day beyond the end of the month, hour > 23, minute or second > 59) become NaT.
+        If any value does not match the layout (e.g. missing values), the column is parsed
+        with pd.to_datetime() in the same format instead, invalid values becoming NaT.
+        
         Args:
-        (dataframe) df - dataframe holding the bike trip data based on the below filters.
-        (str) city - name of the city to analyze
-        (str) month - name of the month to filter by, or "all" to apply no month filter
-        (str) day - name of the day of week to filter by, or "all" to apply no day filter
+            (Series) series - column of timestamp strings.
         
-        Returns: NONE
+        Returns:
+            (ndarray) datetime64[s] values, i.e. int64 seconds since epoch (NaT for missing or invalid values).
     """
-
-    print('\nCalculating The Most Frequent Times of Travel...')
-    print_filter_settings(city, month, day)
-    start_time = time.time()
-    
-    # display the most common month
-    popular_month = df['month'].mode()[0]
-    popular_month_count = df['month'].value_counts()
-    #print(popular_month_count.iloc[0])
-    
-    print("Most popular month: {}, with a count of {}.".format(popular_month, popular_month_count.iloc[0]))
-    
-    # display the most common day of week
-    popular_day = df['day'].mode()[0]
-    popular_day_count = df['day'].value_counts()
-    #print(popular_day)
-    
-    print("Most popular day: {}, with a count of {}.".format(popular_day, popular_day_count.iloc[0]))
-    
-    # display the most common start hour
-    popular_start_hour = df['hour'].mode()[0]
-    popular_start_hour_count = df['hour'].value_counts(sort = False)
-    #print(popular_start_hour_count)
-    
-    print("Most popular start hour: {}, with a count of {}.".format(popular_start_hour, popular_start_hour_count.iloc[0]))
-
-    print("\nThis took %s seconds." % (time.time() - start_time))
-    
-    # Plot value counts, if desired.
-    print("Would you like to see a plot showing the trip start hour counts?")
-    show_plot = input("Type \'yes\' to get it or anything else to continue with next stats function.")
-    
-    if show_plot.lower() == 'yes':
-        popular_start_hour_count.sort_index().plot(kind='bar', color='skyblue')
-        plt.xlabel('Start Hour')
-        plt.ylabel('Count')
-        plt.title('Value Counts of bike trip start hours \nwith filter: city: {}, month: {}, day: {}.'.format(city, month, day))
+    chars = timestamp_chars(series, 19)
+    if chars is not None:
+        separators_ok = (chars[:, [4, 7, 10, 13, 16]] == np.frombuffer(b'-- ::', dtype=np.uint8)).all()
         
-        plot_file_name = "start_hours_" + city + ".png"
-        plt.savefig(plot_file_name)
-        full_path = os.path.abspath(plot_file_name)
-        print("Plot stored locally: " + full_path)
+        # digits of year, month, day, hour, minute and second; non-digits wrap around to values > 9.
+        digits = chars[:, [0, 1, 2, 3, 5, 6, 8, 9, 11, 12, 14, 15, 17, 18]] - np.uint8(ord('0'))
+        digits_ok = (digits <= 9).all()
         
-        plt.show()
+        if separators_ok and digits_ok:
+            digits = digits.astype(np.int32)
+            year = digits[:, 0] * 1000 + digits[:, 1] * 100 + digits[:, 2] * 10 + digits[:, 3]
+            month = digits[:, 4] * 10 + digits[:, 5]
+            day = digits[:, 6] * 10 + digits[:, 7]
+            hour = digits[:, 8] * 10 + digits[:, 9]
+            minute = digits[:, 10] * 10 + digits[:, 11]
+            second = digits[:, 12] * 10 + digits[:, 13]
+            
+            leap_day = (month == 2) & (year % 4 == 0) & ((year % 100 != 0) | (year % 400 == 0))
+            valid = ((month >= 1) & (day >= 1) & (day <= DAYS_IN_MONTH[np.minimum(month, 13)] + leap_day)
+                     & (hour <= 23) & (minute <= 59) & (second <= 59))
+            
+            # days since 1970-01-01 of the (proleptic gregorian) date, see
+            # http://howardhinnant.github.io/date_algorithms.html#days_from_civil
+            year = year - (month <= 2)
+            era = year // 400
+            year_of_era = year - era * 400
+            day_of_year = (153 * (month + np.where(month > 2, -3, 9)) + 2) // 5 + day - 1
+            day_of_era = year_of_era * 365 + year_of_era // 4 - year_of_era // 100 + day_of_year
+            days = era.astype(np.int64) * 146097 + day_of_era - 719468
+            
+            seconds = days * 86400 + hour * 3600 + minute * 60 + second
+            return np.where(valid, seconds, np.iinfo(np.int64).min).view('M8[s]')
     
-    print_line()
+    # strptime accepts leap seconds (second 60), which are not valid in the datasets either.
+    timestamps = pd.to_datetime(series, errors='coerce', format='%Y-%m-%d %H:%M:%S').to_numpy().astype('M8[s]')
+    timestamps[series.astype(str).str.slice(17, 19).gt('59').to_numpy()] = np.datetime64('NaT')
+    return timestamps
 
 
-def station_stats(df, city, month, day):
-    """Displays statistics on the most popular stations and trip.
-        This function calculates the most frequently occuring start end end stations, as well as the most
-        popular start/end station combination based on the filters chosen and 
-        offers a plot of the most popular start/end station combination.
+def time_fields(timestamps):
+    """
+        Derive month, weekday and hour from timestamps with integer arithmetic on the epoch seconds.
         
         Args:
-        (dataframe) df - dataframe holding the bike trip data based on the below filters.
-        (str) city - name of the city to analyze
-        (str) month - name of the month to filter by, or "all" to apply no month filter
-        (str) day - name of the day of week to filter by, or "all" to apply no day filter
+            (ndarray) timestamps - datetime64[s] values as returned by parse_timestamps().
         
-    Returns:
-        NONE
+        Returns:
+            (Categorical) month (MONTH_TYPE), (Categorical) weekday (DAY_TYPE), (ndarray) hour (HOUR_TYPE, -1 for NaT).
     """
-
-    print('\nCalculating The Most Popular Stations and Trip...')
-    print_filter_settings(city, month, day)
-    start_time = time.time()
-
-    # display most commonly used start station
-    popular_start_station = df['Start Station'].mode()[0]
-    popular_start_station_count = df['Start Station'].value_counts()
-    #print(popular_start_station_count)
+    missing = np.isnat(timestamps)
+    seconds = timestamps.view(np.int64)
     
-    print("Most popular start station: {}, with a count of {}.".format(popular_start_station, popular_start_station_count.iloc[0]))
-
-    # display most commonly used end station
-    popular_end_station = df['End Station'].mode()[0]
-    popular_end_station_count = df['End Station'].value_counts()
-    #print(popular_start_station_count)
+    # 1970-01-01 was a thursday (weekday 3, monday is 0).
+    weekday = np.where(missing, -1, (seconds // 86400 + 3) % 7)
+    hour = np.where(missing, -1, (seconds % 86400) // 3600).astype(HOUR_TYPE)
+    month = np.where(missing, -1, timestamps.astype('M8[M]').view(np.int64) % 12)
     
-    print("Most popular end station: {}, with a count of {}.".format(popular_end_station, popular_end_station_count.iloc[0]))
+    return (pd.Categorical.from_codes(month, dtype=MONTH_TYPE),
+            pd.Categorical.from_codes(weekday, dtype=DAY_TYPE),
+            hour)
 
-    # display most frequent combination of start station and end station trip
-    popular_start_end_combi = df['StationsCombined'].mode()[0]
-    popular_start_end_combi_count = df['StationsCombined'].value_counts()
-    #print(popular_start_station_count)
-    
-    print("\nThis took %s seconds." % (time.time() - start_time))
-    
-    # Plot value counts, if desired.
-    print("Would you like to see a plot showing the top 10 start/end station combination counts?")
-    show_plot = input("Type \'yes\' to get it or anything else to continue with next stats function.")
-    
-    if show_plot.lower() == 'yes':
-        no_of_bars = 10
-        # since the start/end station combinations are loo long for display as x tics, customize the x-tick labels with abbreviations
-        #labels = [f'Start/End {i}' for i in range(no_of_bars)]
+
+def prepare_data(df):
+    """
+        Convert the raw csv columns to their final types and add the derived columns
+        used in the stats functions:
+        * month (categorical)
+        * day (categorical)
+        * hour (int8)
+        Start/end station combinations are not stored as column, see route_ids().
         
-        popular_start_end_combi_count.head(no_of_bars).sort_index().plot(kind='bar', color='skyblue')
-        plt.xlabel('Start/End Station')
-        plt.ylabel('Count')
-        plt.xticks(fontsize=8, rotation=45)
-        #plt.xticks(ticks=np.arange(no_of_bars, 1), labels=labels)
-        plt.title('Value Counts of start/end station combinations \nwith filter: city: {}, month: {}, day: {}.'.format(city, month, day))
+        Args:
+            (df) df - dataframe as read from the city csv file (with city_schema() applied).
         
-        plot_file_name = "start_end_stations_count_" + city + ".png"
-        plt.savefig(plot_file_name)
-        full_path = os.path.abspath(plot_file_name)
-        print("Plot stored locally: " + full_path)
+        Returns:
+            df - the same dataframe with converted and added columns.
+    """
+    # convert Start Time and End Time columns to datetime (seconds since epoch).
+    with trace_span('parse_timestamps', rows=len(df)):
+        start_times = parse_timestamps(df['Start Time'])
+        df['Start Time'] = start_times
+        df['End Time'] = parse_timestamps(df['End Time'])
+    
+    with trace_span('derived_columns', rows=len(df)):
+        # For later usage in the stats functions:
+        # - extract month, day of week and hour from the Start Time column and make them
+        #   columns on their own.
+        df['month'], df['day'], df['hour'] = time_fields(start_times)
         
-        plt.show()
-
-    print_line()
+        # station, user type and gender names repeat a lot: store them as categoricals
+        # (in case the schema applied when reading did not do so already).
+        for col in CATEGORY_COLUMNS:
+            if col in df.columns:
+                df[col] = df[col].astype('category')
+    
+    return df
 
 
-def trip_duration_stats(df, city, month, day):
-    """Displays statistics on the total and average trip duration.
-    
-    Args:
-        (dataframe) df - dataframe holding the bike trip data based on the below filters.
-        (str) city - name of the city to analyze
-        (str) month - name of the month to filter by, or "all" to apply no month filter
-        (str) day - name of the day of week to filter by, or "all" to apply no day filter
+def route_ids(df):
+    """
+        Calculate an integer id for the start/end station combination (route) of each trip,
+        from the categorical codes of the 'Start Station' and 'End Station' columns:
+            route id = start station code * number of end stations + end station code
         
-        This function calculates the overall duration of all trips as well as the average
-        trip duration.
+        Args:
+            (df) df - dataframe holding the prepared trip data.
         
-    Returns:
-        NONE
+        Returns:
+            (ndarray) int64 route ids, -1 for trips with unknown start or end station.
     """
-
-    print('\nCalculating Trip Duration...')
-    print_filter_settings(city, month, day)
-    start_time = time.time()
-
-    # display total travel time
-    print("Total travel time: {}.".format(df['Trip Duration'].sum()))
+    start_codes = df['Start Station'].cat.codes.to_numpy().astype(np.int64)
+    end_codes = df['End Station'].cat.codes.to_numpy().astype(np.int64)
+    no_of_end_stations = len(df['End Station'].cat.categories)
     
-    # display mean travel time
-    print("Average travel time: {}.".format(df['Trip Duration'].mean()))
-
-    print("\nThis took %s seconds." % (time.time() - start_time))
-    print_line()
+    valid = (start_codes >= 0) & (end_codes >= 0)
+    return np.where(valid, start_codes * no_of_end_stations + end_codes, -1)
 
 
-def user_stats(df, city, month, day):
-    """Displays statistics on bikeshare users.
-        This function displays user types and some birth year statistics.
-        A plot with the most frequently occuring birth years can be generated, if required.
-    
-     Args:
-        (dataframe) df - dataframe holding the bike trip data based on the below filters.
-        (str) city - name of the city to analyze
-        (str) month - name of the month to filter by, or "all" to apply no month filter
-        (str) day - name of the day of week to filter by, or "all" to apply no day filter
+def cache_dir(csv_path):
+    """
+        Name of the cache directory belonging to a city csv file.
         
-    Returns:
-        NONE
+        Args:
+            (str) csv_path - path of the city csv file.
+        
+        Returns:
+            (str) path of the cache directory, e.g. 'chicago_cache' for 'chicago.csv'.
     """
+    return os.path.splitext(csv_path)[0] + CACHE_SUFFIX
 
-    print('\nCalculating User Stats...')
-    print_filter_settings(city, month, day)
-    start_time = time.time()
 
-    # Display counts of user types and the corresponding percentages
-    user_types = df['User Type'].value_counts(dropna=False)
-    user_types_percentage = df['User Type'].value_counts(normalize=True, dropna=False) * 100
-    combined_uytpe = pd.concat([user_types, user_types_percentage], axis=1)
+def file_hash(path, prefix_size=None):
+    """
+        Calculate the sha1 hash of a file, reading it in blocks.
+        
+        Args:
+            (str) path - path of the file.
+            (int) prefix_size - also hash the first prefix_size bytes (in the same pass).
+        
+        Returns:
+            (str) hex digest of the file content,
+            or (tuple) hex digests of the prefix and of the file content, if prefix_size is given.
+    """
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        if prefix_size is not None:
+            sha1.update(f.read(prefix_size))
+            prefix_sha1 = sha1.hexdigest()
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha1.update(block)
+    if prefix_size is not None:
+        return prefix_sha1, sha1.hexdigest()
+    return sha1.hexdigest()
 
-    # Iterate through the dataframe and print all items.
-    print("User type statistics:")
-    for index, row in combined_uytpe.iterrows():
-        print("User type: {}, Count: {}, Percentage: {}%".format(index, row['count'], round(row['proportion'], 2)))
 
-    # Display counts of gender
-    if 'Gender' in df.columns:
-        gender_counts = df['Gender'].value_counts(dropna=False)
-        gender_percentage = df['Gender'].value_counts(normalize=True, dropna=False) * 100
-        combined_gender = pd.concat([gender_counts, gender_percentage], axis=1)
+def cache_state(meta):
+    """
+        Identify the content of a cache, to check whether data kept in memory (frame cache,
+        station index) is still up to date: the hash of the csv file and the number of
+        incremental updates (see append_to_cache()).
         
-        # iterate through series and print all items.
-        print("\nGender statistics:")
-        for index, row in combined_gender.iterrows():
-            print("Gender: {}, Count: {}, Percentage: {}%".format(index, row['count'], round(row['proportion'], 2)))
-    else:
-        print("No gender info in dataset for {}.".format(city))
+        Args:
+            (dict) meta - cache meta data as returned by read_cache_meta().
+        
+        Returns:
+            (tuple) sha1, generation.
+    """
+    return meta['sha1'], meta.get('generation', 0)
 
-    
-    # Display earliest, most recent, and most common year of birth.
-    print("\nBirth year statatistics:")
-    if 'Birth Year' in df.columns:
-        min_birth_year = int(df['Birth Year'].min())
-        max_birth_year = int(df['Birth Year'].max())
+
+def read_cache_meta(csv_path):
+    """
+        Read the meta data of the cache of a city csv file.
         
-        print("Min birth year is: {}".format(min_birth_year))
-        print("Max birth year is: {}".format(max_birth_year))
+        Args:
+            (str) csv_path - path of the city csv file.
         
-        popular_birth_year = df['Birth Year'].mode()[0]
-        popular_birth_year_count = df['Birth Year'].value_counts()
-        #print(popular_start_station_count)
+        Returns:
+            (dict) meta data, or None if there is no (readable) cache.
+    """
+    meta_file = os.path.join(cache_dir(csv_path), 'meta.json')
+    try:
+        with open(meta_file) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_cache_meta(csv_path, meta):
+    """
+        Write the meta data of the cache of a city csv file.
+        
+        Args:
+            (str) csv_path - path of the city csv file.
+            (dict) meta - meta data to store.
+        
+        Returns: NONE
+    """
+    replace_file(os.path.join(cache_dir(csv_path), 'meta.json'), lambda f: json.dump(meta, f, indent=1), 'w')
+
+
+def remove_cache_meta(csv_path):
+    """
+        Invalidate the cache of a city csv file by removing its meta data, before its files are rewritten.
+        The meta data is written again when all files are complete, so an interrupted update
+        leaves a cache without meta data, which is rebuilt on the next load.
+        
+        Args:
+            (str) csv_path - path of the city csv file.
+        
+        Returns: NONE
+    """
+    try:
+        os.remove(os.path.join(cache_dir(csv_path), 'meta.json'))
+    except FileNotFoundError:
+        pass
+
+
+def replace_file(path, write, mode='wb'):
+    """
+        Write a cache file atomically: the content is written to a temporary file in the same
+        directory, which then replaces the file (os.replace). Concurrent readers see either the old
+        or the new file, never a half-written one.
+        
+        Args:
+            (str) path - path of the file.
+            (function) write - function writing the content to the open file object.
+            (str) mode - mode to open the temporary file with.
+        
+        Returns: NONE
+    """
+    temp_path = "{}.{}.tmp".format(path, os.getpid())
+    try:
+        with open(temp_path, mode) as f:
+            write(f)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def cache_is_valid(csv_path, meta):
+    """
+        Check whether the cache still matches its source csv file.
+        The cache is invalidated when the mtime, size or hash of the csv file change.
+        The hash is only calculated, when mtime or size differ from the cached values,
+        so that a simple 'touch' of the csv file does not force a reload.
+        
+        Args:
+            (str) csv_path - path of the city csv file.
+            (dict) meta - cache meta data as returned by read_cache_meta().
+        
+        Returns:
+            (bool) True, if the cache can be used.
+    """
+    if meta is None or meta.get('version') != CACHE_VERSION:
+        return False
+    
+    stat = os.stat(csv_path)
+    if meta['size'] != stat.st_size:
+        return False
+    if meta['mtime'] != stat.st_mtime:
+        if meta['sha1'] != file_hash(csv_path):
+            return False
+        # same content, just touched: remember the new mtime.
+        meta['mtime'] = stat.st_mtime
+        if CACHE_WRITABLE:
+            write_cache_meta(csv_path, meta)
+    
+    return True
+
+
+def cache_file(csv_path, name):
+    """
+        Path of a data file in the cache directory.
+        The extension depends on the cache format (feather if pyarrow is available, pickle otherwise).
+        
+        Args:
+            (str) csv_path - path of the city csv file.
+            (str) name - name of the data file without extension.
+        
+        Returns:
+            (str) path of the data file.
+    """
+    extension = '.feather' if feather is not None else '.pkl'
+    return os.path.join(cache_dir(csv_path), name + extension)
+
+
+def write_frame(df, path):
+    """
+        Store a dataframe in the columnar cache format (atomically, see replace_file()).
+        
+        Args:
+            (df) df - dataframe to store, with default RangeIndex.
+            (str) path - file name as returned by cache_file().
+        
+        Returns: NONE
+    """
+    if feather is not None:
+        replace_file(path, df.to_feather)
+    else:
+        replace_file(path, df.to_pickle)
+
+
+def read_frame(path, start=None, stop=None):
+    """
+        Load a dataframe from the columnar cache. Feather files are memory-mapped,
+        so only the rows in the range start:stop are actually read and converted.
+        
+        Args:
+            (str) path - file name as returned by cache_file().
+            (int) start - first row to load, None for the beginning of the file.
+            (int) stop - row to stop loading at, None for the end of the file.
+        
+        Returns:
+            df - the stored dataframe (or the requested rows of it).
+    """
+    if feather is not None:
+        table = feather.read_table(path, memory_map=True)
+        if start is not None or stop is not None:
+            start = start or 0
+            stop = table.num_rows if stop is None else stop
+            table = table.slice(start, stop - start)
+        return table.to_pandas()
+    return pd.read_pickle(path).iloc[start:stop]
+
+
+def month_number(month):
+    """
+        Map a month name from the MONTH dictionnary to its number.
+        
+        Args:
+            (str) month - name of the month, or "all".
+        
+        Returns:
+            (int) number of the month (1 - 12), None for "all".
+    """
+    if month == 'all':
+        return None
+    return [key for key, value in MONTH.items() if value == month][0]
+
+
+def day_number(day):
+    """
+        Map a weekday name from the WEEKDAYS dictionnary to its number (0 - monday).
+        
+        Args:
+            (str) day - name of the weekday, or "all".
+        
+        Returns:
+            (int) number of the weekday (0 - 6), None for "all".
+    """
+    if day == 'all':
+        return None
+    return [key for key, value in WEEKDAYS.items() if value == day][0]
+
+
+def filter_data(df, month, day):
+    """
+        Apply the month and day filters to a loaded dataframe.
+        
+        Args:
+            (df) df - dataframe holding the prepared trip data.
+            (str) month - name of the month to filter by, or "all" to apply no month filter
+            (str) day - name of the day of week to filter by, or "all" to apply no day filter
+        
+        Returns:
+            df - the filtered dataframe.
+    """
+    if day != 'all':
+        df = df[df['day'] == day]
+    
+    if month != 'all':
+        df = df[df['month'] == month]
+    
+    return df
+
+
+def write_cache(df, csv_path, meta):
+    """
+        Store the prepared data of a city in the cache, partitioned by month.
+        Within each month file, the rows are sorted by weekday. The row offsets of
+        each weekday are kept in the meta data, as an index for the day filter.
+        The marginal tables (see build_marginals(), build_duration_cube()), the station index (see build_station_index()),
+        the time-series rollups (see build_rollups()) and the column profile of each month (see build_profile())
+        are stored as well.
+        
+        Args:
+            (df) df - prepared dataframe holding all trips of the city.
+            (str) csv_path - path of the city csv file.
+            (dict) meta - meta data of the csv file (version, mtime, size, sha1).
+        
+        Returns: NONE
+    """
+    os.makedirs(cache_dir(csv_path), exist_ok=True)
+    # the meta data is written last, when all files are complete.
+    remove_cache_meta(csv_path)
+    
+    # month 0 and weekday 7 collect the rows without start time.
+    month_no = df['month'].cat.codes.to_numpy().astype(int) + 1
+    weekday_no = np.where(df['day'].cat.codes.to_numpy() < 0, 7, df['day'].cat.codes.to_numpy())
+    
+    partitions = {}
+    profiles = {}
+    cache_order = []
+    for month in np.unique(month_no):
+        rows = np.flatnonzero(month_no == month)
+        rows = rows[np.argsort(weekday_no[rows], kind='stable')]
+        day_counts = np.bincount(weekday_no[rows], minlength=8)
+        
+        # the original row number is kept in column 'index'.
+        partition = df.iloc[rows]
+        write_frame(partition.reset_index(), cache_file(csv_path, 'month_{:02d}'.format(month)))
+        partitions[str(month)] = [0] + np.cumsum(day_counts).tolist()
+        profiles[str(month)] = build_profile(partition)
+        cache_order.append(rows)
+    
+    meta['partitions'] = partitions
+    meta['categories'] = {col: df[col].cat.categories.tolist() for col in CATEGORY_COLUMNS if col in df.columns}
+    meta.setdefault('generation', 0)
+    meta.setdefault('ingested', [])
+    
+    marginals = build_marginals(df)
+    for name, table in marginals.items():
+        write_frame(table, cache_file(csv_path, 'marginal_' + name))
+    write_frame(build_duration_cube(df), cache_file(csv_path, 'duration_cube'))
+    meta['marginals'] = list(marginals)
+    
+    # the row positions of the station index refer to the rows in cache order.
+    write_station_index(build_station_index(df.iloc[np.concatenate(cache_order)]), csv_path)
+    meta['station_index'] = True
+    write_rollups(build_rollups(df), csv_path)
+    meta['rollups'] = True
+    write_profiles(profiles, csv_path)
+    meta['profiles'] = True
+    write_cache_meta(csv_path, meta)
+
+
+def partition_ranges(meta, month, day):
+    """
+        Determine the row ranges of the cache partitions matching the month and day filters.
+        
+        Args:
+            (dict) meta - cache meta data as returned by read_cache_meta().
+            (str) month - name of the month to filter by, or "all" to apply no month filter
+            (str) day - name of the day of week to filter by, or "all" to apply no day filter
+        
+        Returns:
+            (list) of (month number, first row, row to stop at) tuples, rows counted within the month file.
+    """
+    partitions = meta['partitions']
+    if month == 'all':
+        months = sorted(partitions, key=int)
+        if day != 'all':
+            # rows without start time can not match a weekday.
+            months = [m for m in months if m != '0']
+    else:
+        months = [m for m in [str(month_number(month))] if m in partitions]
+    
+    ranges = []
+    for m in months:
+        offsets = partitions[m]
+        if day == 'all':
+            ranges.append((int(m), 0, offsets[-1]))
+        else:
+            ranges.append((int(m), offsets[day_number(day)], offsets[day_number(day) + 1]))
+    
+    return ranges
+
+
+def read_cache(csv_path, meta, month, day):
+    """
+        Load the cached rows of a city matching the month and day filters.
+        Only the month files needed are opened, and only the rows of the selected weekday are read.
+        
+        Args:
+            (str) csv_path - path of the city csv file.
+            (dict) meta - cache meta data as returned by read_cache_meta().
+            (str) month - name of the month to filter by, or "all" to apply no month filter
+            (str) day - name of the day of week to filter by, or "all" to apply no day filter
+        
+        Returns:
+            df - Pandas DataFrame with the matching trips, ordered by month and weekday.
+                 The index holds the original row number.
+    """
+    # month files written by earlier incremental updates lack the newer categories: see unify_categories().
+    frames = [unify_categories(read_frame(cache_file(csv_path, 'month_{:02d}'.format(m)), start, stop), meta['categories'])
+              for m, start, stop in partition_ranges(meta, month, day)]
+    
+    if not frames:
+        # no rows for the month at all: read an empty slice to get the columns and types.
+        first = sorted(meta['partitions'], key=int)[0]
+        frames.append(read_frame(cache_file(csv_path, 'month_{:02d}'.format(int(first))), 0, 0))
+    
+    df = pd.concat(frames) if len(frames) > 1 else frames[0]
+    return df.set_index('index').rename_axis(None)
+
+
+def slice_cached_frame(df, meta, month, day):
+    """
+        Apply the month and day filters to a complete city dataframe, as read by read_cache(meta, 'all', 'all').
+        Since that dataframe is ordered by month and weekday, the filters are just row slices.
+        
+        Args:
+            (df) df - complete city dataframe in cache order.
+            (dict) meta - cache meta data the dataframe was read with.
+            (str) month - name of the month to filter by, or "all" to apply no month filter
+            (str) day - name of the day of week to filter by, or "all" to apply no day filter
+        
+        Returns:
+            df - the matching rows of the dataframe.
+    """
+    # position of the first row of each month within the complete dataframe.
+    month_start = {}
+    position = 0
+    for m in sorted(meta['partitions'], key=int):
+        month_start[int(m)] = position
+        position += meta['partitions'][m][-1]
+    
+    slices = [df.iloc[month_start[m] + start:month_start[m] + stop]
+              for m, start, stop in partition_ranges(meta, month, day)]
+    
+    if not slices:
+        return df.iloc[0:0]
+    return pd.concat(slices) if len(slices) > 1 else slices[0]
+
+
+def profile_value(value):
+    """
+        Convert a min/max value of a column profile to a plain python type, as stored in the cache:
+        timestamps to 'YYYY-MM-DD HH:MM:SS' strings (which sort like the timestamps), numpy scalars to int/float.
+        
+        Args:
+            value - value to convert.
+        
+        Returns:
+            the converted value.
+    """
+    if isinstance(value, (pd.Timestamp, np.datetime64)):
+        return str(pd.Timestamp(value))
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def hash_sketch(hashes):
+    """
+        Select the PROFILE_SKETCH_SIZE smallest distinct values of an array of hashes.
+        Instead of sorting all hashes, the smallest candidates are selected with np.partition (O(n)),
+        taking more candidates only while duplicates leave too few distinct values among them.
+        
+        Args:
+            (ndarray) hashes - uint64 hashes of the values of a column.
+        
+        Returns:
+            (ndarray) sorted smallest distinct hashes.
+    """
+    size = PROFILE_SKETCH_SIZE
+    while size < len(hashes):
+        candidates = np.unique(np.partition(hashes, size)[:size + 1])
+        if len(candidates) >= PROFILE_SKETCH_SIZE:
+            return candidates[:PROFILE_SKETCH_SIZE]
+        size *= 4
+    return np.unique(hashes)[:PROFILE_SKETCH_SIZE]
+
+
+def build_profile(df):
+    """
+        Profile all columns of the trip data in one pass: per column the number of nulls, min and max
+        (of the values in use, for categoricals) and a distinct value sketch (see PROFILE_SKETCH_SIZE),
+        plus the data quality checks: trips ending before they start and negative trip durations.
+        Invalid (unparseable or out of range) timestamps are stored as NaT, so they count as nulls of their column,
+        and the hour of a trip without valid start time (-1) as null of the hour column.
+        Profiles are mergeable, see merge_profiles().
+        
+        Args:
+            (df) df - dataframe holding the prepared trip data.
+        
+        Returns:
+            (dict) rows, end_before_start, negative_duration and columns (column -> dict with
+            dtype, nulls, min, max, sketch - the sorted smallest hashes of the distinct values - and
+            for ordered categoricals order, the categories).
+    """
+    with trace_span('build_profile', rows=len(df)):
+        profile = {'rows': len(df), 'end_before_start': 0, 'negative_duration': 0, 'columns': {}}
+        for col in df.columns:
+            series = df[col]
+            valid = series.notna()
+            if pd.api.types.is_integer_dtype(series.dtype):
+                # negative values of integer columns mark missing values, see frequency_table().
+                valid &= (series >= 0).fillna(False)
+            entry = {'dtype': str(series.dtype), 'nulls': int((~valid).sum()), 'min': None, 'max': None}
+            if isinstance(series.dtype, pd.CategoricalDtype):
+                # the categories in use, from the codes: no need to look at the values of each row.
+                codes = np.unique(series.cat.codes.to_numpy())
+                values = pd.Series(series.cat.categories[codes[codes >= 0]])
+                if series.cat.ordered:
+                    # kept to merge min/max in the order of the categories, see merge_profiles().
+                    entry['order'] = series.cat.categories.tolist()
+                if len(values) > 0:
+                    entry['min'], entry['max'] = (values.iloc[0], values.iloc[-1]) if series.cat.ordered else (values.min(), values.max())
+            else:
+                values = series[valid]
+                if len(values) > 0:
+                    entry['min'], entry['max'] = values.min(), values.max()
+            entry['min'], entry['max'] = profile_value(entry['min']), profile_value(entry['max'])
+            entry['sketch'] = hash_sketch(pd.util.hash_pandas_object(values, index=False).to_numpy())
+            profile['columns'][col] = entry
+        
+        if 'Start Time' in df.columns and 'End Time' in df.columns:
+            profile['end_before_start'] = int((df['End Time'] < df['Start Time']).sum())
+        if 'Trip Duration' in df.columns:
+            profile['negative_duration'] = int((df['Trip Duration'] < 0).sum())
+    
+    return profile
+
+
+def merge_profiles(profile_a, profile_b):
+    """
+        Merge the column profiles of two sets of trips (see build_profile()).
+        
+        Args:
+            (dict) profile_a, profile_b - profiles to merge.
+        
+        Returns:
+            (dict) profile of all trips.
+    """
+    merged = {key: profile_a[key] + profile_b[key] for key in ['rows', 'end_before_start', 'negative_duration']}
+    merged['columns'] = {}
+    for col in list(profile_a['columns']) + [col for col in profile_b['columns'] if col not in profile_a['columns']]:
+        entries = [profile['columns'][col] for profile in (profile_a, profile_b) if col in profile['columns']]
+        minimums = [entry['min'] for entry in entries if entry['min'] is not None]
+        maximums = [entry['max'] for entry in entries if entry['max'] is not None]
+        key = entries[0]['order'].index if 'order' in entries[0] else None
+        merged['columns'][col] = {'dtype': entries[0]['dtype'],
+                                  'nulls': sum(entry['nulls'] for entry in entries),
+                                  'min': min(minimums, key=key) if minimums else None,
+                                  'max': max(maximums, key=key) if maximums else None,
+                                  'sketch': np.unique(np.concatenate([entry['sketch'] for entry in entries]))[:PROFILE_SKETCH_SIZE]}
+        if key is not None:
+            merged['columns'][col]['order'] = entries[0]['order']
+    return merged
+
+
+def distinct_estimate(sketch, count):
+    """
+        Estimate the number of distinct values from a k minimum values sketch (see build_profile()).
+        
+        Args:
+            (ndarray) sketch - sorted smallest uint64 hashes of the distinct values.
+            (int) count - number of (non-null) values, the upper bound of the estimate.
+        
+        Returns:
+            (int) number of distinct values, exact if the sketch is not full.
+    """
+    if len(sketch) < PROFILE_SKETCH_SIZE:
+        return len(sketch)
+    return min(int(round((PROFILE_SKETCH_SIZE - 1) * 2.0**64 / (float(sketch[-1]) + 1))), count)
+
+
+def write_profiles(profiles, csv_path):
+    """
+        Store the column profiles of the month partitions in the cache directory of a city:
+        the sketches in profiles.npz, everything else in profiles.json.
+        
+        Args:
+            (dict) profiles - month number (str) -> profile as returned by build_profile().
+            (str) csv_path - path of the city csv file.
+        
+        Returns: NONE
+    """
+    sketches = {}
+    scalars = {}
+    for month, profile in profiles.items():
+        scalars[month] = dict(profile, columns={col: {key: value for key, value in entry.items() if key != 'sketch'}
+                                                for col, entry in profile['columns'].items()})
+        for col, entry in profile['columns'].items():
+            sketches['{}|{}'.format(month, col)] = entry['sketch']
+    replace_file(os.path.join(cache_dir(csv_path), 'profiles.npz'), lambda f: np.savez(f, **sketches))
+    replace_file(os.path.join(cache_dir(csv_path), 'profiles.json'), lambda f: json.dump(scalars, f, indent=1), 'w')
+
+
+def read_profiles(csv_path):
+    """
+        Load the column profiles of the month partitions stored in the cache directory of a city.
+        
+        Args:
+            (str) csv_path - path of the city csv file.
+        
+        Returns:
+            (dict) month number (str) -> profile, see build_profile().
+    """
+    with open(os.path.join(cache_dir(csv_path), 'profiles.json')) as f:
+        profiles = json.load(f)
+    with np.load(os.path.join(cache_dir(csv_path), 'profiles.npz')) as data:
+        for month, profile in profiles.items():
+            for col, entry in profile['columns'].items():
+                entry['sketch'] = data['{}|{}'.format(month, col)]
+    return profiles
+
+
+def read_city_profile(city, month):
+    """
+        Get the column profile of the cached data of a city for a month filter,
+        merged from the stored profiles of the month partitions.
+        
+        Args:
+            (str) city - name of the city
+            (str) month - name of the month to filter by, or "all" to apply no month filter
+        
+        Returns:
+            (dict) profile (see build_profile()), None if there is no valid cache for the city.
+    """
+    if city not in CITY_DATA:
+        return None
+    csv_path = CITY_DATA[city]
+    meta = read_cache_meta(csv_path)
+    if not os.path.exists(csv_path) or not cache_is_valid(csv_path, meta) or not meta.get('profiles'):
+        return None
+    
+    try:
+        profiles = read_profiles(csv_path)
+    except CACHE_READ_ERRORS:
+        return None
+    profile = None
+    for m, start, stop in partition_ranges(meta, month, 'all'):
+        profile = profiles[str(m)] if profile is None else merge_profiles(profile, profiles[str(m)])
+    return profile
+
+
+def unify_categories(df, categories):
+    """
+        Give the categorical columns of a dataframe the categories of the complete data,
+        so that dataframes stored at different times can be concatenated.
+        
+        Args:
+            (df) df - dataframe with categorical columns.
+            (dict) categories - column -> list of categories, as kept in the cache meta data.
+        
+        Returns:
+            df - the dataframe, with the categories set (only columns with other categories are converted).
+    """
+    for col, values in categories.items():
+        if col in df.columns and len(df[col].cat.categories) != len(values):
+            df[col] = df[col].cat.set_categories(values)
+    return df
+
+
+def concat_trips(frames, renumber=True):
+    """
+        Concatenate prepared trip dataframes (e.g. of several csv files of a city).
+        The categorical columns get the union of the categories (sorted, like pd.read_csv()),
+        the rows are numbered through.
+        
+        Args:
+            (list) frames - prepared dataframes, see prepare_data().
+            (bool) renumber - number the rows through, otherwise they keep their row ids
+                              (e.g. the original row numbers of the cities).
+        
+        Returns:
+            df - the concatenated dataframe.
+    """
+    if len(frames) == 1:
+        return frames[0]
+    
+    categories = {}
+    for col in CATEGORY_COLUMNS:
+        if all(col in frame.columns for frame in frames):
+            categories[col] = pd.api.types.union_categoricals([frame[col] for frame in frames],
+                                                              sort_categories=True).categories.tolist()
+    return pd.concat([unify_categories(frame, categories) for frame in frames], ignore_index=renumber)
+
+
+def read_appended_rows(csv_path, meta):
+    """
+        Read the rows appended to a city csv file since its cache was written, if the file only grew:
+        its first meta['size'] bytes are unchanged (same hash) and end with a complete line.
+        
+        Args:
+            (str) csv_path - path of the city csv file.
+            (dict) meta - cache meta data as returned by read_cache_meta().
+        
+        Returns:
+            (tuple) the raw appended rows (df, with the schema of the cache applied) and the new hash of the file,
+            None if the file did not just grow (or did not change at all).
+    """
+    if meta is None or meta.get('version') != CACHE_VERSION or os.path.getsize(csv_path) <= meta['size']:
+        return None
+    
+    with open(csv_path, 'rb') as f:
+        f.seek(meta['size'] - 1)
+        if f.read(1) != b'\n':
+            return None
+    prefix_sha1, sha1 = file_hash(csv_path, meta['size'])
+    if prefix_sha1 != meta['sha1']:
+        return None
+    
+    columns = pd.read_csv(csv_path, nrows=0).columns
+    with open(csv_path, 'rb') as f:
+        f.seek(meta['size'])
+        df = pd.read_csv(f, header=None, names=columns, dtype=meta['schema'])
+    return df, sha1
+
+
+def merge_station_index(index, delta_index, positions, delta_positions):
+    """
+        Merge the station index of new rows into the station index of the cached rows.
+        The destination counts are merged by station pair, the row lists by station:
+        within a station, the cached rows come first, then the new rows.
+        
+        Args:
+            (dict) index - station index of the cached rows, see build_station_index().
+            (dict) delta_index - station index of the new rows (row positions within the new rows).
+            (ndarray) positions - new row position of each cached row, by old row position.
+            (ndarray) delta_positions - row position of each new row, by position within the new rows.
+        
+        Returns:
+            (dict) the merged station index.
+    """
+    stations = pd.Index(index['stations']).union(pd.Index(delta_index['stations']))
+    no_of_stations = len(stations)
+    merged = {'stations': stations.to_numpy().astype(str)}
+    
+    # station numbers change, as new stations are sorted in.
+    mappings = [stations.get_indexer(index['stations']), stations.get_indexer(delta_index['stations'])]
+    parts = [index, delta_index]
+    
+    # destination counts: (start, end) pairs of both parts, counted together.
+    pairs = [mapping[np.repeat(np.arange(len(mapping)), np.diff(part['indptr']))].astype(np.int64) * no_of_stations
+             + mapping[part['destinations']] for part, mapping in zip(parts, mappings)]
+    keys, inverse = np.unique(np.concatenate(pairs), return_inverse=True)
+    merged['indptr'] = np.searchsorted(keys // no_of_stations, np.arange(no_of_stations + 1))
+    merged['destinations'] = keys % no_of_stations
+    merged['trips'] = np.bincount(inverse, weights=np.concatenate([part['trips'] for part in parts]),
+                                  minlength=len(keys)).astype(np.int64)
+    
+    for key in ['departures', 'arrivals', 'hourly']:
+        merged[key] = np.zeros((no_of_stations,) + index[key].shape[1:], dtype=np.int64)
+        for part, mapping in zip(parts, mappings):
+            merged[key][mapping] += part[key]
+    
+    # row lists: sorted by station (-1 for unknown start station, sorted first), then row position.
+    # Both parts are usually sorted that way already, so the stable sort mostly just merges two runs.
+    rows = np.concatenate([positions[index['row_order']], delta_positions[delta_index['row_order']]])
+    row_stations = np.concatenate([np.concatenate([np.full(part['row_indptr'][0], -1), np.repeat(mapping, np.diff(part['row_indptr']))])
+                                   for part, mapping in zip(parts, mappings)])
+    order = np.argsort((row_stations + 1) * len(rows) + rows, kind='stable')
+    merged['row_order'] = rows[order]
+    merged['row_indptr'] = np.concatenate([[0], np.cumsum(merged['departures'])]) + \
+        int(index['row_indptr'][0] + delta_index['row_indptr'][0])
+    
+    return merged
+
+
+def append_to_cache(csv_path, meta, delta):
+    """
+        Merge new trips into the cache of a city, without reading the cached trips of other months:
+        * the month files of the months with new trips are rewritten, the new rows placed behind
+          the cached rows of the same weekday, and their column profiles are merged with the new rows
+        * the categories are extended by the new values (kept in the meta data, see unify_categories())
+        * the marginal tables and the duration cube are merged with the ones of the new rows
+        * the station index is merged with the index of the new rows
+        * the time-series rollups are merged with the rollups of the new rows
+        The meta data is updated (but not written, see write_cache_meta()).
+        
+        Args:
+            (str) csv_path - path of the city csv file.
+            (dict) meta - cache meta data as returned by read_cache_meta().
+            (df) delta - prepared dataframe holding the new trips, see prepare_data().
+        
+        Returns: NONE
+    """
+    # the cache is incomplete until the updated meta data is written.
+    remove_cache_meta(csv_path)
+    
+    # categories of the complete data: the cached ones, extended by the new values.
+    categories = {}
+    for col, values in meta['categories'].items():
+        new_values = delta[col].cat.categories.difference(values) if col in delta.columns else []
+        categories[col] = sorted(values + list(new_values)) if len(new_values) > 0 else values
+    delta = unify_categories(delta, categories)
+    
+    # slots of the cache order: month file (0-12), then weekday (0-6, 7 for no start time).
+    old_counts = np.zeros(13 * 8, dtype=np.int64)
+    for m, offsets in meta['partitions'].items():
+        old_counts[int(m) * 8:int(m) * 8 + 8] = np.diff(offsets)
+    month_no = delta['month'].cat.codes.to_numpy().astype(np.int64) + 1
+    weekday_no = np.where(delta['day'].cat.codes.to_numpy() < 0, 7, delta['day'].cat.codes.to_numpy()).astype(np.int64)
+    slots = month_no * 8 + weekday_no
+    delta_counts = np.bincount(slots, minlength=13 * 8)
+    new_counts = old_counts + delta_counts
+    
+    # new rows are numbered after the cached rows, then put in cache order.
+    delta = delta.set_axis(np.arange(len(delta)) + int(old_counts.sum()))
+    delta_order = np.argsort(slots, kind='stable')
+    delta = delta.iloc[delta_order]
+    slots = slots[delta_order]
+    
+    # new position of the cached rows and of the new rows in the complete data.
+    old_start = np.concatenate([[0], np.cumsum(old_counts)[:-1]])
+    new_start = np.concatenate([[0], np.cumsum(new_counts)[:-1]])
+    delta_start = np.concatenate([[0], np.cumsum(delta_counts)[:-1]])
+    old_slots = np.repeat(np.arange(13 * 8), old_counts)
+    positions = np.arange(len(old_slots)) - old_start[old_slots] + new_start[old_slots]
+    delta_positions = new_start[slots] + old_counts[slots] + np.arange(len(delta)) - delta_start[slots]
+    
+    # rewrite the month files with new rows.
+    profiles = read_profiles(csv_path)
+    for month in np.unique(slots // 8):
+        rows = delta[slots // 8 == month]
+        profile = build_profile(rows)
+        profiles[str(month)] = merge_profiles(profiles[str(month)], profile) if str(month) in profiles else profile
+        rows = rows.reset_index()
+        name = cache_file(csv_path, 'month_{:02d}'.format(month))
+        if str(month) in meta['partitions']:
+            cached = unify_categories(read_frame(name), categories)
+            rows = pd.concat([cached, rows], ignore_index=True)
+            weekdays = np.concatenate([np.repeat(np.arange(8), np.diff(meta['partitions'][str(month)])),
+                                       np.repeat(np.arange(8), delta_counts[month * 8:month * 8 + 8])])
+            rows = rows.iloc[np.argsort(weekdays, kind='stable')].reset_index(drop=True)
+        write_frame(rows, name)
+        meta['partitions'][str(month)] = [0] + np.cumsum(new_counts[month * 8:month * 8 + 8]).tolist()
+    write_profiles(profiles, csv_path)
+    
+    # merge the marginal tables and the duration cube: rows with the same dimension values are combined.
+    tables = dict(('marginal_' + name, table) for name, table in build_marginals(delta).items())
+    tables['duration_cube'] = build_duration_cube(delta)
+    for name, table in tables.items():
+        cached = unify_categories(read_frame(cache_file(csv_path, name)), categories)
+        write_frame(merge_marginals(cached, table), cache_file(csv_path, name))
+    
+    # merge the station index: the row positions of the new rows are counted within delta (cache order).
+    with np.load(os.path.join(cache_dir(csv_path), 'stations.npz')) as data:
+        index = {key: data[key] for key in data.files}
+    write_station_index(merge_station_index(index, build_station_index(delta), positions, delta_positions), csv_path)
+    
+    write_rollups(merge_rollups(read_rollups(csv_path), build_rollups(delta)), csv_path)
+    
+    meta['categories'] = categories
+    meta['nbytes'] += int(delta.memory_usage(deep=True).sum())
+    meta['generation'] = meta.get('generation', 0) + 1
+    frame_cache_evict(csv_path)
+
+
+def ingest_file(city, path):
+    """
+        Add the trips of another csv file (e.g. a new monthly export, with the columns of the city csv file)
+        to the cached data of a city. Only the new file is parsed, see append_to_cache().
+        The file is remembered in the cache meta data, so that its trips are kept
+        when the cache is rebuilt (e.g. after the city csv file changed).
+        
+        Args:
+            (str) city - name of the city.
+            (str) path - path of the csv file to ingest.
+        
+        Returns:
+            (int) number of trips added, 0 if the file was ingested before.
+    """
+    csv_path = CITY_DATA[city]
+    schema = city_schema(city)
+    # make sure the cache is up to date (and exists).
+    meta = update_cache(csv_path, schema)[0]
+    
+    sha1 = file_hash(path)
+    if any(entry['sha1'] == sha1 for entry in meta['ingested']):
+        return 0
+    
+    with trace_span('ingest_file', file=path):
+        delta = prepare_data(pd.read_csv(path, dtype=schema))
+        append_to_cache(csv_path, meta, delta)
+    meta['ingested'].append({'path': os.path.abspath(path), 'sha1': sha1, 'rows': len(delta)})
+    write_cache_meta(csv_path, meta)
+    return len(delta)
+
+
+def frame_cache_get(csv_path, meta):
+    """
+        Look up the complete dataframe of a city in the in-process frame cache.
+        
+        Args:
+            (str) csv_path - path of the city csv file.
+            (dict) meta - current cache meta data of the city.
+        
+        Returns:
+            df - the cached dataframe, or None if not cached (or cached for an older version of the csv file).
+    """
+    entry = FRAME_CACHE.get(csv_path)
+    if entry is not None and entry['state'] == cache_state(meta):
+        FRAME_CACHE.move_to_end(csv_path)
+        FRAME_CACHE_STATS['hits'] += 1
+        return entry['df']
+    
+    FRAME_CACHE_STATS['misses'] += 1
+    return None
+
+
+def frame_cache_put(csv_path, meta, df):
+    """
+        Store the complete dataframe of a city in the in-process frame cache.
+        The least recently used dataframes are evicted, until the cache fits into FRAME_CACHE_MAX_BYTES.
+        
+        Args:
+            (str) csv_path - path of the city csv file.
+            (dict) meta - current cache meta data of the city.
+            (df) df - complete city dataframe, as read by read_cache(meta, 'all', 'all').
+        
+        Returns: NONE
+    """
+    frame_cache_evict(csv_path)
+    FRAME_CACHE[csv_path] = {'df': df, 'state': cache_state(meta), 'bytes': meta['nbytes']}
+    FRAME_CACHE_STATS['bytes'] += meta['nbytes']
+    
+    while FRAME_CACHE_STATS['bytes'] > FRAME_CACHE_MAX_BYTES and len(FRAME_CACHE) > 1:
+        frame_cache_evict(next(iter(FRAME_CACHE)))
+
+
+def frame_cache_evict(csv_path):
+    """
+        Remove the dataframe of a city from the in-process frame cache, if it is cached.
+        
+        Args:
+            (str) csv_path - path of the city csv file.
+        
+        Returns: NONE
+    """
+    entry = FRAME_CACHE.pop(csv_path, None)
+    if entry is not None:
+        FRAME_CACHE_STATS['bytes'] -= entry['bytes']
+        FRAME_CACHE_STATS['evictions'] += 1
+
+
+def set_frame_cache_limit(max_bytes):
+    """
+        Change the memory limit of the in-process frame cache, evicting dataframes if required.
+        
+        Args:
+            (int) max_bytes - new limit in bytes, 0 disables the frame cache.
+        
+        Returns: NONE
+    """
+    global FRAME_CACHE_MAX_BYTES
+    FRAME_CACHE_MAX_BYTES = max_bytes
+    while FRAME_CACHE and FRAME_CACHE_STATS['bytes'] > FRAME_CACHE_MAX_BYTES:
+        frame_cache_evict(next(iter(FRAME_CACHE)))
+
+
+def init_worker(frame_cache_bytes, stream_file_size):
+    """
+        Initializer of the worker processes of batch_stats(): apply the settings of the batch run,
+        so that they do not depend on the way the processes are started.
+        
+        Args:
+            (int) frame_cache_bytes - memory limit of the frame cache, see set_frame_cache_limit().
+            (int) stream_file_size - size limit of the files loaded, see STREAM_FILE_SIZE.
+        
+        Returns: NONE
+    """
+    global STREAM_FILE_SIZE
+    set_frame_cache_limit(frame_cache_bytes)
+    STREAM_FILE_SIZE = stream_file_size
+
+
+def print_frame_cache_info():
+    """
+        Print the counters of the in-process frame cache (hits, misses, evictions and memory used).
+        
+        Args: NONE
+        
+        Returns: NONE
+    """
+    print("Frame cache: {} hits, {} misses, {} evictions.".format(FRAME_CACHE_STATS['hits'],
+                                                                FRAME_CACHE_STATS['misses'],
+                                                                FRAME_CACHE_STATS['evictions']))
+    print("Frame cache memory: {:.1f} MB of {:.1f} MB used by: {}.".format(FRAME_CACHE_STATS['bytes'] / 1024**2,
+                                                                          FRAME_CACHE_MAX_BYTES / 1024**2,
+                                                                          list(FRAME_CACHE.keys())))
+
+
+def read_city_data(csv_path, month='all', day='all', schema=None):
+    """
+        Load the prepared data of a city, filtered by month and day.
+        On first usage the csv file is parsed and stored in the columnar cache.
+        If the complete data of the city fits into the in-process frame cache, it is kept there
+        and later calls just slice it. Otherwise, only the matching rows are read from the columnar cache.
+        Both caches are used as long as the csv file did not change. Rows appended to the csv file
+        are parsed on their own and merged into the cache, see append_to_cache().
+        
+        Args:
+            (str) csv_path - path of the city csv file.
+            (str) month - name of the month to filter by, or "all" to apply no month filter
+            (str) day - name of the day of week to filter by, or "all" to apply no day filter
+            (dict) schema - column types to apply when reading the csv file, TRIP_SCHEMA if not given.
+        
+        Returns:
+            df - Pandas DataFrame with the matching trips of the city, incl. derived columns.
+    """
+    if schema is None:
+        schema = TRIP_SCHEMA
+    
+    meta, df = update_cache(csv_path, schema)
+    if meta is None:
+        with trace_span('filter', month=month, day=day):
+            return filter_data(df, month, day)
+    
+    try:
+        return read_cached_data(csv_path, meta, month, day)
+    except CACHE_READ_ERRORS as e:
+        # e.g. a cache file left half-written by an interrupted run: rebuild the cache.
+        print("Data cache of {} is damaged ({}), rebuilding it.".format(csv_path, e))
+        frame_cache_evict(csv_path)
+        df, meta = build_cache(csv_path, meta, schema)
+        if meta is None:
+            with trace_span('filter', month=month, day=day):
+                return filter_data(df, month, day)
+        return read_cached_data(csv_path, meta, month, day)
+
+
+def update_cache(csv_path, schema):
+    """
+        Bring the cache of a city csv file up to date: rows appended to the csv file are merged
+        into the cache (see append_to_cache()), a changed csv file is parsed again (see build_cache()).
+        With CACHE_WRITABLE off, the cache is only read: a stale cache is not updated, the csv file
+        is parsed without writing the cache.
+        
+        Args:
+            (str) csv_path - path of the city csv file.
+            (dict) schema - column types to apply when reading the csv file.
+        
+        Returns:
+            (dict) meta data of the valid cache, None if there is none (not writable),
+            and df - the prepared data of the city, if the csv file was parsed (None otherwise).
+    """
+    meta = read_cache_meta(csv_path)
+    
+    # rows appended to the csv file: only parse the new rows and merge them into the cache.
+    appended = read_appended_rows(csv_path, meta) if CACHE_WRITABLE and meta is not None and meta.get('schema') == schema else None
+    if appended is not None:
+        try:
+            with trace_span('append_cache', file=csv_path, rows=len(appended[0])):
+                append_to_cache(csv_path, meta, prepare_data(appended[0]))
+            stat = os.stat(csv_path)
+            meta.update({'mtime': stat.st_mtime, 'size': stat.st_size, 'sha1': appended[1]})
+            write_cache_meta(csv_path, meta)
+        except CACHE_READ_ERRORS as e:
+            # the meta data was removed by append_to_cache(): the cache is rebuilt below.
+            print("Data cache of {} is damaged ({}), rebuilding it.".format(csv_path, e))
+    
+    if not cache_is_valid(csv_path, meta) or meta.get('schema') != schema:
+        df, meta = build_cache(csv_path, meta, schema)
+        return meta, df
+    return meta, None
+
+
+def build_cache(csv_path, meta, schema):
+    """
+        Parse the csv file of a city (and the files ingested into its cache before) and write the cache.
+        
+        Args:
+            (str) csv_path - path of the city csv file.
+            (dict) meta - meta data of the old cache, None if there is none.
+            (dict) schema - column types to apply when reading the csv file.
+        
+        Returns:
+            df - the prepared data of the city, and (dict) the meta data of the new cache,
+            None if the cache could not be written (or CACHE_WRITABLE is off).
+    """
+    stat = os.stat(csv_path)
+    with trace_span('read_csv', file=csv_path, bytes=stat.st_size):
+        df = pd.read_csv(csv_path, dtype=schema)
+    df = prepare_data(df)
+    
+    # files ingested into the old cache (see ingest_file()) are kept.
+    ingested = [entry for entry in (meta or {}).get('ingested', []) if os.path.exists(entry['path'])]
+    if ingested:
+        df = concat_trips([df] + [prepare_data(pd.read_csv(entry['path'], dtype=schema)) for entry in ingested])
+    
+    meta = {'version': CACHE_VERSION,
+            'schema': schema,
+            'mtime': stat.st_mtime,
+            'size': stat.st_size,
+            'sha1': file_hash(csv_path),
+            'nbytes': int(df.memory_usage(deep=True).sum()),
+            'ingested': ingested}
+    
+    # the cache is just an accelerator: if it can not be written, carry on without it.
+    if not CACHE_WRITABLE:
+        return df, None
+    try:
+        with trace_span('write_cache', file=csv_path):
+            write_cache(df, csv_path, meta)
+    except OSError as e:
+        print("Could not write data cache: {}.".format(e))
+        return df, None
+    return df, meta
+
+
+def read_cached_data(csv_path, meta, month, day):
+    """
+        Load the data of a city matching the month and day filters from the (valid) cache:
+        sliced from the frame cache, or read from the columnar cache.
+        
+        Args:
+            (str) csv_path - path of the city csv file.
+            (dict) meta - cache meta data as returned by read_cache_meta().
+            (str) month - name of the month to filter by, or "all" to apply no month filter
+            (str) day - name of the day of week to filter by, or "all" to apply no day filter
+        
+        Returns:
+            df - Pandas DataFrame with the matching trips of the city.
+    """
+    df = frame_cache_get(csv_path, meta)
+    if df is None and meta['nbytes'] <= FRAME_CACHE_MAX_BYTES:
+        with trace_span('read_cache', file=csv_path, month='all', day='all'):
+            df = read_cache(csv_path, meta, 'all', 'all')
+        frame_cache_put(csv_path, meta, df)
+    
+    if df is not None:
+        with trace_span('filter', month=month, day=day):
+            return slice_cached_frame(df, meta, month, day)
+    with trace_span('read_cache', file=csv_path, month=month, day=day):
+        return read_cache(csv_path, meta, month, day)
+
+
+def load_data(city, month, day, script_name):
+    """
+        Loads data for the specified city and filters by month and day if applicable.
+        The function also adds 3 columns required in the stats functions later on.
+        * month
+        * day
+        * hour
+    
+
+        Args:
+            (str) city - name of the city to analyze
+            (str) month - name of the month to filter by, or "all" to apply no month filter
+            (str) day - name of the day of week to filter by, or "all" to apply no day filter
+        
+        Returns:
+            df - Pandas DataFrame containing city data filtered by month and day
+        
+        Raises:
+            DataLoadError - unknown city or missing data file.
+    """
+    #city = 'test'
+    if city == COMBINED_CITY:
+        return load_combined_data(month, day, script_name)
+    
+    # load data based in city and CITY_DATA.
+    # if somehow an invalid city is encountered, terminate script.
+    pathname = os.path.dirname(script_name)
+    full_path = os.path.abspath(pathname)
+    
+    if city in CITY_DATA.keys():
+        try:
+            with trace_span('load_data', city=city, month=month, day=day):
+                df = read_city_data(CITY_DATA[city], month, day, city_schema(city))
+        except FileNotFoundError as e:
+            raise DataLoadError("Error while laoding data: {}.\n"
+                                "Check location of script and data files.\n"
+                                "They should all be located in the same directory!!\n"
+                                "Current working directory is: {}.".format(e, full_path))
+            
+        #print(df.head())
+    else:
+        raise DataLoadError("City \'{}\' not found.\n"
+                            "Please check against config in CITY_DATA:\n{}".format(city, CITY_DATA))
+    
+    # drop the categories not present in the filtered data, so that value counts
+    # only list the values actually found.
+    df = df.assign(**{col: df[col].cat.remove_unused_categories()
+                      for col in CATEGORY_COLUMNS if col in df.columns})
+
+    return df
+
+
+def frequency_table(series, dropna=True, weights=None):
+    """
+        Count the occurences of each value of a column in one pass, using np.bincount
+        over integer codes instead of value_counts().
+        
+        Args:
+            (Series) series - column to count; negative values of integer columns count as missing.
+            (bool) dropna - if False, missing values are counted as well (index NaN).
+            (array) weights - optional number of occurences of each row, e.g. the trips of a marginal table row.
+        
+        Returns:
+            (Series) counts indexed by value, sorted by count (descending) and value (ascending),
+            so that the first entry is the mode as returned by Series.mode()[0].
+    """
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        codes = series.cat.codes.to_numpy()
+        labels = series.cat.categories
+    elif pd.api.types.is_integer_dtype(series.dtype) and len(series) > 0:
+        # integer columns hold non-negative values (hours, birth years); negative values mark
+        # missing values, e.g. the hour -1 of a trip without valid start time, see time_fields().
+        codes = series.to_numpy()
+        labels = pd.RangeIndex(max(int(codes.max()) + 1, 0))
+    else:
+        codes, labels = pd.factorize(series, sort=True)
+    
+    if weights is None:
+        weights = np.ones(len(codes), dtype=np.int64)
+    else:
+        weights = np.asarray(weights, dtype=np.int64)
+    
+    valid = codes >= 0
+    counts = np.bincount(codes[valid], weights=weights[valid], minlength=len(labels)).astype(np.int64)
+    table = pd.Series(counts, index=labels)
+    table = table[table > 0]
+    
+    no_of_missing = int(weights[~valid].sum())
+    if not dropna and no_of_missing > 0:
+        table = pd.concat([table, pd.Series([no_of_missing], index=[np.nan])])
+    
+    return sort_frequency_table(table)
+
+
+def sort_frequency_table(table):
+    """
+        Sort a frequency table by count (descending) and value (ascending).
+        
+        Args:
+            (Series) table - counts indexed by value.
+        
+        Returns:
+            (Series) the sorted table.
+    """
+    return table.sort_index(kind='stable').sort_values(ascending=False, kind='stable')
+
+
+def topk_table(table, k):
+    """
+        Reduce an exact frequency table to a top-k summary (Space-Saving counters, see merge_topk()).
+        The table has to be counted completely first: this bounds the size of the summaries
+        kept while merging, not the memory needed to count one chunk.
+        
+        Args:
+            (Series) table - frequency table as returned by frequency_table().
+            (int) k - number of values to keep.
+        
+        Returns:
+            (Series) the k most frequent values, (Series) their errors (all 0, the counts are exact),
+            (int) error bound: count of the most frequent value dropped.
+    """
+    bound = int(table.iloc[k]) if len(table) > k else 0
+    summary = table.head(k)
+    return summary, pd.Series(0, index=summary.index, dtype=np.int64), bound
+
+
+def merge_topk(table_a, errors_a, bound_a, table_b, errors_b, bound_b, k):
+    """
+        Merge two top-k summaries into a top-k summary of the combined data (mergeable Space-Saving).
+        A value missing in one summary is counted with that summary's error bound, which is also added
+        to the error of the value. So for every value kept, count - error <= true count <= count,
+        and a value not kept occurs at most 'bound' times.
+        
+        Args:
+            (Series) table_a, table_b - top-k summaries (value -> count), see topk_table().
+            (Series) errors_a, errors_b - their errors per value (value -> maximum overestimation).
+            (int) bound_a, bound_b - their error bounds.
+            (int) k - number of values to keep.
+        
+        Returns:
+            (Series) merged top-k summary, (Series) its errors per value, (int) its error bound.
+    """
+    keys = table_a.index.union(table_b.index)
+    counts = (table_a.reindex(keys, fill_value=bound_a) + table_b.reindex(keys, fill_value=bound_b)).astype(np.int64)
+    counts = sort_frequency_table(counts)
+    errors = (errors_a.reindex(counts.index, fill_value=bound_a) +
+              errors_b.reindex(counts.index, fill_value=bound_b)).astype(np.int64)
+    
+    bound = bound_a + bound_b
+    if len(counts) > k:
+        bound = max(bound, int(counts.iloc[k]))
+    return counts.head(k), errors.head(k), bound
+
+
+def load_combined_data(month, day, script_name):
+    """
+        Load the data of all cities in CITY_DATA into one dataframe, with the city in column 'City'.
+        The schemas are harmonized: columns missing for a city (e.g. Gender and Birth Year for washington)
+        are empty, and the station, user type and gender columns share one dictionary (categories) for all cities.
+        The rows of each city stay together, in the order of CITY_DATA, and keep their row ids
+        (the original row numbers of the city, see browse_data()).
+        
+        Args:
+            (str) month - name of the month to filter by, or "all" to apply no month filter
+            (str) day - name of the day of week to filter by, or "all" to apply no day filter
+            (str) script_name - name of the script, see load_data().
+        
+        Returns:
+            df - Pandas DataFrame containing the data of all cities filtered by month and day
+    """
+    frames = [load_data(city, month, day, script_name) for city in CITY_DATA]
+    
+    # all columns, with a frame holding each column, to take the type of missing columns from.
+    templates = {}
+    for frame in frames:
+        templates.update({col: frame for col in frame.columns if col not in templates})
+    columns = list(templates)
+    
+    for number, frame in enumerate(frames):
+        missing = {}
+        for col in columns:
+            if col in frame.columns:
+                continue
+            if col in CATEGORY_COLUMNS:
+                missing[col] = pd.Categorical.from_codes(np.full(len(frame), -1), categories=templates[col][col].cat.categories[:0])
+            elif col == 'Birth Year':
+                missing[col] = pd.array([pd.NA] * len(frame), dtype=TRIP_SCHEMA['Birth Year'])
+            else:
+                missing[col] = np.nan
+        frames[number] = frame.assign(**missing)[columns].assign(
+            City=pd.Categorical.from_codes(np.full(len(frame), number), categories=list(CITY_DATA)))
+    
+    return concat_trips(frames, renumber=False)
+
+
+def combined_stats(df, topk=None):
+    """
+        Calculate the statistics of the combined data of all cities (see load_combined_data()):
+        per city (in one pass over the rows of each city), then merged, see combine_city_stats().
+        
+        Args:
+            (df) df - dataframe holding the combined data, with column 'City'.
+            (int) topk - see compute_stats().
+        
+        Returns:
+            (dict) statistics, see combine_city_stats().
+    """
+    by_city = {}
+    codes = df['City'].cat.codes.to_numpy()
+    for number, city in enumerate(df['City'].cat.categories):
+        part = df[codes == number].drop(columns='City')
+        # columns the city has no data for (see load_combined_data()) are left out, like in the data of the city.
+        part = part.drop(columns=[col for col in ['Gender', 'Birth Year'] if col in part.columns and part[col].isna().all()])
+        by_city[city] = compute_stats(part, topk)
+    return combine_city_stats(by_city)
+
+
+def combine_city_stats(by_city):
+    """
+        Merge the statistics of several cities into the statistics of the combined data, see merge_stats().
+        
+        Args:
+            (dict) by_city - city -> statistics as returned by compute_stats().
+        
+        Returns:
+            (dict) the merged statistics, with the statistics of the cities in 'by_city'.
+    """
+    stats = None
+    for city_stats in by_city.values():
+        stats = city_stats if stats is None else merge_stats(stats, city_stats)
+    return dict(stats, by_city=by_city)
+
+
+def compute_stats(df, topk=None):
+    """
+        Statistics engine: calculate all frequency tables, sums and min/max values
+        needed by time_stats, station_stats, trip_duration_stats and user_stats in
+        one pass over the columns of the filtered dataframe.
+        
+        With topk, the station, route and birth year rankings (TOPK_KEYS) are only kept as
+        top-k summaries with an error bound, so that their size stays bounded when merging
+        the statistics of many chunks (see merge_stats()). The rankings of the dataframe itself
+        are still counted exactly and truncated afterwards (see topk_table()), so memory is
+        bounded per chunk (by the distinct values of the chunk), not O(k).
+        
+        Args:
+            (df) df - dataframe holding the bike trip data based on the filters chosen.
+            (int) topk - number of values kept per ranking, None for exact frequency tables.
+        
+        Returns:
+            (dict) statistics with the following entries:
+            * rows - number of trips
+            * month, day, hour, start, end, user_type, gender, birth_year - frequency tables
+              as returned by frequency_table() (gender and birth_year only, if in the data)
+            * route - frequency table of route ids, see route_ids()
+            * stations - (start station categories, end station categories), to decode route ids
+            * duration_sum, duration_count, duration_min, duration_max - sum, number, shortest and longest trip duration
+            * duration_sketch, duration_sketch_by_hour, duration_sketch_by_user_type - trip duration
+              distribution of all trips, per start hour and per user type, see duration_sketches()
+            * birth_year_min, birth_year_max - earliest and most recent year of birth
+            * topk, topk_errors, topk_bounds - only with topk: k, the errors of the values kept
+              (value -> maximum overestimation) and the error bound of the values dropped per ranking
+            * by_city - only for the combined data of all cities: statistics per city, see combined_stats()
+    """
+    if 'City' in df.columns:
+        return combined_stats(df, topk)
+    
+    # every statistic is recorded as span of its own, see trace_span().
+    with trace_span('compute_stats', rows=len(df)):
+        stats = {'rows': len(df)}
+        
+        with trace_span('stat_month'):
+            stats['month'] = frequency_table(df['month'])
+        with trace_span('stat_day'):
+            stats['day'] = frequency_table(df['day'])
+        with trace_span('stat_hour'):
+            stats['hour'] = frequency_table(df['hour'])
+        
+        with trace_span('stat_start'):
+            stats['start'] = frequency_table(df['Start Station'])
+        with trace_span('stat_end'):
+            stats['end'] = frequency_table(df['End Station'])
+        with trace_span('stat_route'):
+            routes = route_ids(df)
+            stats['route'] = sort_frequency_table(pd.Series(routes[routes >= 0]).value_counts())
+            stats['stations'] = (df['Start Station'].cat.categories, df['End Station'].cat.categories)
+        
+        with trace_span('stat_duration'):
+            duration = df['Trip Duration']
+            stats['duration_sum'] = duration.sum()
+            stats['duration_count'] = int(duration.count())
+            stats['duration_min'] = duration.min()
+            stats['duration_max'] = duration.max()
+            stats['duration_sketch'], stats['duration_sketch_by_hour'], stats['duration_sketch_by_user_type'] = \
+                duration_sketches(duration_buckets(duration), df['hour'].to_numpy(), df['User Type'])
+        
+        with trace_span('stat_user_type'):
+            stats['user_type'] = frequency_table(df['User Type'], dropna=False)
+        if 'Gender' in df.columns:
+            with trace_span('stat_gender'):
+                stats['gender'] = frequency_table(df['Gender'], dropna=False)
+        
+        if 'Birth Year' in df.columns:
+            with trace_span('stat_birth_year'):
+                birth_years = df['Birth Year'].dropna()
+                stats['birth_year'] = frequency_table(birth_years.astype(np.int64))
+                stats['birth_year_min'] = birth_years.min()
+                stats['birth_year_max'] = birth_years.max()
+        
+        if topk is not None:
+            with trace_span('stat_topk', k=topk):
+                stats['topk'] = topk
+                stats['topk_errors'] = {}
+                stats['topk_bounds'] = {}
+                for key in TOPK_KEYS:
+                    if key in stats:
+                        stats[key], stats['topk_errors'][key], stats['topk_bounds'][key] = topk_table(stats[key], topk)
+    
+    return stats
+
+
+def decode_routes(stats, ids):
+    """
+        Decode route ids from a statistics result into 'Start/End' station labels.
+        
+        Args:
+            (dict) stats - statistics as returned by compute_stats().
+            (array) ids - route ids to decode.
+        
+        Returns:
+            (list) of 'Start Station/End Station' strings.
+    """
+    start_stations, end_stations = stats['stations']
+    ids = np.asarray(ids, dtype=np.int64)
+    start = start_stations.take(ids // len(end_stations))
+    end = end_stations.take(ids % len(end_stations))
+    return [s + '/' + e for s, e in zip(start, end)]
+
+
+def duration_buckets(durations):
+    """
+        Map trip durations to the buckets of the duration sketch.
+        
+        Args:
+            (array) durations - trip durations in seconds.
+        
+        Returns:
+            (ndarray) int64 bucket numbers, -1 for missing durations.
+    """
+    durations = np.asarray(durations, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        buckets = np.ceil(np.log(np.maximum(durations, 1)) / np.log(DURATION_SKETCH_GAMMA))
+    buckets = np.clip(np.nan_to_num(buckets, nan=-1), -1, DURATION_SKETCH_BUCKETS - 1)
+    return buckets.astype(np.int64)
+
+
+def duration_sketches(buckets, hours, user_types, weights=None):
+    """
+        Build the duration sketches (bucket counts) of all trips, per start hour and per user type,
+        with one np.bincount each.
+        
+        Args:
+            (ndarray) buckets - bucket number of each trip (or cube cell), see duration_buckets().
+            (ndarray) hours - start hour of each trip, -1 if unknown.
+            (Series) user_types - categorical user type of each trip.
+            (array) weights - optional number of trips per row (for marginal tables and the duration cube).
+        
+        Returns:
+            (ndarray) sketch of all trips, (ndarray) sketches per hour (24 x buckets),
+            (dict) user type -> sketch.
+    """
+    size = DURATION_SKETCH_BUCKETS
+    if weights is None:
+        weights = np.ones(len(buckets), dtype=np.int64)
+    weights = np.asarray(weights, dtype=np.int64)
+    hours = np.asarray(hours, dtype=np.int64)
+    codes = user_types.cat.codes.to_numpy().astype(np.int64)
+    
+    valid = buckets >= 0
+    sketch = np.bincount(buckets[valid], weights=weights[valid], minlength=size).astype(np.int64)
+    
+    with_hour = valid & (hours >= 0)
+    by_hour = np.bincount(hours[with_hour] * size + buckets[with_hour], weights=weights[with_hour],
+                          minlength=24 * size).astype(np.int64).reshape(24, size)
+    
+    with_user_type = valid & (codes >= 0)
+    categories = user_types.cat.categories
+    by_user_type = np.bincount(codes[with_user_type] * size + buckets[with_user_type], weights=weights[with_user_type],
+                               minlength=len(categories) * size).astype(np.int64).reshape(len(categories), size)
+    by_user_type = {user_type: by_user_type[i] for i, user_type in enumerate(categories) if by_user_type[i].sum() > 0}
+    
+    return sketch, by_hour, by_user_type
+
+
+def duration_quantile(sketch, q):
+    """
+        Read a quantile from a duration sketch (relative error at most DURATION_SKETCH_ACCURACY).
+        
+        Args:
+            (ndarray) sketch - bucket counts, see duration_sketches().
+            (float) q - quantile wanted, between 0 and 1 (e.g. 0.9 for p90).
+        
+        Returns:
+            (float) the estimated duration in seconds, NaN for an empty sketch.
+    """
+    counts = np.cumsum(sketch)
+    if len(counts) == 0 or counts[-1] == 0:
+        return np.nan
+    bucket = int(np.searchsorted(counts, q * (counts[-1] - 1), side='right'))
+    return duration_quantile_value(bucket)
+
+
+def duration_histogram(sketch):
+    """
+        Log-bucketed histogram of the trip durations, with the upper bounds of DURATION_HISTOGRAM_MINUTES.
+        Derived from the duration sketch: each sketch bucket is counted in the bin of its upper bound,
+        so trips less than 2% below a bin bound may be counted in the next bin.
+        
+        Args:
+            (ndarray) sketch - bucket counts, see duration_sketches().
+        
+        Returns:
+            (Series) number of trips indexed by bin label, e.g. '2 - 4 min'.
+    """
+    values = DURATION_SKETCH_GAMMA ** np.arange(len(sketch))
+    edges = np.array(DURATION_HISTOGRAM_MINUTES) * 60
+    bins = np.searchsorted(edges, values, side='right')
+    counts = np.bincount(bins, weights=sketch, minlength=len(edges) + 1).astype(np.int64)
+    
+    labels = ["< {} min".format(DURATION_HISTOGRAM_MINUTES[0])]
+    labels += ["{} - {} min".format(low, high) for low, high in zip(DURATION_HISTOGRAM_MINUTES[:-1], DURATION_HISTOGRAM_MINUTES[1:])]
+    labels += [">= {} min".format(DURATION_HISTOGRAM_MINUTES[-1])]
+    return pd.Series(counts, index=labels)
+
+
+def duration_quantile_value(bucket):
+    """
+        Representative duration of a sketch bucket, as used by duration_quantile().
+        
+        Args:
+            (int) bucket - bucket number.
+        
+        Returns:
+            (float) duration in seconds.
+    """
+    if bucket == 0:
+        return 1.0
+    # the middle (in relative terms) of the bucket.
+    return 2 * DURATION_SKETCH_GAMMA ** bucket / (DURATION_SKETCH_GAMMA + 1)
+
+
+def build_duration_cube(df):
+    """
+        Aggregate the trips into a cube of trip counts per month, weekday, hour, user type
+        and duration sketch bucket, so that the duration sketches can be answered for any
+        month/day filter without the trip rows.
+        
+        Args:
+            (df) df - dataframe holding the prepared trip data.
+        
+        Returns:
+            df - the duration cube, one row per combination found in the data.
+    """
+    cells = df[['month', 'day', 'hour', 'User Type']].assign(bucket=duration_buckets(df['Trip Duration']))
+    cube = cells.groupby(['month', 'day', 'hour', 'User Type', 'bucket'], observed=True, dropna=False, sort=False).size()
+    return cube.rename('trips').reset_index()
+
+
+def build_marginals(df):
+    """
+        Aggregate the trips into the marginal tables of MARGINAL_COLUMNS: number of trips and
+        trip duration count, sum, min and max per month, weekday and the columns of each statistic.
+        
+        Args:
+            (df) df - dataframe holding the prepared trip data.
+        
+        Returns:
+            (dict) statistic -> df, one row per combination found in the data.
+    """
+    tables = {}
+    for name, columns in MARGINAL_COLUMNS.items():
+        if any(col not in df.columns for col in columns):
+            continue
+        grouped = df.groupby(['month', 'day'] + columns, observed=True, dropna=False, sort=False)['Trip Duration']
+        tables[name] = grouped.agg(trips='size', duration_count='count', duration_sum='sum',
+                                   duration_min='min', duration_max='max').reset_index()
+    return tables
+
+
+def merge_marginals(table_a, table_b):
+    """
+        Merge two marginal tables (see build_marginals()) or duration cubes (see build_duration_cube())
+        with the same columns: counts and sums of the same dimension values are added, min/max combined.
+        
+        Args:
+            (df) table_a, table_b - tables to merge, with the same categories.
+        
+        Returns:
+            df - the merged table.
+    """
+    aggregations = {'trips': 'sum', 'duration_count': 'sum', 'duration_sum': 'sum',
+                    'duration_min': 'min', 'duration_max': 'max'}
+    table = pd.concat([table_a, table_b], ignore_index=True)
+    dimensions = [col for col in table.columns if col not in aggregations]
+    aggregations = {col: how for col, how in aggregations.items() if col in table.columns}
+    return table.groupby(dimensions, observed=True, dropna=False, sort=False).agg(aggregations).reset_index()
+
+
+def marginal_stats(marginals, duration_cube, month, day):
+    """
+        Calculate the same statistics as compute_stats(), but from the marginal tables
+        and the duration cube instead of the trip rows.
+        
+        Args:
+            (dict) marginals - marginal tables as returned by build_marginals().
+            (df) duration_cube - duration cube as returned by build_duration_cube().
+            (str) month - name of the month to filter by, or "all" to apply no month filter
+            (str) day - name of the day of week to filter by, or "all" to apply no day filter
+        
+        Returns:
+            (dict) statistics, see compute_stats().
+    """
+    with trace_span('marginal_stats', month=month, day=day):
+        tables = {name: filter_data(table, month, day) for name, table in marginals.items()}
+        total = tables['total']
+        trips = total['trips'].to_numpy()
+        stats = {'rows': int(trips.sum())}
+        
+        stats['month'] = frequency_table(total['month'], weights=trips)
+        stats['day'] = frequency_table(total['day'], weights=trips)
+        for key, col, dropna in [('hour', 'hour', True), ('start', 'Start Station', True), ('end', 'End Station', True),
+                                 ('user_type', 'User Type', False), ('gender', 'Gender', False)]:
+            if key in tables:
+                stats[key] = frequency_table(tables[key][col], dropna=dropna, weights=tables[key]['trips'].to_numpy())
+        
+        route = tables['route']
+        routes = route_ids(route)
+        valid = routes >= 0
+        stats['route'] = sort_frequency_table(pd.Series(route['trips'].to_numpy()[valid]).groupby(routes[valid]).sum())
+        stats['stations'] = (route['Start Station'].cat.categories, route['End Station'].cat.categories)
+        
+        stats['duration_sum'] = total['duration_sum'].sum()
+        stats['duration_count'] = int(total['duration_count'].sum())
+        stats['duration_min'] = total['duration_min'].min()
+        stats['duration_max'] = total['duration_max'].max()
+        duration_cube = filter_data(duration_cube, month, day)
+        stats['duration_sketch'], stats['duration_sketch_by_hour'], stats['duration_sketch_by_user_type'] = \
+            duration_sketches(duration_cube['bucket'].to_numpy(), duration_cube['hour'].to_numpy(),
+                              duration_cube['User Type'], weights=duration_cube['trips'].to_numpy())
+        
+        if 'birth_year' in tables:
+            birth_year = tables['birth_year']
+            with_birth_year = birth_year['Birth Year'].notna().to_numpy()
+            birth_years = birth_year['Birth Year'][with_birth_year]
+            stats['birth_year'] = frequency_table(birth_years.astype(np.int64),
+                                                  weights=birth_year['trips'].to_numpy()[with_birth_year])
+            stats['birth_year_min'] = birth_years.min()
+            stats['birth_year_max'] = birth_years.max()
+    
+    return stats
+
+
+def read_city_stats(city, month, day):
+    """
+        Answer the statistics for a city and month/day filter from the cached marginal tables,
+        without touching the trip rows.
+        
+        Args:
+            (str) city - name of the city to analyze
+            (str) month - name of the month to filter by, or "all" to apply no month filter
+            (str) day - name of the day of week to filter by, or "all" to apply no day filter
+        
+        Returns:
+            (dict) statistics, see compute_stats(), or None if there are no valid marginal tables for the city.
+    """
+    if city == COMBINED_CITY:
+        by_city = {name: read_city_stats(name, month, day) for name in CITY_DATA}
+        if any(stats is None for stats in by_city.values()):
+            return None
+        return combine_city_stats(by_city)
+    
+    csv_path = CITY_DATA[city]
+    meta = read_cache_meta(csv_path)
+    if not os.path.exists(csv_path) or not cache_is_valid(csv_path, meta) or not meta.get('marginals'):
+        return None
+    tables = read_city_marginals(csv_path, meta)
+    if tables is None:
+        return None
+    return marginal_stats(tables[0], tables[1], month, day)
+
+
+def read_city_marginals(csv_path, meta):
+    """
+        Get the marginal tables and the duration cube of a city from its (valid) cache. They are kept
+        in memory after the first call, as long as the cache does not change.
+        
+        Args:
+            (str) csv_path - path of the city csv file.
+            (dict) meta - cache meta data as returned by read_cache_meta().
+        
+        Returns:
+            (tuple) the marginal tables (see build_marginals()) and the duration cube, None if they can not be read.
+    """
+    entry = MARGINALS.get(csv_path)
+    if entry is None or entry['state'] != cache_state(meta):
+        try:
+            marginals = {name: read_frame(cache_file(csv_path, 'marginal_' + name)) for name in meta['marginals']}
+            tables = (marginals, read_frame(cache_file(csv_path, 'duration_cube')))
+        except CACHE_READ_ERRORS:
+            return None
+        entry = {'state': cache_state(meta), 'tables': tables}
+        MARGINALS[csv_path] = entry
+    return entry['tables']
+
+
+def build_rollups(df):
+    """
+        Aggregate the trips into time-series rollups: number of trips and trip duration sum per
+        time bucket (by start time), for each resolution of ROLLUP_RESOLUTIONS. The buckets of a
+        resolution are consecutive, from the first to the last bucket with trips, so any time range
+        is a slice of the arrays. Trips without start time are not counted.
+        
+        Args:
+            (df) df - dataframe holding the prepared trip data.
+        
+        Returns:
+            (dict) resolution -> dict with 'origin' (start of the first bucket, in seconds since 1970),
+            'trips' and 'duration_sum' (arrays, one value per bucket).
+    """
+    with trace_span('build_rollups', rows=len(df)):
+        timestamps = df['Start Time'].to_numpy()
+        valid = ~np.isnat(timestamps)
+        seconds = timestamps[valid].astype('datetime64[s]').astype(np.int64)
+        durations = np.nan_to_num(df['Trip Duration'].to_numpy(dtype=np.float64, na_value=np.nan)[valid])
+        
+        rollups = {}
+        for resolution, width in ROLLUP_RESOLUTIONS.items():
+            offset = ROLLUP_WEEK_OFFSET if resolution == 'week' else 0
+            buckets = (seconds - offset) // width
+            first = int(buckets.min()) if len(buckets) > 0 else 0
+            rollups[resolution] = {'origin': first * width + offset,
+                                   'trips': np.bincount(buckets - first).astype(np.int64),
+                                   'duration_sum': np.bincount(buckets - first, weights=durations)}
+    
+    return rollups
+
+
+def merge_rollups(rollups_a, rollups_b):
+    """
+        Merge the time-series rollups of two sets of trips: the buckets are aligned and summed up.
+        
+        Args:
+            (dict) rollups_a, rollups_b - rollups as returned by build_rollups().
+        
+        Returns:
+            (dict) rollups of all trips.
+    """
+    merged = {}
+    for resolution, width in ROLLUP_RESOLUTIONS.items():
+        parts = [rollups[resolution] for rollups in (rollups_a, rollups_b) if len(rollups[resolution]['trips']) > 0]
+        if len(parts) < 2:
+            merged[resolution] = parts[0] if parts else rollups_a[resolution]
+            continue
+        
+        origin = min(part['origin'] for part in parts)
+        length = max((part['origin'] - origin) // width + len(part['trips']) for part in parts)
+        rollup = {'origin': origin, 'trips': np.zeros(length, dtype=np.int64), 'duration_sum': np.zeros(length)}
+        for part in parts:
+            first = (part['origin'] - origin) // width
+            rollup['trips'][first:first + len(part['trips'])] += part['trips']
+            rollup['duration_sum'][first:first + len(part['trips'])] += part['duration_sum']
+        merged[resolution] = rollup
+    return merged
+
+
+def write_rollups(rollups, csv_path):
+    """
+        Store the time-series rollups in the cache directory of a city.
+        
+        Args:
+            (dict) rollups - rollups as returned by build_rollups().
+            (str) csv_path - path of the city csv file.
+        
+        Returns: NONE
+    """
+    arrays = {}
+    for resolution, rollup in rollups.items():
+        if resolution in ROLLUP_RESOLUTIONS:
+            for key, value in rollup.items():
+                arrays['{}_{}'.format(resolution, key)] = value
+    replace_file(os.path.join(cache_dir(csv_path), 'rollups.npz'), lambda f: np.savez(f, **arrays))
+
+
+def read_rollups(csv_path):
+    """
+        Load the time-series rollups stored in the cache directory of a city.
+        
+        Args:
+            (str) csv_path - path of the city csv file.
+        
+        Returns:
+            (dict) rollups, see build_rollups().
+    """
+    with np.load(os.path.join(cache_dir(csv_path), 'rollups.npz')) as data:
+        return {resolution: {'origin': int(data[resolution + '_origin']),
+                             'trips': data[resolution + '_trips'],
+                             'duration_sum': data[resolution + '_duration_sum']}
+                for resolution in ROLLUP_RESOLUTIONS}
+
+
+def combine_city_rollups(by_city):
+    """
+        Merge the time-series rollups of several cities into the rollups of the combined data, see merge_rollups().
+        
+        Args:
+            (dict) by_city - city -> rollups as returned by build_rollups().
+        
+        Returns:
+            (dict) the merged rollups, with the rollups of the cities in 'by_city'.
+    """
+    rollups = None
+    for city_rollups in by_city.values():
+        rollups = city_rollups if rollups is None else merge_rollups(rollups, city_rollups)
+    return dict(rollups, by_city=by_city)
+
+
+def read_city_rollups(city):
+    """
+        Get the time-series rollups of a city, as stored in the cache when the data was loaded.
+        For the combined data of all cities, the rollups of the cities are merged.
+        
+        Args:
+            (str) city - name of the city
+        
+        Returns:
+            (dict) rollups (see build_rollups()), None if there is no valid cache for the city.
+            The rollups of the combined data hold the rollups of each city in 'by_city'.
+    """
+    if city == COMBINED_CITY:
+        by_city = {name: read_city_rollups(name) for name in CITY_DATA}
+        if any(rollups is None for rollups in by_city.values()):
+            return None
+        return combine_city_rollups(by_city)
+    
+    csv_path = CITY_DATA[city]
+    meta = read_cache_meta(csv_path)
+    if not os.path.exists(csv_path) or not cache_is_valid(csv_path, meta) or not meta.get('rollups'):
+        return None
+    try:
+        return read_rollups(csv_path)
+    except CACHE_READ_ERRORS:
+        return None
+
+
+def rollup_frame(rollups, resolution, month='all', day='all', start=None, end=None):
+    """
+        Look up the buckets of a resolution in the time-series rollups. The time range
+        is cut out of the bucket arrays directly, so the lookup costs O(buckets), not O(trips).
+        With a month or day filter, only the buckets within the month or on the weekday are kept
+        (weekly buckets are then summed up from the matching daily buckets).
+        
+        Args:
+            (dict) rollups - rollups as returned by build_rollups().
+            (str) resolution - one of ROLLUP_RESOLUTIONS, e.g. 'hour'.
+            (str) month - name of the month to filter by, or "all" to apply no month filter
+            (str) day - name of the day of week to filter by, or "all" to apply no day filter
+            start, end - time range (anything pd.Timestamp() accepts), None for the first/last bucket.
+                         Buckets overlapping the range are returned.
+        
+        Returns:
+            df - Pandas DataFrame with the columns trips and duration_sum, indexed by the bucket start.
+    """
+    width = ROLLUP_RESOLUTIONS[resolution]
+    if resolution == 'week' and (month != 'all' or day != 'all'):
+        daily = rollup_frame(rollups, 'day', month, day, start, end)
+        seconds = daily.index.to_numpy().astype('datetime64[s]').astype(np.int64)
+        weeks = (seconds - ROLLUP_WEEK_OFFSET) // width * width + ROLLUP_WEEK_OFFSET
+        return daily.groupby(pd.to_datetime(weeks, unit='s')).sum()
+    
+    rollup = rollups[resolution]
+    origin = rollup['origin']
+    first, stop = 0, len(rollup['trips'])
+    if start is not None:
+        first = min(max(0, (pd.Timestamp(start).value // 10**9 - origin) // width), stop)
+    if end is not None:
+        stop = max(min(stop, -((origin - pd.Timestamp(end).value // 10**9) // width)), first)
+    
+    frame = pd.DataFrame({'trips': rollup['trips'][first:stop], 'duration_sum': rollup['duration_sum'][first:stop]},
+                         index=pd.to_datetime(origin + np.arange(first, stop) * width, unit='s'))
+    if month != 'all':
+        frame = frame[frame.index.month == month_number(month)]
+    if day != 'all':
+        frame = frame[frame.index.dayofweek == day_number(day)]
+    return frame
+
+
+def city_rollups(city, script_name):
+    """
+        Get the time-series rollups of a city, the fastest way available: from the cache,
+        in streaming mode for files too large to be loaded, or built from the loaded data otherwise.
+        
+        Args:
+            (str) city - name of the city
+            (str) script_name - name of the script, see load_data().
+        
+        Returns:
+            (dict) rollups, see read_city_rollups().
+    """
+    if city == COMBINED_CITY:
+        return combine_city_rollups({name: city_rollups(name, script_name) for name in CITY_DATA})
+    
+    rollups = read_city_rollups(city)
+    if rollups is not None:
+        return rollups
+    
+    if os.path.exists(CITY_DATA[city]) and os.path.getsize(CITY_DATA[city]) > STREAM_FILE_SIZE:
+        for chunk in pd.read_csv(CITY_DATA[city], dtype=city_schema(city), chunksize=STREAM_CHUNK_SIZE):
+            chunk_rollups = build_rollups(prepare_data(chunk))
+            rollups = chunk_rollups if rollups is None else merge_rollups(rollups, chunk_rollups)
+        return rollups
+    
+    return build_rollups(load_data(city, 'all', 'all', script_name))
+
+
+def usage_curve(df, groups=None):
+    """
+        Calculate the bikes-in-use curve of the trips with a sweep line: each trip is a start event (+1)
+        and an end event (-1); after sorting all events by time, the cumulative sum of the events is
+        the number of trips underway. Ends are sorted before starts at the same time, so a trip ending
+        when another one starts does not count twice. Costs O(n log n) for the sort, without loops.
+        Trips without start or end time, or ending before they start, are left out.
+        
+        Args:
+            (df) df - dataframe holding the prepared trip data.
+            (array) groups - group number of each trip (e.g. start station codes), for a curve per group:
+                             the events are sorted by group first, each group starts from 0 bikes.
+        
+        Returns:
+            df - Pandas DataFrame with one row per event: time and bikes_in_use after the event
+                 (and group, if groups are given), sorted by (group and) time.
+    """
+    with trace_span('usage_curve', rows=len(df)):
+        start = df['Start Time'].to_numpy()
+        end = df['End Time'].to_numpy()
+        valid = ~np.isnat(start) & ~np.isnat(end) & (end >= start)
+        times = np.concatenate([start[valid], end[valid]]).astype('datetime64[s]').astype(np.int64)
+        changes = np.concatenate([np.ones(valid.sum(), dtype=np.int64), -np.ones(valid.sum(), dtype=np.int64)])
+        
+        # np.lexsort sorts by the last key first.
+        keys = [changes, times]
+        if groups is not None:
+            groups = np.asarray(groups)[valid]
+            groups = np.concatenate([groups, groups])
+            keys.append(groups)
+        order = np.lexsort(keys)
+        
+        curve = pd.DataFrame({'time': pd.to_datetime(times[order], unit='s'),
+                              'bikes_in_use': np.cumsum(changes[order])})
+        if groups is not None:
+            curve['group'] = groups[order]
+    
+    return curve
+
+
+def bikes_in_use(curve, at):
+    """
+        Look up the number of bikes in use at given times on the bikes-in-use curve (binary search).
+        
+        Args:
+            (df) curve - bikes-in-use curve as returned by usage_curve() (without groups).
+            at - time or array of times (anything np.datetime64 accepts, e.g. '2017-06-06 17:30').
+        
+        Returns:
+            (int) bikes in use at the time, or (ndarray) at each of the times.
+    """
+    at = np.asarray(at, dtype='datetime64[s]')
+    positions = np.searchsorted(curve['time'].to_numpy().astype('datetime64[s]'), at, side='right') - 1
+    counts = np.where(positions >= 0, curve['bikes_in_use'].to_numpy()[np.maximum(positions, 0)], 0)
+    return int(counts) if counts.ndim == 0 else counts
+
+
+def build_station_index(df):
+    """
+        Build the station index of the trip data, to answer station-centric questions without
+        scanning the trips again. All arrays are indexed by station number (position in 'stations'):
+        * stations - names of all start and end stations
+        * indptr, destinations, trips - destination counts per start station in CSR layout:
+          start station i has trips[indptr[i]:indptr[i+1]] trips to destinations[indptr[i]:indptr[i+1]]
+        * departures, arrivals - number of trips from/to each station
+        * hourly - number of trips from each station per start hour (stations x 24)
+        * row_order, row_indptr - row positions of df sorted by start station:
+          the trips from station i are the rows row_order[row_indptr[i]:row_indptr[i+1]]
+        
+        Args:
+            (df) df - dataframe holding the prepared trip data.
+        
+        Returns:
+            (dict) the station index.
+    """
+    stations = df['Start Station'].cat.categories.union(df['End Station'].cat.categories)
+    no_of_stations = len(stations)
+    
+    # station numbers of each trip, -1 for unknown stations.
+    start = stations.get_indexer(df['Start Station'].cat.categories).take(df['Start Station'].cat.codes.to_numpy())
+    start[df['Start Station'].cat.codes.to_numpy() < 0] = -1
+    end = stations.get_indexer(df['End Station'].cat.categories).take(df['End Station'].cat.codes.to_numpy())
+    end[df['End Station'].cat.codes.to_numpy() < 0] = -1
+    
+    index = {'stations': stations.to_numpy().astype(str)}
+    
+    # destination counts: unique (start, end) pairs are sorted by start station, then end station.
+    valid = (start >= 0) & (end >= 0)
+    pairs, trips = np.unique(start[valid].astype(np.int64) * no_of_stations + end[valid], return_counts=True)
+    index['indptr'] = np.searchsorted(pairs // no_of_stations, np.arange(no_of_stations + 1))
+    index['destinations'] = pairs % no_of_stations
+    index['trips'] = trips
+    
+    index['departures'] = np.bincount(start[start >= 0], minlength=no_of_stations)
+    index['arrivals'] = np.bincount(end[end >= 0], minlength=no_of_stations)
+    
+    hours = df['hour'].to_numpy().astype(np.int64)
+    with_hour = (start >= 0) & (hours >= 0)
+    index['hourly'] = np.bincount(start[with_hour] * 24 + hours[with_hour],
+                                  minlength=no_of_stations * 24).reshape(no_of_stations, 24)
+    
+    # rows with unknown start station are sorted first and are not part of any station range.
+    index['row_order'] = np.argsort(start, kind='stable')
+    index['row_indptr'] = np.concatenate([[0], np.cumsum(index['departures'])]) + int((start < 0).sum())
+    
+    return index
+
+
+def write_station_index(index, csv_path):
+    """
+        Store the station index in the cache directory of a city.
+        
+        Args:
+            (dict) index - station index as returned by build_station_index().
+            (str) csv_path - path of the city csv file.
+        
+        Returns: NONE
+    """
+    replace_file(os.path.join(cache_dir(csv_path), 'stations.npz'), lambda f: np.savez(f, **index))
+
+
+def read_station_index(city):
+    """
+        Get the station index of a city, as stored in the cache when the data was loaded.
+        The index is kept in memory after the first call.
+        
+        Args:
+            (str) city - name of the city
+        
+        Returns:
+            (dict) station index (see build_station_index()), None if there is no valid cache for the city.
+    """
+    csv_path = CITY_DATA[city]
+    meta = read_cache_meta(csv_path)
+    if not os.path.exists(csv_path) or not cache_is_valid(csv_path, meta) or not meta.get('station_index'):
+        return None
+    
+    entry = STATION_INDEXES.get(csv_path)
+    if entry is None or entry['state'] != cache_state(meta):
+        with np.load(os.path.join(cache_dir(csv_path), 'stations.npz')) as data:
+            index = {key: data[key] for key in data.files}
+        index['lookup'] = pd.Index(index['stations'])
+        entry = {'state': cache_state(meta), 'index': index}
+        STATION_INDEXES[csv_path] = entry
+    
+    return entry['index']
+
+
+def station_number(index, station):
+    """
+        Look up the number of a station in the station index.
+        
+        Args:
+            (dict) index - station index as returned by read_station_index().
+            (str) station - name of the station.
+        
+        Returns:
+            (int) station number, None if the station is unknown.
+    """
+    if station not in index['lookup']:
+        return None
+    return index['lookup'].get_loc(station)
+
+
+def station_top_destinations(index, station, n=10):
+    """
+        Most frequent destinations of the trips starting at a station.
+        
+        Args:
+            (dict) index - station index as returned by read_station_index().
+            (str) station - name of the start station.
+            (int) n - number of destinations wanted.
+        
+        Returns:
+            (Series) trip counts indexed by end station, most frequent first.
+    """
+    i = station_number(index, station)
+    if i is None:
+        return pd.Series([], dtype=np.int64)
+    
+    start, stop = index['indptr'][i], index['indptr'][i + 1]
+    destinations = pd.Series(index['trips'][start:stop], index=index['stations'][index['destinations'][start:stop]])
+    return sort_frequency_table(destinations).head(n)
+
+
+def station_hourly_profile(index, station):
+    """
+        Number of trips starting at a station per start hour.
+        
+        Args:
+            (dict) index - station index as returned by read_station_index().
+            (str) station - name of the start station.
+        
+        Returns:
+            (Series) trip counts indexed by hour (0 - 23).
+    """
+    i = station_number(index, station)
+    if i is None:
+        return pd.Series(np.zeros(24, dtype=np.int64))
+    return pd.Series(index['hourly'][i])
+
+
+def station_trip_counts(index, station):
+    """
+        Number of trips from and to a station.
+        
+        Args:
+            (dict) index - station index as returned by read_station_index().
+            (str) station - name of the station.
+        
+        Returns:
+            (int) trips from the station, (int) trips to the station.
+    """
+    i = station_number(index, station)
+    if i is None:
+        return 0, 0
+    return int(index['departures'][i]), int(index['arrivals'][i])
+
+
+def station_trips(index, meta, station, month='all', day='all'):
+    """
+        Get the positions of the trips starting at a station in the data of a month/day filter,
+        from the station index instead of scanning the start stations.
+        
+        Args:
+            (dict) index - station index as returned by read_station_index().
+            (dict) meta - cache meta data the index belongs to, as returned by read_cache_meta().
+            (str) station - name of the start station.
+            (str) month - name of the month to filter by, or "all" to apply no month filter
+            (str) day - name of the day of week to filter by, or "all" to apply no day filter
+        
+        Returns:
+            (ndarray) positions of the trips in the dataframe returned by load_data(city, month, day, ...),
+            None if the station is unknown.
+    """
+    i = station_number(index, station)
+    if i is None:
+        return None
+    rows = np.sort(index['row_order'][index['row_indptr'][i]:index['row_indptr'][i + 1]])
+    
+    # the rows of the index count in cache order, i.e. the month files one after another,
+    # the filtered data holds the partition ranges of the filter one after another.
+    months = sorted(meta['partitions'], key=int)
+    month_start = dict(zip(months, np.cumsum([0] + [meta['partitions'][m][-1] for m in months])))
+    ranges = partition_ranges(meta, month, day)
+    if len(ranges) == 0 or len(rows) == 0:
+        # e.g. a month without trips: no partition matches the filter.
+        return np.empty(0, dtype=np.int64)
+    starts = np.array([month_start[str(m)] + first for m, first, stop in ranges], dtype=np.int64)
+    stops = np.array([month_start[str(m)] + stop for m, first, stop in ranges], dtype=np.int64)
+    offsets = np.cumsum([0] + [stop - first for m, first, stop in ranges])[:-1]
+    
+    r = np.searchsorted(starts, rows, side='right') - 1
+    inside = (r >= 0) & (rows < stops[np.maximum(r, 0)])
+    return (rows[inside] - starts[r[inside]] + offsets[r[inside]]).astype(np.int64)
+
+
+def station_report(city, station):
+    """
+        Display the station statistics of a city from its station index:
+        trips from and to the station, top destinations and the hourly profile of departures.
+        The statistics cover all trips of the city, the month/day filters are not applied.
+        
+        Args:
+            (str) city - name of the city
+            (str) station - name of the station.
+        
+        Returns: NONE
+    """
+    if city == COMBINED_CITY:
+        for name in CITY_DATA:
+            print("{}:".format(name.title()))
+            station_report(name, station)
+        return
+    
+    index = read_station_index(city)
+    if index is None:
+        print("No station index available for {}.".format(city))
+        return
+    if station_number(index, station) is None:
+        print("Station \'{}\' not found in data for {}.".format(station, city))
+        return
+    
+    trips_from, trips_to = station_trip_counts(index, station)
+    print("Station {}: {} trips from, {} trips to the station.".format(station, trips_from, trips_to))
+    
+    print("Top destinations:")
+    for destination, count in station_top_destinations(index, station, 5).items():
+        print("  {}: {} trips".format(destination, count))
+    
+    print("Trips from the station per start hour:")
+    profile = station_hourly_profile(index, station)
+    print("  " + ", ".join("{}h: {}".format(hour, count) for hour, count in profile.items() if count > 0))
+    print_line()
+
+
+def merge_tables(table_a, table_b):
+    """
+        Add up two frequency tables as returned by frequency_table().
+        
+        Args:
+            (Series) table_a, table_b - the frequency tables to merge.
+        
+        Returns:
+            (Series) merged frequency table, sorted like frequency_table().
+    """
+    return sort_frequency_table(table_a.add(table_b, fill_value=0).astype(np.int64))
+
+
+def route_stations(stats, start_stations, end_stations, table=None):
+    """
+        Re-key the route frequency table of a statistics result to other station categories,
+        e.g. the union of the stations of several results.
+        
+        Args:
+            (dict) stats - statistics as returned by compute_stats().
+            (Index) start_stations, end_stations - new station categories (must contain the old ones).
+            (Series) table - table indexed by the route ids of stats to re-key, stats['route'] if not given.
+        
+        Returns:
+            (Series) route frequency table with route ids based on the new categories.
+    """
+    if table is None:
+        table = stats['route']
+    old_start, old_end = stats['stations']
+    ids = table.index.to_numpy().astype(np.int64)
+    start = start_stations.get_indexer(old_start.take(ids // len(old_end)))
+    end = end_stations.get_indexer(old_end.take(ids % len(old_end)))
+    return pd.Series(table.to_numpy(), index=start.astype(np.int64) * len(end_stations) + end)
+
+
+def merge_stats(stats_a, stats_b):
+    """
+        Merge two statistics results, e.g. of two chunks of a csv file, into the statistics
+        of the combined data. Merging is exact: counters and sums are added, min/max combined.
+        Only top-k summaries (statistics computed with topk) are merged approximately, see merge_topk().
+        
+        Args:
+            (dict) stats_a, stats_b - statistics as returned by compute_stats().
+        
+        Returns:
+            (dict) the merged statistics.
+    """
+    stats = {'rows': stats_a['rows'] + stats_b['rows']}
+    topk = stats_a.get('topk')
+    if topk is not None:
+        stats['topk'] = topk
+        stats['topk_errors'] = {}
+        stats['topk_bounds'] = {}
+    
+    # the route ids depend on the station categories: re-key both to the union of the stations.
+    start_stations = stats_a['stations'][0].union(stats_b['stations'][0])
+    end_stations = stats_a['stations'][1].union(stats_b['stations'][1])
+    routes_a = dict(stats_a, route=route_stations(stats_a, start_stations, end_stations))
+    routes_b = dict(stats_b, route=route_stations(stats_b, start_stations, end_stations))
+    stats['stations'] = (start_stations, end_stations)
+    if topk is not None:
+        for routes, st in [(routes_a, stats_a), (routes_b, stats_b)]:
+            routes['topk_errors'] = dict(st['topk_errors'])
+            if 'route' in st['topk_errors']:
+                routes['topk_errors']['route'] = route_stations(st, start_stations, end_stations, st['topk_errors']['route'])
+    
+    for key in ['month', 'day', 'hour', 'start', 'end', 'route', 'user_type', 'gender', 'birth_year']:
+        if key in stats_a and key in stats_b:
+            if topk is not None and key in TOPK_KEYS:
+                stats[key], stats['topk_errors'][key], stats['topk_bounds'][key] = \
+                    merge_topk(routes_a[key], routes_a['topk_errors'][key], stats_a['topk_bounds'][key],
+                               routes_b[key], routes_b['topk_errors'][key], stats_b['topk_bounds'][key], topk)
+            else:
+                stats[key] = merge_tables(routes_a[key], routes_b[key])
+        elif key in stats_a or key in stats_b:
+            routes = routes_a if key in stats_a else routes_b
+            stats[key] = routes[key]
+            if topk is not None and key in TOPK_KEYS:
+                stats['topk_errors'][key] = routes['topk_errors'][key]
+                stats['topk_bounds'][key] = (stats_a if key in stats_a else stats_b)['topk_bounds'][key]
+    
+    stats['duration_sum'] = stats_a['duration_sum'] + stats_b['duration_sum']
+    stats['duration_count'] = stats_a['duration_count'] + stats_b['duration_count']
+    stats['duration_sketch'] = stats_a['duration_sketch'] + stats_b['duration_sketch']
+    stats['duration_sketch_by_hour'] = stats_a['duration_sketch_by_hour'] + stats_b['duration_sketch_by_hour']
+    stats['duration_sketch_by_user_type'] = dict(stats_a['duration_sketch_by_user_type'])
+    for user_type, sketch in stats_b['duration_sketch_by_user_type'].items():
+        if user_type in stats['duration_sketch_by_user_type']:
+            sketch = stats['duration_sketch_by_user_type'][user_type] + sketch
+        stats['duration_sketch_by_user_type'][user_type] = sketch
+    
+    for key, combine in [('duration_min', min), ('duration_max', max), ('birth_year_min', min), ('birth_year_max', max)]:
+        values = [st[key] for st in (stats_a, stats_b) if key in st and pd.notna(st[key])]
+        if values:
+            stats[key] = combine(values)
+    
+    return stats
+
+
+def stream_stats(csv_path, month, day, schema=None, chunksize=STREAM_CHUNK_SIZE, topk=None):
+    """
+        Streaming mode: calculate the statistics of a city csv file without loading it completely.
+        The file is read in chunks of chunksize rows; the statistics of each chunk are merged
+        into the total, so peak memory depends on the chunk size, not on the file size.
+        
+        Args:
+            (str) csv_path - path of the city csv file.
+            (str) month - name of the month to filter by, or "all" to apply no month filter
+            (str) day - name of the day of week to filter by, or "all" to apply no day filter
+            (dict) schema - column types to apply when reading the csv file, TRIP_SCHEMA if not given.
+            (int) chunksize - number of rows read at once.
+            (int) topk - keep only top-k summaries of the rankings, see compute_stats().
+        
+        Returns:
+            (dict) statistics, see compute_stats().
+    """
+    if schema is None:
+        schema = TRIP_SCHEMA
+    
+    stats = None
+    with trace_span('stream_stats', file=csv_path, month=month, day=day):
+        for chunk in pd.read_csv(csv_path, dtype=schema, chunksize=chunksize):
+            chunk_stats = compute_stats(filter_data(prepare_data(chunk), month, day), topk)
+            stats = chunk_stats if stats is None else merge_stats(stats, chunk_stats)
+    
+    return stats
+
+
+def csv_byte_ranges(csv_path, parts):
+    """
+        Split a csv file into byte ranges of about equal size, each ending at a line break,
+        so that the ranges can be parsed independently.
+        Assumes that the fields of the csv file do not contain line breaks.
+        
+        Args:
+            (str) csv_path - path of the csv file.
+            (int) parts - number of ranges wanted.
+        
+        Returns:
+            (list) of (start, stop) byte offsets; the header line is not part of any range.
+    """
+    size = os.path.getsize(csv_path)
+    with open(csv_path, 'rb') as f:
+        f.readline()
+        data_start = f.tell()
+        
+        boundaries = [data_start]
+        for i in range(1, parts):
+            position = data_start + (size - data_start) * i // parts
+            if position <= boundaries[-1]:
+                continue
+            f.seek(position)
+            f.readline()
+            if f.tell() < size and f.tell() > boundaries[-1]:
+                boundaries.append(f.tell())
+        boundaries.append(size)
+    
+    return [(start, stop) for start, stop in zip(boundaries[:-1], boundaries[1:]) if stop > start]
+
+
+class RangeReader(io.RawIOBase):
+    """
+        Read-only file object over a byte range of a csv file, preceded by the header line,
+        so that pd.read_csv() can parse the range in chunks without loading it into memory.
+        
+        Args:
+            (file) f - csv file opened in binary mode.
+            (bytes) header - header line of the csv file.
+            (int) start, stop - byte range to read.
+    """
+    def __init__(self, f, header, start, stop):
+        super().__init__()
+        self.f = f
+        self.header = header
+        self.remaining = stop - start
+        f.seek(start)
+    
+    def readable(self):
+        return True
+    
+    def readinto(self, buffer):
+        if self.header:
+            n = min(len(buffer), len(self.header))
+            buffer[:n] = self.header[:n]
+            self.header = self.header[n:]
+            return n
+        n = self.f.readinto(memoryview(buffer)[:min(len(buffer), self.remaining)])
+        self.remaining -= n
+        return n
+
+
+def csv_range_stats(csv_path, start, stop, month, day, schema, chunksize=STREAM_CHUNK_SIZE, topk=None):
+    """
+        Calculate the statistics of a byte range of a city csv file, see csv_byte_ranges().
+        Used as task of the worker processes in parallel_stats(); the range is read in chunks
+        through a RangeReader, so that memory is bounded by the chunk size, not the range size.
+        
+        Args:
+            (str) csv_path - path of the city csv file.
+            (int) start, stop - byte range to analyse.
+            (str) month - name of the month to filter by, or "all" to apply no month filter
+            (str) day - name of the day of week to filter by, or "all" to apply no day filter
+            (dict) schema - column types to apply when reading the csv file.
+            (int) chunksize - number of rows parsed at once.
+            (int) topk - keep only top-k summaries of the rankings, see compute_stats().
+        
+        Returns:
+            (dict) statistics of the range, see compute_stats().
+    """
+    stats = None
+    with open(csv_path, 'rb') as f:
+        header = f.readline()
+        reader = io.BufferedReader(RangeReader(f, header, start, stop))
+        for chunk in pd.read_csv(reader, dtype=schema, chunksize=chunksize):
+            chunk_stats = compute_stats(filter_data(prepare_data(chunk), month, day), topk)
+            stats = chunk_stats if stats is None else merge_stats(stats, chunk_stats)
+    
+    return stats
+
+
+def parallel_stats(cities, month, day, workers=None, topk=None, chunksize=STREAM_CHUNK_SIZE):
+    """
+        Calculate the statistics of one or more cities in parallel worker processes.
+        Each city csv file is split into byte ranges, which are analysed concurrently;
+        the results are merged per city with merge_stats(), which is exact (incl. ties).
+        
+        Args:
+            (list) cities - names of the cities to analyse (keys of CITY_DATA).
+            (str) month - name of the month to filter by, or "all" to apply no month filter
+            (str) day - name of the day of week to filter by, or "all" to apply no day filter
+            (int) workers - number of worker processes, PARALLEL_WORKERS if not given.
+            (int) topk - keep only top-k summaries of the rankings, see compute_stats().
+            (int) chunksize - number of rows read at once by each worker, see csv_range_stats().
+        
+        Returns:
+            (dict) city -> statistics, see compute_stats().
+    """
+    if workers is None:
+        workers = PARALLEL_WORKERS
+    
+    results = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        tasks = []
+        for city in cities:
+            csv_path = CITY_DATA[city]
+            for start, stop in csv_byte_ranges(csv_path, workers):
+                tasks.append((city, executor.submit(traced_task, dict(TRACE_SETTINGS), csv_range_stats, csv_path,
+                                                    start, stop, month, day, city_schema(city), chunksize, topk)))
+        
+        for city, task in tasks:
+            stats = task_result(task)
+            results[city] = stats if city not in results else merge_stats(results[city], stats)
+    
+    return results
+
+
+def plot_file_name(kind, city, month, day):
+    """
+        Name of the file a plot is stored in, keyed on the plot kind and the filter settings.
+        
+        Args:
+            (str) kind - kind of plot, e.g. 'start_hours'.
+            (str) city - name of the city analyzed
+            (str) month - name of the month filtered by, or "all"
+            (str) day - name of the day of week filtered by, or "all"
+        
+        Returns:
+            (str) path of the plot file in PLOT_DIR.
+    """
+    return os.path.join(PLOT_DIR, "{}_{}_{}_{}.png".format(kind, city.replace(' ', '_'), month, day))
+
+
+def draw_bar_plot(ax, labels, counts, xlabel, title, small_ticks):
+    """
+        Draw a bar plot of value counts into a matplotlib axes.
+        
+        Args:
+            (Axes) ax - axes to draw into.
+            (list) labels - bar labels.
+            (list) counts - bar heights.
+            (str) xlabel - label of the x axis.
+            (str) title - title of the plot.
+            (bool) small_ticks - use small, rotated x tick labels (for long labels).
+        
+        Returns: NONE
+    """
+    ax.bar(range(len(counts)), counts, color='skyblue')
+    ax.set_xticks(range(len(labels)))
+    if small_ticks:
+        ax.set_xticklabels([str(label) for label in labels], fontsize=8, rotation=45)
+    else:
+        ax.set_xticklabels([str(label) for label in labels], rotation=90)
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel('Count')
+    ax.set_title(title)
+
+
+def render_bar_plot(labels, counts, xlabel, title, small_ticks, file_name):
+    """
+        Render a bar plot into a file, headless: the figure is drawn with the non-GUI Agg canvas,
+        outside of the shared pyplot state, and is released when done.
+        Runs in the plot worker processes, see submit_plot().
+        
+        Args:
+            (list) labels, counts, (str) xlabel, title, (bool) small_ticks - see draw_bar_plot().
+            (str) file_name - file to store the plot in.
+        
+        Returns:
+            (str) file_name.
+    """
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    draw_bar_plot(fig.add_subplot(), labels, counts, xlabel, title, small_ticks)
+    fig.savefig(file_name, bbox_inches='tight')
+    return file_name
+
+
+def submit_plot(counts, xlabel, title, small_ticks, file_name, show):
+    """
+        Store a bar plot of value counts in a file.
+        Interactively (show), the plot is drawn with pyplot, shown and closed again.
+        Otherwise it is rendered headless, in the background if plot workers are running.
+        
+        Args:
+            (Series) counts - value counts to plot, indexed by value.
+            (str) xlabel - label of the x axis.
+            (str) title - title of the plot.
+            (bool) small_ticks - use small, rotated x tick labels (for long labels).
+            (str) file_name - file to store the plot in.
+            (bool) show - show the plot on screen.
+        
+        Returns: NONE
+    """
+    labels, values = counts.index.tolist(), counts.tolist()
+    if show:
+        fig, ax = plt.subplots()
+        draw_bar_plot(ax, labels, values, xlabel, title, small_ticks)
+        fig.savefig(file_name, bbox_inches='tight')
+        plt.show()
+        plt.close(fig)
+    elif PLOT_EXECUTOR is not None:
+        PLOT_TASKS.append(PLOT_EXECUTOR.submit(render_bar_plot, labels, values, xlabel, title, small_ticks, file_name))
+    else:
+        render_bar_plot(labels, values, xlabel, title, small_ticks, file_name)
+    
+    print("Plot stored locally: " + os.path.abspath(file_name))
+
+
+def start_plot_workers(workers):
+    """
+        Start the pool of worker processes rendering plots in the background.
+        
+        Args:
+            (int) workers - number of worker processes.
+        
+        Returns: NONE
+    """
+    global PLOT_EXECUTOR
+    PLOT_EXECUTOR = ProcessPoolExecutor(max_workers=workers)
+
+
+def wait_for_plots():
+    """
+        Wait until all plots submitted to the plot workers are rendered, and stop the workers.
+        
+        Args: NONE
+        
+        Returns:
+            (int) number of plots rendered.
+    """
+    global PLOT_EXECUTOR
+    rendered = 0
+    for task in PLOT_TASKS:
+        try:
+            task.result()
+            rendered += 1
+        except Exception as e:
+            print("Error while rendering plot: {}.".format(e))
+    PLOT_TASKS.clear()
+    
+    if PLOT_EXECUTOR is not None:
+        PLOT_EXECUTOR.shutdown()
+        PLOT_EXECUTOR = None
+    return rendered
+
+
+def city_results(build_result, stats, month, day, *args):
+    """
+        Per city breakdown of a result of the combined data of all cities.
+        
+        Args:
+            (function) build_result - function building the result, e.g. time_result().
+            (dict) stats - statistics, with the statistics per city in 'by_city' (see combine_city_stats()).
+            (str) month, day - filter the statistics were calculated for.
+            args - further arguments of build_result.
+        
+        Returns:
+            (dict) city -> result of the city, None if the statistics are not combined.
+    """
+    if 'by_city' not in stats:
+        return None
+    return {city: build_result(city_stats, city, month, day, *args) for city, city_stats in stats['by_city'].items()}
+
+
+def popular_value(table, errors=None):
+    """
+        Most frequent value of a frequency table and its count.
+        
+        Args:
+            (Series) table - frequency table sorted by count, see sort_frequency_table().
+            (Series) errors - for top-k summaries: errors per value, see merge_topk().
+        
+        Returns:
+            (dict) value and count, with errors also min_count (the count guaranteed), None for an empty table.
+    """
+    if len(table) == 0:
+        return None
+    popular = {'value': table.index[0], 'count': table.iloc[0]}
+    if errors is not None:
+        popular['min_count'] = table.iloc[0] - errors[table.index[0]]
+    return popular
+
+
+def time_result(stats, city, month, day):
+    """
+        Structured result of time_stats().
+        
+        Args:
+            (dict) stats - statistics as returned by compute_stats().
+            (str) city, month, day - filter the statistics were calculated for.
+        
+        Returns:
+            (dict) report, city, month, day, rows, popular_month, popular_day, popular_hour
+            (value and count, see popular_value()) and hour_counts (start hour -> count).
+    """
+    return {'report': 'time', 'city': city, 'month': month, 'day': day,
+            'rows': stats['rows'],
+            'popular_month': popular_value(stats['month']),
+            'popular_day': popular_value(stats['day']),
+            'popular_hour': popular_value(stats['hour']),
+            'hour_counts': stats['hour'].sort_index().to_dict(),
+            'by_city': city_results(time_result, stats, month, day)}
+
+
+def station_result(stats, city, month, day, no_of_trips=10):
+    """
+        Structured result of station_stats().
+        
+        Args:
+            (dict) stats - statistics as returned by compute_stats().
+            (str) city, month, day - filter the statistics were calculated for.
+            (int) no_of_trips - number of most popular trips listed.
+        
+        Returns:
+            (dict) report, city, month, day, rows, popular_start_station, popular_end_station,
+            popular_trip (value and count, see popular_value()), top_trips ('start/end' -> count)
+            and, for approximate rankings, the guaranteed count of the popular values (min_count)
+            and topk_bounds (ranking -> maximum count of the values not kept).
+    """
+    errors = stats.get('topk_errors', {})
+    top_routes = stats['route'].head(no_of_trips)
+    top_trips = pd.Series(top_routes.to_numpy(), index=decode_routes(stats, top_routes.index))
+    trip_errors = None
+    if 'route' in errors:
+        trip_errors = pd.Series(errors['route'].reindex(top_routes.index).to_numpy(), index=top_trips.index)
+    
+    result = {'report': 'station', 'city': city, 'month': month, 'day': day,
+              'rows': stats['rows'],
+              'popular_start_station': popular_value(stats['start'], errors.get('start')),
+              'popular_end_station': popular_value(stats['end'], errors.get('end')),
+              'popular_trip': popular_value(top_trips, trip_errors),
+              'top_trips': top_trips.to_dict()}
+    if 'topk' in stats:
+        result['topk'] = stats['topk']
+        result['topk_bounds'] = {key: stats['topk_bounds'][key] for key in ['start', 'end', 'route']}
+    result['by_city'] = city_results(station_result, stats, month, day, no_of_trips)
+    return result
+
+
+def duration_result(stats, city, month, day):
+    """
+        Structured result of trip_duration_stats().
+        
+        Args:
+            (dict) stats - statistics as returned by compute_stats().
+            (str) city, month, day - filter the statistics were calculated for.
+        
+        Returns:
+            (dict) report, city, month, day, rows, total and mean travel time (seconds), and if there are
+            trip durations: shortest and longest travel time (seconds), percentiles ('p50' -> seconds, see DURATION_PERCENTILES), histogram (label -> count),
+            by_user_type and by_hour (user type / start hour -> {'p50': seconds, 'p90': seconds}).
+    """
+    count = stats['duration_count']
+    result = {'report': 'duration', 'city': city, 'month': month, 'day': day,
+              'rows': stats['rows'],
+              'total': stats['duration_sum'],
+              'mean': stats['duration_sum'] / count if count > 0 else np.nan}
+    
+    if count > 0:
+        result['shortest'] = stats['duration_min']
+        result['longest'] = stats['duration_max']
+        result['percentiles'] = {"p{}".format(p): duration_quantile(stats['duration_sketch'], p / 100)
+                                 for p in DURATION_PERCENTILES}
+        result['histogram'] = duration_histogram(stats['duration_sketch']).to_dict()
+        result['by_user_type'] = {user_type: {'p50': duration_quantile(sketch, 0.5), 'p90': duration_quantile(sketch, 0.9)}
+                                  for user_type, sketch in stats['duration_sketch_by_user_type'].items()}
+        result['by_hour'] = {hour: {'p50': duration_quantile(sketch, 0.5), 'p90': duration_quantile(sketch, 0.9)}
+                             for hour, sketch in enumerate(stats['duration_sketch_by_hour']) if sketch.sum() > 0}
+    result['by_city'] = city_results(duration_result, stats, month, day)
+    return result
+
+
+def user_result(stats, city, month, day):
+    """
+        Structured result of user_stats().
+        
+        Args:
+            (dict) stats - statistics as returned by compute_stats().
+            (str) city, month, day - filter the statistics were calculated for.
+        
+        Returns:
+            (dict) report, city, month, day, rows, user_types (user type -> {'count', 'percentage'}),
+            genders (like user_types, None without gender info), birth_year_min, birth_year_max and
+            popular_birth_year (value and count, see popular_value(), None without birth year info).
+    """
+    result = {'report': 'user', 'city': city, 'month': month, 'day': day,
+              'rows': stats['rows'],
+              'user_types': None,
+              'genders': None,
+              'birth_year_min': None,
+              'birth_year_max': None,
+              'popular_birth_year': None}
+    
+    for key, result_key in [('user_type', 'user_types'), ('gender', 'genders')]:
+        if key in stats:
+            counts = stats[key]
+            percentage = counts / counts.sum() * 100
+            result[result_key] = {value: {'count': count, 'percentage': percentage[value]} for value, count in counts.items()}
+    
+    if 'birth_year' in stats and len(stats['birth_year']) > 0:
+        result['birth_year_min'] = int(stats['birth_year_min'])
+        result['birth_year_max'] = int(stats['birth_year_max'])
+        popular = popular_value(stats['birth_year'], stats.get('topk_errors', {}).get('birth_year'))
+        result['popular_birth_year'] = dict(popular, value=int(popular['value']))
+        if 'topk' in stats:
+            result['topk'] = stats['topk']
+            result['topk_bounds'] = {'birth_year': stats['topk_bounds']['birth_year']}
+    result['by_city'] = city_results(user_result, stats, month, day)
+    return result
+
+
+def bucket_value(series, largest=True):
+    """
+        Bucket with the largest (or smallest) value of a time series and its value.
+        
+        Args:
+            (Series) series - values indexed by bucket start, see rollup_frame().
+            (bool) largest - take the largest value, otherwise the smallest one.
+        
+        Returns:
+            (dict) value (date of the bucket, 'YYYY-MM-DD') and count, None for an empty series.
+    """
+    series = series.dropna()
+    if len(series) == 0:
+        return None
+    bucket = series.idxmax() if largest else series.idxmin()
+    return {'value': str(bucket.date()), 'count': series[bucket]}
+
+
+def trend_result(rollups, city, month, day):
+    """
+        Structured result of trend_stats(), from the time-series rollups: trips per day,
+        day-over-day changes, the rolling mean of the daily trips over TREND_WINDOW_DAYS days,
+        the busiest quarter hour of the day and the trips per week.
+        With a day filter, the days compared are the matching weekdays (e.g. Monday to Monday).
+        
+        Args:
+            (dict) rollups - rollups as returned by read_city_rollups(), None if not available.
+            (str) city, month, day - filter to report for.
+        
+        Returns:
+            (dict) report, city, month, day, rows, days, mean_daily_trips, mean_duration,
+            busiest_day, quietest_day, last_day, largest_increase, largest_decrease, rolling_peak,
+            busiest_quarter_hour (value and count, see bucket_value()), day_over_day (change of the trips
+            of the last day), day_over_day_percent, daily_trips and weekly_trips (date -> trips).
+    """
+    result = {'report': 'trend', 'city': city, 'month': month, 'day': day,
+              'rows': 0, 'days': 0, 'mean_daily_trips': None, 'mean_duration': None,
+              'busiest_day': None, 'quietest_day': None, 'last_day': None,
+              'day_over_day': None, 'day_over_day_percent': None,
+              'largest_increase': None, 'largest_decrease': None,
+              'rolling_peak': None, 'busiest_quarter_hour': None,
+              'daily_trips': {}, 'weekly_trips': {}, 'by_city': None}
+    if rollups is None:
+        return result
+    
+    daily = rollup_frame(rollups, 'day', month, day)
+    trips = daily['trips']
+    result['rows'] = int(trips.sum())
+    result['days'] = len(daily)
+    result['by_city'] = city_results(trend_result, rollups, month, day)
+    if result['rows'] == 0:
+        return result
+    
+    result['mean_daily_trips'] = trips.mean()
+    result['mean_duration'] = daily['duration_sum'].sum() / result['rows']
+    result['busiest_day'] = bucket_value(trips)
+    result['quietest_day'] = bucket_value(trips, largest=False)
+    result['last_day'] = {'value': str(trips.index[-1].date()), 'count': trips.iloc[-1]}
+    
+    change = trips.diff()
+    if len(trips) > 1:
+        result['day_over_day'] = int(change.iloc[-1])
+        if trips.iloc[-2] > 0:
+            result['day_over_day_percent'] = change.iloc[-1] / trips.iloc[-2] * 100
+    result['largest_increase'] = bucket_value(change)
+    result['largest_decrease'] = bucket_value(change, largest=False)
+    # the peak is reported at the last day of the window.
+    result['rolling_peak'] = bucket_value(trips.rolling(TREND_WINDOW_DAYS).mean())
+    
+    quarter_hours = rollup_frame(rollups, '15min', month, day)['trips']
+    profile = quarter_hours.groupby(quarter_hours.index.hour * 4 + quarter_hours.index.minute // 15).sum() / len(daily)
+    result['busiest_quarter_hour'] = {'value': '{:02d}:{:02d}'.format(profile.idxmax() // 4, profile.idxmax() % 4 * 15),
+                                      'count': profile.max()}
+    
+    result['daily_trips'] = {str(date.date()): count for date, count in trips.items()}
+    result['weekly_trips'] = {str(date.date()): count for date, count in rollup_frame(rollups, 'week', month, day)['trips'].items()}
+    return result
+
+
+def usage_result(df, city, month, day, no_of_stations=10):
+    """
+        Structured result of usage_stats(), from the bikes-in-use curve (see usage_curve())
+        of the trips matching the filter (trips starting within the month/on the weekday).
+        
+        Args:
+            (df) df - dataframe holding the bike trip data based on the filter.
+            (str) city, month, day - filter the data was loaded with.
+            (int) no_of_stations - number of start stations listed in station_peaks.
+        
+        Returns:
+            (dict) report, city, month, day, rows, peak (time and bikes in use, as value and count),
+            mean_daily_peak, daily_peaks (date -> peak of the day), profile ('HH:MM' -> bikes in use
+            on average at that time of day, on the days with trips), busiest_time_of_day (value and count)
+            and station_peaks (start station -> {'count': most trips underway at once, 'time': when}).
+    """
+    result = {'report': 'usage', 'city': city, 'month': month, 'day': day,
+              'rows': 0, 'peak': None, 'mean_daily_peak': None, 'daily_peaks': {},
+              'profile': {}, 'busiest_time_of_day': None, 'station_peaks': {}, 'by_city': None}
+    if df is None:
+        return result
+    result['rows'] = len(df)
+    if 'City' in df.columns:
+        result['by_city'] = {name: usage_result(df[df['City'] == name].drop(columns='City'), name, month, day, no_of_stations)
+                             for name in df['City'].cat.categories}
+    
+    curve = usage_curve(df)
+    if len(curve) == 0:
+        return result
+    
+    peak = curve['bikes_in_use'].idxmax()
+    result['peak'] = {'value': str(curve['time'][peak]), 'count': curve['bikes_in_use'][peak]}
+    # the days with trips starting (not those only reached by trips ending after midnight).
+    days = np.unique(df['Start Time'].dropna().to_numpy().astype('datetime64[D]'))
+    daily_peaks = curve.groupby(curve['time'].dt.normalize())['bikes_in_use'].max()
+    daily_peaks = daily_peaks[daily_peaks.index.isin(days)]
+    result['mean_daily_peak'] = daily_peaks.mean()
+    result['daily_peaks'] = {str(date.date()): count for date, count in daily_peaks.items()}
+    
+    # sample the curve at fixed times of day, on each day with trips starting.
+    steps = np.arange(0, 86400, USAGE_PROFILE_STEP)
+    samples = bikes_in_use(curve, days.astype('datetime64[s]')[:, None] + steps.astype('m8[s]'))
+    profile = pd.Series(samples.mean(axis=0),
+                        index=['{:02d}:{:02d}'.format(step // 3600, step % 3600 // 60) for step in steps])
+    result['profile'] = profile.to_dict()
+    result['busiest_time_of_day'] = popular_value(profile.sort_values(ascending=False, kind='stable'))
+    
+    # one curve per start station: the trips underway that started at the station.
+    codes = df['Start Station'].cat.codes.to_numpy()
+    station_curve = usage_curve(df, codes)
+    station_curve = station_curve[station_curve['group'] >= 0]
+    peaks = station_curve.loc[station_curve.groupby('group')['bikes_in_use'].idxmax()]
+    peaks = peaks.sort_values('bikes_in_use', ascending=False, kind='stable').head(no_of_stations)
+    stations = df['Start Station'].cat.categories
+    result['station_peaks'] = {stations[group]: {'count': count, 'time': str(time)}
+                               for group, count, time in zip(peaks['group'], peaks['bikes_in_use'], peaks['time'])}
+    return result
+
+
+def plain(value):
+    """
+        Convert a result (see time_result(), ...) to plain python types, as needed for JSON:
+        numpy/pandas scalars to int/float, missing values (NaN, NA) to None, dict keys to str.
+        
+        Args:
+            value - result or part of it.
+        
+        Returns:
+            the converted value.
+    """
+    if isinstance(value, dict):
+        return {str(key): plain(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [plain(item) for item in value]
+    if isinstance(value, np.generic):
+        value = value.item()
+    if value is pd.NA or (isinstance(value, float) and np.isnan(value)):
+        return None
+    return value
+
+
+def result_rows(result):
+    """
+        Flatten a result into rows of a long table, one row per number (or text):
+        * scalars: metric = key, e.g. ('mean', None, 715.2)
+        * value/count pairs: label = value, e.g. ('popular_month', 'June', 1234)
+        * tables: one row per entry, e.g. ('histogram', '< 1 min', 12)
+        * tables of value dicts: one row per entry and value, e.g. ('by_user_type.p50', 'Customer', 1520.3)
+        
+        Args:
+            (dict) result - result as returned by time_result(), ..., dataframe_overview().
+        
+        Returns:
+            (list) of dicts with report, city, month, day, metric, label, value (number) and text.
+    """
+    result = plain(result)
+    ids = {key: result.get(key) for key in RESULT_ID_KEYS}
+    rows = []
+    
+    def add(metric, label, item):
+        if isinstance(item, dict) and set(item) == {'value', 'count'}:
+            add(metric, str(item['value']), item['count'])
+        elif isinstance(item, dict):
+            for key, value in item.items():
+                if isinstance(value, dict):
+                    for name, number in value.items():
+                        add("{}.{}".format(metric, name), key, number)
+                else:
+                    add(metric, key, value)
+        elif isinstance(item, list):
+            for value in item:
+                add(metric, label, value)
+        elif isinstance(item, str):
+            rows.append(dict(ids, metric=metric, label=label, value=None, text=item))
+        elif item is not None:
+            rows.append(dict(ids, metric=metric, label=label, value=item, text=None))
+    
+    for key, item in result.items():
+        if key == 'by_city':
+            # per city breakdown (see city_results()): rows of the city results.
+            for city_result in (item or {}).values():
+                rows.extend(result_rows(city_result))
+        elif key not in RESULT_ID_KEYS:
+            add(key, None, item)
+    return rows
+
+
+def write_results(results, path):
+    """
+        Store results (see time_result(), ...) in a file, in the format given by its extension:
+        * .json - list of the results
+        * .jsonl - one result per line
+        * .csv, .parquet - long table, see result_rows() (parquet requires pyarrow)
+        
+        Args:
+            (list) results - results to store.
+            (str) path - file to write.
+        
+        Returns: NONE
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.json':
+        with open(path, 'w') as f:
+            json.dump([plain(result) for result in results], f, indent=1)
+    elif extension == '.jsonl':
+        with open(path, 'w') as f:
+            for result in results:
+                f.write(json.dumps(plain(result)) + '\n')
+    else:
+        table = pd.DataFrame([row for result in results for row in result_rows(result)],
+                             columns=RESULT_ID_KEYS + ['metric', 'label', 'value', 'text'])
+        table['value'] = table['value'].astype('float64')
+        if extension == '.parquet':
+            table.to_parquet(path, index=False)
+        else:
+            table.to_csv(path, index=False)
+
+
+def print_time_result(result):
+    """
+        Print the result of time_stats(), see time_result().
+        
+        Args:
+            (dict) result - result to print.
+        
+        Returns: NONE
+    """
+    # display the most common month, day of week and start hour
+    for key, label in [('popular_month', 'month'), ('popular_day', 'day'), ('popular_hour', 'start hour')]:
+        if result[key] is not None:
+            print("Most popular {}: {}, with a count of {}.".format(label, result[key]['value'], result[key]['count']))
+
+
+def print_station_result(result):
+    """
+        Print the result of station_stats(), see station_result().
+        
+        Args:
+            (dict) result - result to print.
+        
+        Returns: NONE
+    """
+    # display most commonly used start and end station, and most frequent combination of start station and end station trip
+    for key, label in [('popular_start_station', 'start station'), ('popular_end_station', 'end station'), ('popular_trip', 'trip')]:
+        if result[key] is not None:
+            print("Most popular {}: {}, with a count of {}{}.".format(label, result[key]['value'], result[key]['count'],
+                  " (at least {})".format(result[key]['min_count']) if 'min_count' in result[key] else ""))
+    
+    if 'topk' in result:
+        print("Approximate top {} counts; values not kept occur at most: start station {}, end station {}, trip {} times.".format(
+              result['topk'], result['topk_bounds']['start'], result['topk_bounds']['end'], result['topk_bounds']['route']))
+
+
+def print_duration_result(result):
+    """
+        Print the result of trip_duration_stats(), see duration_result().
+        
+        Args:
+            (dict) result - result to print.
+        
+        Returns: NONE
+    """
+    # display total and mean travel time
+    print("Total travel time: {}.".format(result['total']))
+    print("Average travel time: {}.".format(result['mean']))
+    
+    # display the distribution of the travel time: percentiles and histogram,
+    # percentiles per user type and start hour.
+    if 'percentiles' in result:
+        print("Shortest travel time: {}, longest travel time: {}.".format(result['shortest'], result['longest']))
+        percentiles = ["{}: {:.1f}".format(p, value) for p, value in result['percentiles'].items()]
+        print("Travel time percentiles (error < {:.0%}): {}.".format(DURATION_SKETCH_ACCURACY, ", ".join(percentiles)))
+        
+        print("\nTravel time histogram:")
+        for label, count in result['histogram'].items():
+            print("  {}: {}".format(label, count))
+        
+        print("\nMedian and p90 travel time per user type:")
+        for user_type, quantiles in result['by_user_type'].items():
+            print("  {}: {:.1f}, {:.1f}".format(user_type, quantiles['p50'], quantiles['p90']))
+        
+        print("\nMedian and p90 travel time per start hour:")
+        for hour, quantiles in result['by_hour'].items():
+            print("  {}h: {:.1f}, {:.1f}".format(hour, quantiles['p50'], quantiles['p90']))
+
+
+def print_user_result(result):
+    """
+        Print the result of user_stats(), see user_result().
+        
+        Args:
+            (dict) result - result to print.
+        
+        Returns: NONE
+    """
+    # Display counts of user types and the corresponding percentages
+    # Iterate through the tables and print all items.
+    print("User type statistics:")
+    for index, counts in result['user_types'].items():
+        print("User type: {}, Count: {}, Percentage: {}%".format(index, float(counts['count']), round(counts['percentage'], 2)))
+
+    # Display counts of gender
+    if result['genders'] is not None:
+        # iterate through series and print all items.
+        print("\nGender statistics:")
+        for index, counts in result['genders'].items():
+            print("Gender: {}, Count: {}, Percentage: {}%".format(index, float(counts['count']), round(counts['percentage'], 2)))
+    else:
+        print("No gender info in dataset for {}.".format(result['city']))
+
+    
+    # Display earliest, most recent, and most common year of birth.
+    print("\nBirth year statatistics:")
+    if result['popular_birth_year'] is not None:
+        print("Min birth year is: {}".format(result['birth_year_min']))
+        print("Max birth year is: {}".format(result['birth_year_max']))
+        print("Most popular birth year: {}, with a count of {}.".format(result['popular_birth_year']['value'], result['popular_birth_year']['count']))
+        if 'topk' in result:
+            print("Approximate top {} count, at least {}; birth years not kept occur at most {} times.".format(
+                  result['topk'], result['popular_birth_year']['min_count'], result['topk_bounds']['birth_year']))
+    else:
+        print("Birth year info not available in dataset for {}.".format(result['city']))
+
+
+def print_trend_result(result):
+    """
+        Print the result of trend_stats(), see trend_result().
+        
+        Args:
+            (dict) result - result to print.
+        
+        Returns: NONE
+    """
+    if result['rows'] == 0:
+        print("No trips with start time in the data for {}.".format(result['city']))
+        return
+    
+    print("Trips per day: {:.1f} on average over {} days, mean trip duration: {:.1f} seconds.".format(
+          result['mean_daily_trips'], result['days'], result['mean_duration']))
+    print("Busiest day: {}, with {} trips.".format(result['busiest_day']['value'], result['busiest_day']['count']))
+    print("Quietest day: {}, with {} trips.".format(result['quietest_day']['value'], result['quietest_day']['count']))
+    
+    # with a day filter, each day is compared to the same weekday of the week before.
+    previous = 'day before' if result['day'] == 'all' else 'previous {}'.format(result['day'])
+    if result['day_over_day'] is not None:
+        print("Last day: {}, with {} trips, {:+d}{} compared to the {}.".format(
+              result['last_day']['value'], result['last_day']['count'], result['day_over_day'],
+              "" if result['day_over_day_percent'] is None else " ({:+.1f}%)".format(result['day_over_day_percent']), previous))
+        print("Largest increase to the {}: {:+.0f} trips on {}.".format(
+              previous, result['largest_increase']['count'], result['largest_increase']['value']))
+        print("Largest decrease to the {}: {:+.0f} trips on {}.".format(
+              previous, result['largest_decrease']['count'], result['largest_decrease']['value']))
+    if result['rolling_peak'] is not None:
+        print("Peak of the {} day rolling mean: {:.1f} trips per day, in the {} days up to {}.".format(
+              TREND_WINDOW_DAYS, result['rolling_peak']['count'], TREND_WINDOW_DAYS, result['rolling_peak']['value']))
+    print("Busiest quarter hour of the day: {}, with {:.1f} trips per day on average.".format(
+          result['busiest_quarter_hour']['value'], result['busiest_quarter_hour']['count']))
+    
+    print("\nTrips per week (starting on Monday):")
+    for week, count in result['weekly_trips'].items():
+        print("{}: {}".format(week, count))
+
+
+def print_usage_result(result):
+    """
+        Print the result of usage_stats(), see usage_result().
+        
+        Args:
+            (dict) result - result to print.
+        
+        Returns: NONE
+    """
+    if result['peak'] is None:
+        print("No trips with start and end time in the data for {}.".format(result['city']))
+        return
+    
+    print("Peak of bikes in use: {} bikes at {}.".format(result['peak']['count'], result['peak']['value']))
+    print("Daily peak: {:.1f} bikes on average over {} days.".format(result['mean_daily_peak'], len(result['daily_peaks'])))
+    print("Busiest time of day: {}, with {:.1f} bikes in use on average.".format(
+          result['busiest_time_of_day']['value'], result['busiest_time_of_day']['count']))
+    print("Bikes in use on average per time of day:")
+    print("  " + ", ".join("{}: {:.1f}".format(time_of_day, count) for time_of_day, count in result['profile'].items()
+                           if time_of_day.endswith(':00')))
+    
+    print("Start stations with the most trips underway at once:")
+    for station, peak in result['station_peaks'].items():
+        print("  {}: {} bikes at {}".format(station, peak['count'], peak['time']))
+
+
+def print_city_results(result, print_result):
+    """
+        Print the per city breakdown of a result of the combined data of all cities (see combine_city_stats()).
+        
+        Args:
+            (dict) result - result with the results per city in 'by_city', if any.
+            (function) print_result - function printing one result, e.g. print_time_result().
+        
+        Returns: NONE
+    """
+    for city_result in (result['by_city'] or {}).values():
+        print("\n{} ({} trips):".format(city_result['city'].title(), city_result['rows']))
+        print_result(city_result)
+
+
+def time_stats(df, city, month, day, stats=None, plot=None):
+    """Displays statistics on the most frequent times of travel.
+       This function calculates the most frequent travel times based on the filters chosen and 
+       offers a plot of the most popular starting hours.
+       
+        Args:
+        (dataframe) df - dataframe holding the bike trip data based on the below filters.
+        (str) city - name of the city to analyze
+        (str) month - name of the month to filter by, or "all" to apply no month filter
+        (str) day - name of the day of week to filter by, or "all" to apply no day filter
+        (dict) stats - statistics as returned by compute_stats(df), calculated if not given.
+        (bool) plot - None: ask the user for the plot, True/False: store the plot (without showing it) or not.
+        
+        Returns:
+            (dict) result, see time_result().
+    """
+
+    print('\nCalculating The Most Frequent Times of Travel...')
+    print_filter_settings(city, month, day)
+    start_time = time.time()
+    with trace_span('time_stats', city=city, month=month, day=day):
+        if stats is None:
+            stats = compute_stats(df)
+        result = time_result(stats, city, month, day)
+        print_time_result(result)
+        print_city_results(result, print_time_result)
+    
+    print("\nThis took %s seconds." % (time.time() - start_time))
     
-        print("Most popular birth year: {}, with a count of {}.".format(int(popular_birth_year), popular_birth_year_count.iloc[0]))
+    # Plot value counts, if desired.
+    show_plot = plot is None
+    if plot is None:
+        print("Would you like to see a plot showing the trip start hour counts?")
+        plot = input("Type \'yes\' to get it or anything else to continue with next stats function.").lower() == 'yes'
+    
+    if plot:
+        submit_plot(pd.Series(result['hour_counts']), 'Start Hour',
+                    'Value Counts of bike trip start hours \nwith filter: city: {}, month: {}, day: {}.'.format(city, month, day),
+                    False, plot_file_name('start_hours', city, month, day), show_plot)
+    
+    print_line()
+    return result
+
+
+def station_stats(df, city, month, day, stats=None, plot=None):
+    """Displays statistics on the most popular stations and trip.
+        This function calculates the most frequently occuring start end end stations, as well as the most
+        popular start/end station combination based on the filters chosen and 
+        offers a plot of the most popular start/end station combination.
         
-        # Plot value counts, if required.
-        print("Would you like to see a plot showing the top 10 birth year counts?")
-        show_plot = input("Type \'yes\' to get it or anything else to get back to main menue.")
+        Args:
+        (dataframe) df - dataframe holding the bike trip data based on the below filters.
+        (str) city - name of the city to analyze
+        (str) month - name of the month to filter by, or "all" to apply no month filter
+        (str) day - name of the day of week to filter by, or "all" to apply no day filter
+        (dict) stats - statistics as returned by compute_stats(df), calculated if not given.
+        (bool) plot - None: ask the user for the plot, True/False: store the plot (without showing it) or not.
         
-        if show_plot.lower() == 'yes':
-            no_of_bars = 10
-            # since the start/end station combinations are loo long for display as x tics, customize the x-tick labels with abbreviations
-            #labels = [f'Start/End {i}' for i in range(no_of_bars)]
-            
-            popular_birth_year_count.head(no_of_bars).sort_index().plot(kind='bar', color='skyblue')
-            plt.xlabel('Brih Year')
-            plt.ylabel('Count')
-            plt.xticks(fontsize=8, rotation=45)
-            #plt.xticks(ticks=np.arange(no_of_bars, 1), labels=labels)
-            plt.title('Value Counts of birth years \nwith filter: city: {}, month: {}, day: {}.'.format(city, month, day))
-            
-            plot_file_name = "birth_year_count_" + city + ".png"
-            plt.savefig(plot_file_name)
-            full_path = os.path.abspath(plot_file_name)
-            print("Plot stored locally: " + full_path)
-            
-            plt.show()
+    Returns:
+        (dict) result, see station_result().
+    """
+
+    print('\nCalculating The Most Popular Stations and Trip...')
+    print_filter_settings(city, month, day)
+    start_time = time.time()
+    with trace_span('station_stats', city=city, month=month, day=day):
+        if stats is None:
+            stats = compute_stats(df)
+        # the start/end station combinations are counted as integer route ids, only the top ones are decoded to labels.
+        no_of_bars = 10
+        result = station_result(stats, city, month, day, no_of_bars)
+        print_station_result(result)
+        print_city_results(result, print_station_result)
+    
+    print("\nThis took %s seconds." % (time.time() - start_time))
+    
+    # Plot value counts, if desired.
+    show_plot = plot is None
+    if plot is None:
+        print("Would you like to see a plot showing the top 10 start/end station combination counts?")
+        plot = input("Type \'yes\' to get it or anything else to continue with next stats function.").lower() == 'yes'
+    
+    if plot:
+        # the start/end station combinations are long: use small, rotated x tick labels.
+        submit_plot(pd.Series(result['top_trips'], dtype=np.int64).sort_index(), 'Start/End Station',
+                    'Value Counts of start/end station combinations \nwith filter: city: {}, month: {}, day: {}.'.format(city, month, day),
+                    True, plot_file_name('start_end_stations_count', city, month, day), show_plot)
+
+    print_line()
+    return result
+
+
+def trip_duration_stats(df, city, month, day, stats=None, plot=None):
+    """Displays statistics on the total and average trip duration.
+    
+    Args:
+        (dataframe) df - dataframe holding the bike trip data based on the below filters.
+        (str) city - name of the city to analyze
+        (str) month - name of the month to filter by, or "all" to apply no month filter
+        (str) day - name of the day of week to filter by, or "all" to apply no day filter
+        (dict) stats - statistics as returned by compute_stats(df), calculated if not given.
+        (bool) plot - not used, there is no trip duration plot (same signature as the other stats functions).
+        
+        This function calculates the overall duration of all trips as well as the average
+        trip duration, and shows the distribution of the trip durations (percentiles, histogram,
+        percentiles per user type and start hour).
+        
+    Returns:
+        (dict) result, see duration_result().
+    """
+
+    print('\nCalculating Trip Duration...')
+    print_filter_settings(city, month, day)
+    start_time = time.time()
+    with trace_span('trip_duration_stats', city=city, month=month, day=day):
+        if stats is None:
+            stats = compute_stats(df)
+        result = duration_result(stats, city, month, day)
+        print_duration_result(result)
+        print_city_results(result, print_duration_result)
+    
+    print("\nThis took %s seconds." % (time.time() - start_time))
+    print_line()
+    return result
+
+
+def user_stats(df, city, month, day, stats=None, plot=None):
+    """Displays statistics on bikeshare users.
+        This function displays user types and some birth year statistics.
+        A plot with the most frequently occuring birth years can be generated, if required.
+    
+     Args:
+        (dataframe) df - dataframe holding the bike trip data based on the below filters.
+        (str) city - name of the city to analyze
+        (str) month - name of the month to filter by, or "all" to apply no month filter
+        (str) day - name of the day of week to filter by, or "all" to apply no day filter
+        (dict) stats - statistics as returned by compute_stats(df), calculated if not given.
+        (bool) plot - None: ask the user for the plot, True/False: store the plot (without showing it) or not.
+        
+    Returns:
+        (dict) result, see user_result().
+    """
+
+    print('\nCalculating User Stats...')
+    print_filter_settings(city, month, day)
+    start_time = time.time()
+    with trace_span('user_stats', city=city, month=month, day=day):
+        if stats is None:
+            stats = compute_stats(df)
+        result = user_result(stats, city, month, day)
+        print_user_result(result)
+        print_city_results(result, print_user_result)
+        
+        if result['popular_birth_year'] is not None:
+            # Plot value counts, if required.
+            show_plot = plot is None
+            if plot is None:
+                print("Would you like to see a plot showing the top 10 birth year counts?")
+                plot = input("Type \'yes\' to get it or anything else to get back to main menue.").lower() == 'yes'
             
-        else:
-            print("Birth year info not available in dataset for {}.".format(city))
+            if plot:
+                no_of_bars = 10
+                submit_plot(stats['birth_year'].head(no_of_bars).sort_index(), 'Birth Year',
+                            'Value Counts of birth years \nwith filter: city: {}, month: {}, day: {}.'.format(city, month, day),
+                            True, plot_file_name('birth_year_count', city, month, day), show_plot)
+    
+    print("\nThis took %s seconds." % (time.time() - start_time))
+    print_line()
+    return result
+
+
+def trend_stats(df, city, month, day, stats=None, plot=None):
+    """Displays the trend of the trips over time.
+        This function reports the trips per day and week, day-over-day changes and a rolling mean,
+        from the time-series rollups of the city (see build_rollups()), and
+        offers a plot of the trips per week.
+    
+     Args:
+        (dataframe) df - dataframe holding the bike trip data based on the below filters,
+                         only used if the city has no cached rollups.
+        (str) city - name of the city to analyze
+        (str) month - name of the month to filter by, or "all" to apply no month filter
+        (str) day - name of the day of week to filter by, or "all" to apply no day filter
+        (dict) stats - not used, the trend is calculated from the rollups.
+        (bool) plot - None: ask the user for the plot, True/False: store the plot (without showing it) or not.
+        
+    Returns:
+        (dict) result, see trend_result().
+    """
+
+    print('\nCalculating The Trend of Trips over Time...')
+    print_filter_settings(city, month, day)
+    start_time = time.time()
+    with trace_span('trend_stats', city=city, month=month, day=day):
+        rollups = read_city_rollups(city)
+        if rollups is None:
+            rollups = build_rollups(df) if df is not None else city_rollups(city, sys.argv[0])
+        result = trend_result(rollups, city, month, day)
+        print_trend_result(result)
+        print_city_results(result, print_trend_result)
+    
+    print("\nThis took %s seconds." % (time.time() - start_time))
+    
+    if result['weekly_trips']:
+        # Plot the trips per week, if required.
+        show_plot = plot is None
+        if plot is None:
+            print("Would you like to see a plot showing the trips per week?")
+            plot = input("Type \'yes\' to get it or anything else to get back to main menue.").lower() == 'yes'
+        
+        if plot:
+            submit_plot(pd.Series(result['weekly_trips']), 'Week',
+                        'Trips per week \nwith filter: city: {}, month: {}, day: {}.'.format(city, month, day),
+                        True, plot_file_name('weekly_trips', city, month, day), show_plot)
+    
+    print_line()
+    return result
+
+
+def usage_stats(df, city, month, day, stats=None, plot=None):
+    """Displays statistics on the bikes in use at the same time.
+        This function calculates the number of trips underway over time (see usage_curve()),
+        its peaks, its average profile over the day and the peaks per start station, and
+        offers a plot of the bikes in use per time of day.
+    
+     Args:
+        (dataframe) df - dataframe holding the bike trip data based on the below filters,
+                         loaded if not given.
+        (str) city - name of the city to analyze
+        (str) month - name of the month to filter by, or "all" to apply no month filter
+        (str) day - name of the day of week to filter by, or "all" to apply no day filter
+        (dict) stats - not used, the trip rows are needed for the start and end times.
+        (bool) plot - None: ask the user for the plot, True/False: store the plot (without showing it) or not.
+        
+    Returns:
+        (dict) result, see usage_result().
+    """
+
+    print('\nCalculating The Bikes in Use...')
+    print_filter_settings(city, month, day)
+    start_time = time.time()
+    with trace_span('usage_stats', city=city, month=month, day=day):
+        if df is None:
+            # files too large to be loaded (streaming mode): not available.
+            if city == COMBINED_CITY or not os.path.exists(CITY_DATA[city]) or os.path.getsize(CITY_DATA[city]) <= STREAM_FILE_SIZE:
+                df = load_data(city, month, day, sys.argv[0])
+        result = usage_result(df, city, month, day)
+        print_usage_result(result)
+        print_city_results(result, print_usage_result)
     
     print("\nThis took %s seconds." % (time.time() - start_time))
+    
+    if result['peak'] is not None:
+        # Plot the average bikes in use per time of day, if required.
+        show_plot = plot is None
+        if plot is None:
+            print("Would you like to see a plot showing the bikes in use per time of day?")
+            plot = input("Type \'yes\' to get it or anything else to get back to main menue.").lower() == 'yes'
+        
+        if plot:
+            submit_plot(pd.Series(result['profile']), 'Time of Day',
+                        'Bikes in use on average \nwith filter: city: {}, month: {}, day: {}.'.format(city, month, day),
+                        True, plot_file_name('bikes_in_use', city, month, day), show_plot)
+    
     print_line()
+    return result
+
+
+def print_page(df, positions, start, page_size):
+    """
+        Print one page of records, as a dictionnary per row for better readability of raw data (hopefully).
+        Only the rows of the page are accessed (positional slicing), so the time needed does not
+        depend on the position of the page.
+        
+        Args:
+            (df) df - dataframe loaded.
+            (ndarray) positions - row positions to browse (e.g. the rows of one station), None for all rows.
+            (int) start - position of the first record of the page within the browsed rows.
+            (int) page_size - number of records per page.
+        
+        Returns: NONE
+    """
+    if positions is None:
+        page = df.iloc[start:start + page_size]
+    else:
+        page = df.iloc[positions[start:start + page_size]]
+    
+    for index, record in zip(page.index, page.to_dict('records')):
+        print("Row {}: {}".format(index, record))
+
+
+def sorted_row_ids(df, positions):
+    """
+        Sort the row ids of the browsed rows, for the lookup of rows by id (see row_positions()).
+        
+        Args:
+            (df) df - dataframe loaded.
+            (ndarray) positions - row positions browsed, None for all rows.
+        
+        Returns:
+            (ndarray) the sorted row ids, (ndarray) the positions within the browsed rows in the same order.
+    """
+    ids = df.index.to_numpy() if positions is None else df.index.to_numpy()[positions]
+    order = np.argsort(ids, kind='stable')
+    return ids[order], order
+
+
+def row_positions(df, positions, row_ids, row, city=None):
+    """
+        Find the browsed rows with a row id by binary search in the sorted row ids.
+        
+        Args:
+            (df) df - dataframe loaded.
+            (ndarray) positions - row positions browsed, None for all rows.
+            (tuple) row_ids - sorted row ids and their positions, see sorted_row_ids().
+            (int) row - row id to look up.
+            (str) city - combined data of all cities: only rows of this city, None for all cities.
+        
+        Returns:
+            (ndarray) positions within the browsed rows, in ascending order (several for the combined data).
+    """
+    ids, order = row_ids
+    matches = np.sort(order[np.searchsorted(ids, row, 'left'):np.searchsorted(ids, row, 'right')])
+    if city is not None and 'City' in df.columns:
+        cities = df['City'].to_numpy()[matches if positions is None else positions[matches]]
+        matches = matches[cities == city.strip().lower()]
+    return matches
 
 
-def browse_data(df):
+def browse_data(df, page_size=BATCH_SIZE, city=None, month='all', day='all'):
     """
-        Browse the dataset records in batches of BATCH_SIZE.
+        Browse the dataset records page by page, with page_size records per page.
+        Besides paging forward and backward, it is possible to jump to a position or row id
+        and to browse only the trips starting at a station (looked up in the station index
+        of the city, see station_trips(), if the city is given and its cache is valid).
+        Row ids are looked up by binary search in the sorted row ids of the browsed rows, sorted
+        once per set of browsed rows. Row ids of the combined data of all cities are the original
+        row numbers of each city: 'r <row> <city>' selects the city, 'r <row>' the first match.
         
         Args:
             (df) df - dataframe loaded.
+            (int) page_size - number of records per page.
+            (str) city, month, day - filter the dataframe was loaded with, see load_data().
             
         Returns: NONE
     """
     rows, columns = df.shape
     print("Rows: {}, columns: {}.".format(rows, columns))
     
-    loop_control = 'm'
-    i = 0
-    row_index = 0
-    
-    # Display the dataset BATCH_SIZE rows at a time, as a dictionnary for better readability of raw data (hopefully).
-    # iterate over all rows, but maintain a counter, that stops after BATCH_SIZE rows, 
-    # if more is required, reset counter.
-    i = 0
-    for index, row in df.iterrows():
-        print("Row {}: {}".format(index, row.to_dict()))
-        i +=1
-        if i == BATCH_SIZE:
-            loop_control = input("Press \'m\' for more, anything else to quit browsing mode: ")
-            if loop_control != 'm': 
-                break
-            i = 0
+    # positions of the browsed rows, None for all rows of the dataframe.
+    positions = None
+    no_of_records = rows
+    start = 0
+    # row ids of the browsed rows in sorted order and their positions, see row_positions().
+    row_ids = None
+    
+    while True:
+        if start < no_of_records:
+            print_page(df, positions, start, page_size)
+        else:
+            print("No more records.")
+        
+        command = input("Press \'m\' for more, \'p\' for previous page, \'g <position>\' to go to a position, "
+                        "\'r <row>\' to go to a row, \'s <station>\' for trips from a station only, \'a\' for all trips, "
+                        "anything else to quit browsing mode: ").strip()
+        action, argument = (command.split(' ', 1) + [''])[:2]
+        
+        if action == 'm':
+            start = min(start + page_size, no_of_records)
+        elif action == 'p':
+            start = max(start - page_size, 0)
+        elif action == 'g' and argument.isdigit():
+            start = min(int(argument), no_of_records)
+        elif action == 'r' and argument.split(' ', 1)[0].isdigit():
+            if row_ids is None:
+                row_ids = sorted_row_ids(df, positions)
+            row, row_city = (argument.split(' ', 1) + [None])[:2]
+            matches = row_positions(df, positions, row_ids, int(row), row_city)
+            if len(matches) == 0:
+                print("Row {} not found.".format(argument))
+            else:
+                start = int(matches[0])
+        elif action == 's':
+            index = read_station_index(city) if city in CITY_DATA else None
+            if index is not None:
+                station_positions = station_trips(index, read_cache_meta(CITY_DATA[city]), argument, month, day)
+            elif argument in df['Start Station'].cat.categories:
+                # no station index (e.g. the combined data of all cities): scan the start stations.
+                code = df['Start Station'].cat.categories.get_loc(argument)
+                station_positions = np.flatnonzero(df['Start Station'].cat.codes.to_numpy() == code)
+            else:
+                station_positions = None
+            if station_positions is None:
+                print("Station \'{}\' not found.".format(argument))
+            else:
+                positions = station_positions
+                no_of_records = len(positions)
+                start = 0
+                row_ids = None
+                print("Trips from {}: {}.".format(argument, no_of_records))
+        elif action == 'a':
+            positions = None
+            no_of_records = rows
+            start = 0
+            row_ids = None
+        else:
+            break
     
     print_line()
 
 
+# stats functions selectable in batch mode.
+STATS_FUNCTIONS = {'time': time_stats,
+                   'station': station_stats,
+                   'duration': trip_duration_stats,
+                   'user': user_stats,
+                   'trend': trend_stats,
+                   'usage': usage_stats}
+
+
+def parse_month(value):
+    """
+        Map a month given on the command line to its name in the MONTH dictionnary.
+        
+        Args:
+            (str) value - month name (any case) or number, 'all' or 0 for no month filter.
+        
+        Returns:
+            (str) name of the month, or "all".
+    """
+    for key, name in MONTH.items():
+        if value.lower() in (name.lower(), str(key)):
+            return name
+    raise argparse.ArgumentTypeError("invalid month: {}".format(value))
+
+
+def parse_day(value):
+    """
+        Map a weekday given on the command line to its name in the WEEKDAYS dictionnary.
+        
+        Args:
+            (str) value - weekday name (any case), 'all' for no day filter.
+        
+        Returns:
+            (str) name of the weekday, or "all".
+    """
+    for name in WEEKDAYS.values():
+        if value.lower() == name.lower():
+            return name
+    raise argparse.ArgumentTypeError("invalid day: {}".format(value))
+
+
+def parse_args(args):
+    """
+        Parse the command line arguments of the batch mode.
+        
+        Args:
+            (list) args - command line arguments without the script name.
+        
+        Returns:
+            (Namespace) parsed arguments.
+    """
+    parser = argparse.ArgumentParser(description="Generate US bikeshare statistics reports without any prompts. "
+                                                 "A report is generated for every combination of the cities, months and days given.")
+    parser.add_argument('--city', nargs='+', choices=list(CITY_DATA.keys()) + ['all'],
+                        help="cities to analyse, 'all' for all cities in CITY_DATA")
+    parser.add_argument('--month', nargs='+', type=parse_month, default=['all'],
+                        help="months to filter by (name or number), default: all")
+    parser.add_argument('--day', nargs='+', type=parse_day, default=['all'],
+                        help="weekdays to filter by, default: all")
+    parser.add_argument('--stats', nargs='+', choices=list(STATS_FUNCTIONS.keys()), default=list(STATS_FUNCTIONS.keys()),
+                        help="stats functions to run, default: all")
+    parser.add_argument('--output-dir', default=None,
+                        help="directory for the report files (report_<city>_<month>_<day>.txt) and plots, "
+                             "default: reports are printed, plots are not generated")
+    parser.add_argument('--plots', action='store_true',
+                        help="store the plots of the stats functions in the output directory")
+    parser.add_argument('--plot-workers', type=int, default=1,
+                        help="number of worker processes rendering the plots in the background, default: 1")
+    parser.add_argument('--topk', type=int, default=None,
+                        help="in streaming mode (very large files), keep only approximate top K station, "
+                             "trip and birth year rankings, to bound memory")
+    parser.add_argument('--frame-cache-mb', type=int, default=FRAME_CACHE_MAX_BYTES // 1024**2,
+                        help="memory limit (MB) of the complete city data kept in memory and reused for all reports "
+                             "of a city, 0 to read the filtered rows from the data cache for every report, "
+                             "default: {}".format(FRAME_CACHE_MAX_BYTES // 1024**2))
+    parser.add_argument('--stream-file-mb', type=int, default=STREAM_FILE_SIZE // 1024**2,
+                        help="csv files larger than this (MB) are not loaded, but analysed in streaming mode, "
+                             "in parallel byte ranges with more than one worker (used while the data cache of the city "
+                             "is not built), default: {}".format(STREAM_FILE_SIZE // 1024**2))
+    parser.add_argument('--chunk-size', type=int, default=STREAM_CHUNK_SIZE,
+                        help="number of rows read at once in streaming mode (per worker), smaller chunks need less "
+                             "memory, default: {}".format(STREAM_CHUNK_SIZE))
+    parser.add_argument('--workers', type=int, default=PARALLEL_WORKERS,
+                        help="number of worker processes calculating the statistics of the cities (and of the ranges "
+                             "of very large files) in parallel, default: number of CPUs")
+    parser.add_argument('--combined', action='store_true',
+                        help="analyse all cities as one dataset, with a breakdown per city (instead of --city)")
+    parser.add_argument('--ingest', nargs='+', default=[],
+                        help="csv files with new trips of the city (e.g. monthly exports) to add to its cached data "
+                             "before the reports are generated, parsing only the new files")
+    parser.add_argument('--output', default=None,
+                        help="also store the results of all reports in this file, for downstream processing: "
+                             ".json, .jsonl, .csv or .parquet (long table: report, city, month, day, metric, label, value, text)")
+    parser.add_argument('--trace', default=None,
+                        help="record timing spans (csv read, parsing, filtering, statistics) and write them to this file: "
+                             "Chrome trace if it ends with .json, JSON lines otherwise")
+    parser.add_argument('--trace-memory', action='store_true',
+                        help="with --trace, also record the memory allocated per span (tracemalloc, slower)")
+    parser.add_argument('--profile', default=None,
+                        help="profile the run with cProfile and store the stats in this file (see python -m pstats)")
+    args = parser.parse_args(args)
+    
+    if args.combined == (args.city is not None):
+        parser.error("either --city or --combined is required")
+    if args.combined:
+        args.city = [COMBINED_CITY]
+    if 'all' in args.city:
+        args.city = list(CITY_DATA.keys())
+    if args.plots and args.output_dir is None:
+        parser.error("--plots requires --output-dir")
+    if args.ingest and (len(args.city) != 1 or args.combined):
+        parser.error("--ingest requires exactly one city")
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if args.frame_cache_mb < 0:
+        parser.error("--frame-cache-mb must not be negative")
+    if args.stream_file_mb < 0:
+        parser.error("--stream-file-mb must not be negative")
+    if args.chunk_size < 1:
+        parser.error("--chunk-size must be at least 1")
+    if args.trace_memory and args.trace is None:
+        parser.error("--trace-memory requires --trace")
+    if args.output is not None:
+        extension = os.path.splitext(args.output)[1].lower()
+        if extension not in ['.json', '.jsonl', '.csv', '.parquet']:
+            parser.error("--output must end with .json, .jsonl, .csv or .parquet")
+        if extension == '.parquet' and pa is None:
+            parser.error("--output in parquet format requires pyarrow")
+    return args
+
+
+def city_stats(city, month, day, script_name, topk=None, workers=None, chunksize=STREAM_CHUNK_SIZE):
+    """
+        Get the statistics of a city for a month/day filter, the fastest way available:
+        from the cached marginal tables, in streaming mode for files too large to be loaded,
+        or calculated from the loaded data otherwise.
+        
+        Args:
+            (str) city - name of the city to analyze
+            (str) month - name of the month to filter by, or "all" to apply no month filter
+            (str) day - name of the day of week to filter by, or "all" to apply no day filter
+            (str) script_name - name of the script, see load_data().
+            (int) topk - approximate the rankings with top-k summaries, see compute_stats().
+                         Only used in streaming mode, the other ways are exact anyway.
+            (int) workers - number of worker processes for the cities of the combined data and
+                            for streaming mode, PARALLEL_WORKERS if not given.
+            (int) chunksize - number of rows read at once in streaming mode, see stream_stats().
+        
+        Returns:
+            (dict) statistics, see compute_stats().
+    """
+    if workers is None:
+        workers = PARALLEL_WORKERS
+    
+    stats = read_city_stats(city, month, day)
+    if stats is not None:
+        return stats
+    
+    if city == COMBINED_CITY:
+        by_city = batch_stats(list(CITY_DATA), [month], [day], script_name, topk, workers, chunksize)
+        return combine_city_stats({name: by_city[(name, month, day)] for name in CITY_DATA})
+    
+    if os.path.exists(CITY_DATA[city]) and os.path.getsize(CITY_DATA[city]) > STREAM_FILE_SIZE:
+        if workers > 1:
+            return parallel_stats([city], month, day, workers, topk, chunksize)[city]
+        return stream_stats(CITY_DATA[city], month, day, city_schema(city), chunksize, topk)
+    
+    return compute_stats(load_data(city, month, day, script_name))
+
+
+def city_filter_stats(city, months, days, script_name, topk=None, chunksize=STREAM_CHUNK_SIZE):
+    """
+        Get the statistics of a city for all combinations of the months and days given.
+        Used as task of the worker processes in batch_stats(); the city data is loaded once.
+        
+        Args:
+            (str) city - name of the city to analyze
+            (list) months - names of the months to filter by, see city_stats().
+            (list) days - names of the days of week to filter by, see city_stats().
+            (str) script_name - name of the script, see load_data().
+            (int) topk - approximate the rankings with top-k summaries, see compute_stats().
+            (int) chunksize - number of rows read at once in streaming mode, see city_stats().
+        
+        Returns:
+            (dict) (city, month, day) -> statistics, see compute_stats().
+    """
+    return {(city, month, day): city_stats(city, month, day, script_name, topk, 1, chunksize)
+            for month in months for day in days}
+
+
+def batch_stats(cities, months, days, script_name, topk=None, workers=None, chunksize=STREAM_CHUNK_SIZE):
+    """
+        Get the statistics of several cities for all combinations of the months and days given,
+        the cities in parallel worker processes (one task per city, see city_filter_stats()).
+        With a single city or worker, the statistics are calculated in this process,
+        see city_stats().
+        
+        Args:
+            (list) cities - names of the cities to analyze (keys of CITY_DATA or COMBINED_CITY).
+            (list) months - names of the months to filter by, see city_stats().
+            (list) days - names of the days of week to filter by, see city_stats().
+            (str) script_name - name of the script, see load_data().
+            (int) topk - approximate the rankings with top-k summaries, see compute_stats().
+            (int) workers - number of worker processes, PARALLEL_WORKERS if not given.
+            (int) chunksize - number of rows read at once in streaming mode, see city_stats().
+        
+        Returns:
+            (dict) (city, month, day) -> statistics, see compute_stats().
+    """
+    if workers is None:
+        workers = PARALLEL_WORKERS
+    
+    if workers <= 1 or len(cities) <= 1 or COMBINED_CITY in cities:
+        return {(city, month, day): city_stats(city, month, day, script_name, topk, workers, chunksize)
+                for city in cities for month in months for day in days}
+    
+    results = {}
+    with ProcessPoolExecutor(max_workers=min(workers, len(cities)),
+                             initializer=init_worker, initargs=(FRAME_CACHE_MAX_BYTES, STREAM_FILE_SIZE)) as executor:
+        tasks = [executor.submit(traced_task, dict(TRACE_SETTINGS), city_filter_stats, city, months, days, script_name,
+                                 topk, chunksize) for city in cities]
+        for task in tasks:
+            results.update(task_result(task))
+    return results
+
+
+def run_batch(args, script_name):
+    """
+        Batch mode: generate the reports for all city/month/day combinations given on the command line.
+        The data of a city is loaded once (see read_city_data()) and reused for all its reports.
+        
+        Args:
+            (Namespace) args - command line arguments as returned by parse_args().
+            (str) script_name - name of the script, see load_data().
+        
+        Returns: NONE
+    """
+    global PLOT_DIR, STREAM_FILE_SIZE
+    set_frame_cache_limit(args.frame_cache_mb * 1024**2)
+    STREAM_FILE_SIZE = args.stream_file_mb * 1024**2
+    if args.output_dir is not None:
+        os.makedirs(args.output_dir, exist_ok=True)
+        PLOT_DIR = args.output_dir
+    if args.plots:
+        start_plot_workers(args.plot_workers)
+    
+    for path in args.ingest:
+        print("Ingested {} new trips from {}.".format(ingest_file(args.city[0], path), path))
+    
+    all_stats = batch_stats(args.city, args.month, args.day, script_name, args.topk, args.workers, args.chunk_size)
+    
+    results = []
+    for city in args.city:
+        for month in args.month:
+            for day in args.day:
+                stats = all_stats[(city, month, day)]
+                
+                if args.output_dir is None:
+                    for name in args.stats:
+                        results.append(STATS_FUNCTIONS[name](None, city, month, day, stats, plot=False))
+                    continue
+                
+                report_file = os.path.join(args.output_dir, "report_{}_{}_{}.txt".format(city.replace(' ', '_'), month, day))
+                with open(report_file, 'w') as f, redirect_stdout(f):
+                    for name in args.stats:
+                        results.append(STATS_FUNCTIONS[name](None, city, month, day, stats, plot=args.plots))
+                print("Report stored: {}".format(os.path.abspath(report_file)))
+    
+    if args.output is not None:
+        write_results(results, args.output)
+        print("Results stored: {}".format(os.path.abspath(args.output)))
+    
+    if args.plots:
+        print("Waiting for the plots to be rendered...")
+        print("{} plots stored in {}.".format(wait_for_plots(), os.path.abspath(args.output_dir)))
+
+
 def main(argv):
     
+    # any command line arguments: run in batch mode, without prompts.
+    if len(argv) > 1:
+        args = parse_args(argv[1:])
+        if args.trace is not None:
+            enable_tracing(args.trace_memory)
+        profiler = cProfile.Profile() if args.profile is not None else None
+        if profiler is not None:
+            profiler.enable()
+        
+        run_batch(args, argv[0])
+        
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+            print("Profile stored: {}".format(os.path.abspath(args.profile)))
+        if args.trace is not None:
+            write_trace(args.trace)
+            print("Trace stored: {}".format(os.path.abspath(args.trace)))
+        return
+    
     clear_screen()
     
     while True:
@@ -583,6 +4694,22 @@ def main(argv):
         print("Month(s): {}.".format(month))
         print("Day(s): {}".format(day))
         
+        # files too large for memory: calculate the statistics in streaming mode,
+        # browsing and the dataset overview are not available then.
+        if city in CITY_DATA and os.path.exists(CITY_DATA[city]) and os.path.getsize(CITY_DATA[city]) > STREAM_FILE_SIZE:
+            print("Data file is too large to be loaded, calculating statistics in streaming mode...")
+            stats = city_stats(city, month, day, sys.argv[0])
+            time_stats(None, city, month, day, stats)
+            station_stats(None, city, month, day, stats)
+            trip_duration_stats(None, city, month, day, stats)
+            user_stats(None, city, month, day, stats)
+            
+            restart = input('\nWould you like to restart? Enter yes to restart and anything else to quit: ')
+            if restart.lower() != 'yes':
+                print("Terminating script. Good bye...")
+                break
+            continue
+        
         print("Loading data...")
         start_time = time.time()
         
@@ -600,19 +4727,35 @@ def main(argv):
                 print("Your options are:")
                 decision = input("\'b\' to browse raw data,\
                                 \n\'i\' for dataset basic info and summary,\
+                                \n\'s\' for statistics of a station (all trips of the city),\
+                                \n\'t\' for the trend of the trips over time,\
+                                \n\'u\' for the bikes in use at the same time,\
                                 \n\'x\' to execute the stats functions and \
                                 \nany other key to go back to main menue. ")
                 print("your decison is: ",  decision)
         
                 if decision == 'b':
-                    browse_data(df)
+                    browse_data(df, city=city, month=month, day=day)
                 elif decision == 'i':
-                    dataframe_overview(df)
+                    dataframe_overview(df, city, month, day)
+                    print_frame_cache_info()
+                elif decision == 's':
+                    station_report(city, input("Name of the station: ").strip())
+                elif decision == 't':
+                    trend_stats(df, city, month, day)
+                elif decision == 'u':
+                    usage_stats(df, city, month, day)
                 elif decision == 'x':
-                    time_stats(df , city, month, day)
-                    station_stats(df , city, month, day)
-                    trip_duration_stats(df , city, month, day)
-                    user_stats(df , city, month, day)
+                    # the statistics are answered from the marginal tables (like in batch mode),
+                    # or calculated in one pass over the loaded rows if there are none;
+                    # the stats functions just report them.
+                    stats = read_city_stats(city, month, day)
+                    if stats is None:
+                        stats = compute_stats(df)
+                    time_stats(df , city, month, day, stats)
+                    station_stats(df , city, month, day, stats)
+                    trip_duration_stats(df , city, month, day, stats)
+                    user_stats(df , city, month, day, stats)
                 else:
                     print("Back to main menue...")
                     break
@@ -626,4 +4769,9 @@ def main(argv):
 
 
 if __name__ == "__main__":
-    main(sys.argv)
+    try:
+        main(sys.argv)
+    except DataLoadError as e:
+        print(e)
+        print("Terminating script...")
+        sys.exit(1)
@@ -0,0 +1,38 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bikeshare_zj_v3 as bikeshare
+import bikeshare_benchmark
+
+# name of the synthetic city registered in CITY_DATA by the city fixture.
+TEST_CITY = 'test city'
+
+
+def register_city(monkeypatch, csv_path, user_data=True):
+    """
+        Register a csv file as city in CITY_DATA, for the duration of a test.
+
+        Args:
+            (MonkeyPatch) monkeypatch - pytest fixture undoing the registration.
+            (str) csv_path - path of the city csv file.
+            (bool) user_data - the file has Gender and Birth Year columns.
+
+        Returns:
+            (str) name of the city.
+    """
+    monkeypatch.setitem(bikeshare.CITY_DATA, TEST_CITY, csv_path)
+    monkeypatch.setitem(bikeshare.CITY_SCHEMA, TEST_CITY, bikeshare.TRIP_SCHEMA if user_data else
+                        dict(bikeshare.TRIP_SCHEMA, **{'Trip Duration': 'float64'}))
+    return TEST_CITY
+
+
+@pytest.fixture
+def city(tmp_path, monkeypatch):
+    """Synthetic city of 3000 trips (January - June 2017) with a cache in a temporary directory."""
+    csv_path = str(tmp_path / 'test_city.csv')
+    bikeshare_benchmark.generate_city_csv(csv_path, 3000)
+    return register_city(monkeypatch, csv_path)
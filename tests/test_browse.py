@@ -0,0 +1,88 @@
+import builtins
+
+import numpy as np
+import pytest
+
+import bikeshare_zj_v3 as bikeshare
+
+
+def browse(df, monkeypatch, capsys, commands, **filters):
+    """
+        Browse a dataframe with the commands given.
+
+        Args:
+            (df) df - dataframe to browse.
+            (MonkeyPatch) monkeypatch, (CaptureFixture) capsys - pytest fixtures.
+            (list) commands - browse commands, browsing is quit after them.
+            filters - city, month and day, see browse_data().
+
+        Returns:
+            (list) the first record printed after each command (None if no record was printed).
+    """
+    answers = iter(commands + ['q'])
+    # the output is collected at every prompt: the page printed before each command.
+    pages = []
+
+    def answer(*args):
+        pages.append(capsys.readouterr().out)
+        return next(answers)
+    monkeypatch.setattr(builtins, 'input', answer)
+    bikeshare.browse_data(df, page_size=3, **filters)
+    return [next((line for line in page.splitlines() if line.startswith("Row ") and ": {" in line), None)
+            for page in pages[1:]]
+
+
+@pytest.fixture
+def two_cities(city, tmp_path, monkeypatch):
+    """CITY_DATA with the synthetic city and a second, smaller city, for the combined data."""
+    other = str(tmp_path / 'other.csv')
+    with open(bikeshare.CITY_DATA[city]) as f:
+        lines = f.readlines()
+    with open(other, 'w') as f:
+        f.writelines(lines[:501])
+    monkeypatch.setattr(bikeshare, 'CITY_DATA', {city: bikeshare.CITY_DATA[city], 'other city': other})
+    return city, 'other city'
+
+
+@pytest.mark.parametrize('month, day', [('all', 'all'), ('May', 'all')])
+def test_browse_row(city, month, day, monkeypatch, capsys):
+    df = bikeshare.load_data(city, month, day, __file__)
+    # the cached rows are in month and weekday order, not in row order.
+    assert not df.index.is_monotonic_increasing
+    row = int(df.index[len(df) // 2])
+    printed = browse(df, monkeypatch, capsys, ['r {}'.format(row), 'r 999999'], city=city, month=month, day=day)
+    assert printed[0].startswith("Row {}: ".format(row))
+    assert repr(df.loc[row, 'Start Time']) in printed[0]
+    # unknown rows: the page stays.
+    assert printed[1] == printed[0]
+
+
+def test_browse_row_of_station(city, monkeypatch, capsys):
+    df = bikeshare.load_data(city, 'all', 'all', __file__)
+    station = df['Start Station'].value_counts().index[0]
+    rows = df.index[(df['Start Station'] == station).to_numpy()]
+    other = int(df.index[(df['Start Station'] != station).to_numpy()][0])
+    printed = browse(df, monkeypatch, capsys, ['s ' + station, 'r {}'.format(rows[5]), 'r {}'.format(other),
+                                               'a', 'r {}'.format(other)], city=city)
+    assert printed[1].startswith("Row {}: ".format(rows[5]))
+    # rows of other stations are not browsed.
+    assert printed[2].startswith("Row {}: ".format(rows[5]))
+    assert printed[4].startswith("Row {}: ".format(other))
+
+
+def test_combined_row_ids(two_cities):
+    city, other = two_cities
+    df = bikeshare.load_combined_data('all', 'all', __file__)
+    by_city = [bikeshare.load_data(name, 'all', 'all', __file__) for name in two_cities]
+    np.testing.assert_array_equal(df.index, np.concatenate([frame.index for frame in by_city]))
+
+
+def test_browse_combined_row(two_cities, monkeypatch, capsys):
+    city, other = two_cities
+    df = bikeshare.load_combined_data('all', 'all', __file__)
+    printed = browse(df, monkeypatch, capsys, ['r 100', 'r 100 ' + other, 'r 2000 ' + other], city=bikeshare.COMBINED_CITY)
+    assert printed[0].startswith("Row 100: ") and "'City': '{}'".format(city) in printed[0]
+    assert printed[1].startswith("Row 100: ") and "'City': '{}'".format(other) in printed[1]
+    assert repr(bikeshare.load_data(other, 'all', 'all', __file__).loc[100, 'Start Time']) in printed[1]
+    # the other city has 500 rows only.
+    assert printed[2] == printed[1]
@@ -0,0 +1,80 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import bikeshare_zj_v3 as bikeshare
+from conftest import register_city
+
+# name of the city holding the complete data, for comparison with the ingested data.
+FULL_CITY = 'full city'
+
+
+@pytest.fixture
+def split_city(city, tmp_path, monkeypatch):
+    """
+        The trips of the synthetic city split into a city csv file (January - March) and a file
+        to ingest (April - June), in which 'Station 1' is renamed to a new station; and a city
+        with the csv file of all trips, whose cache is a full rebuild.
+    """
+    with open(bikeshare.CITY_DATA[city]) as f:
+        header, *lines = f.readlines()
+    early = [line for line in lines if line.split(',')[1][5:7] <= '03']
+    late = [line.replace(',Station 1,', ',Brand New Station,') for line in lines if line.split(',')[1][5:7] > '03']
+
+    paths = {}
+    for name, rows in [('base', early), ('extra', late), ('full', early + late)]:
+        paths[name] = str(tmp_path / '{}.csv'.format(name))
+        with open(paths[name], 'w') as f:
+            f.writelines([header] + rows)
+    monkeypatch.setitem(bikeshare.CITY_DATA, FULL_CITY, paths['full'])
+    return register_city(monkeypatch, paths['base']), paths['extra']
+
+
+def test_ingest_matches_rebuild(split_city):
+    city, extra = split_city
+    meta = bikeshare.update_cache(bikeshare.CITY_DATA[city], bikeshare.city_schema(city))[0]
+    assert sorted(meta['partitions']) == ['1', '2', '3']
+
+    assert bikeshare.ingest_file(city, extra) > 0
+    meta = bikeshare.read_cache_meta(bikeshare.CITY_DATA[city])
+    assert sorted(meta['partitions']) == ['1', '2', '3', '4', '5', '6']
+
+    for month, day in [('all', 'all'), ('February', 'all'), ('May', 'Friday')]:
+        ingested = bikeshare.load_data(city, month, day, __file__)
+        full = bikeshare.load_data(FULL_CITY, month, day, __file__)
+        pd.testing.assert_frame_equal(ingested.astype({col: object for col in bikeshare.CATEGORY_COLUMNS}),
+                                      full.astype({col: object for col in bikeshare.CATEGORY_COLUMNS}))
+
+        ingested_stats = bikeshare.read_city_stats(city, month, day)
+        full_stats = bikeshare.read_city_stats(FULL_CITY, month, day)
+        for result in [bikeshare.time_result, bikeshare.station_result, bikeshare.duration_result, bikeshare.user_result]:
+            assert (bikeshare.plain(result(ingested_stats, city, month, day)) ==
+                    bikeshare.plain(result(full_stats, city, month, day)))
+
+
+def test_ingest_new_station(split_city):
+    city, extra = split_city
+    bikeshare.ingest_file(city, extra)
+    full = bikeshare.load_data(FULL_CITY, 'all', 'all', __file__)
+    meta = bikeshare.read_cache_meta(bikeshare.CITY_DATA[city])
+    index = bikeshare.read_station_index(city)
+    positions = bikeshare.station_trips(index, meta, 'Brand New Station')
+    assert len(positions) > 0
+    np.testing.assert_array_equal(positions, np.flatnonzero((full['Start Station'] == 'Brand New Station').to_numpy()))
+
+
+def test_ingest_cache_state(split_city):
+    city, extra = split_city
+    csv_path = bikeshare.CITY_DATA[city]
+    meta = bikeshare.update_cache(csv_path, bikeshare.city_schema(city))[0]
+    sha1, generation = bikeshare.cache_state(meta)
+
+    rows = bikeshare.ingest_file(city, extra)
+    meta = bikeshare.read_cache_meta(csv_path)
+    # the csv file itself did not change, the generation tells the data apart.
+    assert bikeshare.cache_state(meta) == (sha1, generation + 1)
+    assert meta['ingested'] == [{'path': extra, 'sha1': bikeshare.file_hash(extra), 'rows': rows}]
+
+    # a file is ingested once.
+    assert bikeshare.ingest_file(city, extra) == 0
+    assert bikeshare.cache_state(bikeshare.read_cache_meta(csv_path)) == (sha1, generation + 1)
@@ -0,0 +1,55 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import bikeshare_zj_v3 as bikeshare
+import bikeshare_benchmark
+import bikeshare_service
+
+
+@pytest.fixture
+def service(city, monkeypatch):
+    """Response cache and cache state of the service, reset for the test; yields the worker pool."""
+    monkeypatch.setattr(bikeshare_service, 'RESPONSE_CACHE', type(bikeshare_service.RESPONSE_CACHE)())
+    monkeypatch.setattr(bikeshare_service, 'CSV_STATS', {})
+    bikeshare_service.build_caches()
+    with ThreadPoolExecutor(1) as executor:
+        yield executor
+
+
+def browse(executor, city):
+    """Answer a /browse request of the complete data of the city."""
+    return asyncio.run(bikeshare_service.answer(executor, '/browse', {'city': [city], 'size': ['1']}))
+
+
+def test_response_cache_hit(service, city):
+    status, body, cached = browse(service, city)
+    assert (status, body['rows'], cached) == (200, 3000, False)
+    assert browse(service, city)[2]
+
+
+def test_ingest_invalidates_response(service, city, tmp_path):
+    browse(service, city)
+    extra = str(tmp_path / 'extra.csv')
+    bikeshare_benchmark.generate_city_csv(extra, 200, seed=1)
+    assert bikeshare.ingest_file(city, extra) == 200
+
+    status, body, cached = browse(service, city)
+    assert (status, body['rows'], cached) == (200, 3200, False)
+
+
+def test_csv_append_updates_cache(service, city, tmp_path):
+    browse(service, city)
+    extra = str(tmp_path / 'extra.csv')
+    bikeshare_benchmark.generate_city_csv(extra, 100, seed=2)
+    with open(extra) as f:
+        rows = f.readlines()[1:]
+    with open(bikeshare.CITY_DATA[city], 'a') as f:
+        f.writelines(rows)
+
+    generation = bikeshare.read_cache_meta(bikeshare.CITY_DATA[city])['generation']
+    status, body, cached = browse(service, city)
+    assert (status, body['rows'], cached) == (200, 3100, False)
+    # the rows were merged into the cache by the service, not parsed again by the worker.
+    assert bikeshare.read_cache_meta(bikeshare.CITY_DATA[city])['generation'] > generation
@@ -0,0 +1,45 @@
+import builtins
+
+import numpy as np
+import pytest
+
+import bikeshare_zj_v3 as bikeshare
+
+
+def scanned_positions(df, station):
+    """Positions of the trips from a station, found by scanning the start stations."""
+    return np.flatnonzero((df['Start Station'] == station).to_numpy())
+
+
+@pytest.mark.parametrize('month, day', [('all', 'all'), ('March', 'all'), ('all', 'Sunday'), ('June', 'Monday')])
+def test_station_trips_matches_scan(city, month, day):
+    df = bikeshare.load_data(city, month, day, __file__)
+    index = bikeshare.read_station_index(city)
+    meta = bikeshare.read_cache_meta(bikeshare.CITY_DATA[city])
+    for station in ['Station 0', 'Station 1', 'Station 28']:
+        positions = bikeshare.station_trips(index, meta, station, month, day)
+        np.testing.assert_array_equal(positions, scanned_positions(df, station))
+
+
+def test_station_trips_unknown_station(city):
+    bikeshare.load_data(city, 'all', 'all', __file__)
+    index = bikeshare.read_station_index(city)
+    assert bikeshare.station_trips(index, bikeshare.read_cache_meta(bikeshare.CITY_DATA[city]), 'Nowhere') is None
+
+
+def test_station_trips_filter_without_partition(city):
+    # the data covers January - June only: no partition matches December.
+    df = bikeshare.load_data(city, 'December', 'all', __file__)
+    assert len(df) == 0
+    index = bikeshare.read_station_index(city)
+    positions = bikeshare.station_trips(index, bikeshare.read_cache_meta(bikeshare.CITY_DATA[city]), 'Station 28', 'December')
+    assert positions.dtype == np.int64
+    assert len(positions) == 0
+
+
+def test_browse_station_filter_without_partition(city, monkeypatch, capsys):
+    df = bikeshare.load_data(city, 'December', 'all', __file__)
+    answers = iter(['s Station 28', 'q'])
+    monkeypatch.setattr(builtins, 'input', lambda *args: next(answers))
+    bikeshare.browse_data(df, city=city, month='December', day='all')
+    assert "Trips from Station 28: 0." in capsys.readouterr().out
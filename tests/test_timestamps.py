@@ -0,0 +1,66 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import bikeshare_zj_v3 as bikeshare
+
+VALID = ['2017-01-01 00:00:00', '2017-06-30 23:59:59', '1999-12-31 12:34:56', '2038-01-19 03:14:08']
+# 2000 and 2016 are leap years, 1900 and 2017 are not.
+LEAP_DAYS = ['2016-02-29 08:00:00', '2000-02-29 00:00:00', '2017-02-29 08:00:00', '1900-02-29 00:00:00',
+             '2017-02-28 23:59:59', '2016-03-01 00:00:00']
+OUT_OF_RANGE = ['2017-00-10 10:00:00', '2017-13-10 10:00:00', '2017-04-31 10:00:00', '2017-01-00 10:00:00',
+                '2017-01-10 24:00:00', '2017-01-10 10:60:00', '2017-01-10 10:00:60', '2017-01-32 10:00:00']
+# values not matching the layout: the column is parsed by pd.to_datetime().
+OTHER_LAYOUT = ['2017-01-01 00:00:00', '2017-1-1 00:00:00', 'not a time', '', '2017-01-01T00:00:00',
+                '2017-06-01 10:00:60']
+
+
+def expected(values):
+    """Timestamps as parsed by pandas in the format of the datasets, invalid values NaT."""
+    timestamps = (pd.to_datetime(pd.Series(values, dtype=object), errors='coerce', format='%Y-%m-%d %H:%M:%S')
+                  .to_numpy().astype('M8[s]'))
+    # pandas accepts leap seconds.
+    timestamps[[isinstance(value, str) and value[17:19] == '60' for value in values]] = np.datetime64('NaT')
+    return timestamps
+
+
+@pytest.mark.parametrize('values', [VALID, LEAP_DAYS, OUT_OF_RANGE, VALID + OUT_OF_RANGE, OTHER_LAYOUT],
+                         ids=['valid', 'leap days', 'out of range', 'mixed', 'other layout'])
+@pytest.mark.parametrize('pyarrow', [True, False], ids=['pyarrow', 'numpy'])
+def test_parse_timestamps(values, pyarrow, monkeypatch):
+    if not pyarrow:
+        monkeypatch.setattr(bikeshare, 'pa', None)
+    timestamps = bikeshare.parse_timestamps(pd.Series(values, dtype=object))
+    assert timestamps.dtype == np.dtype('M8[s]')
+    np.testing.assert_array_equal(timestamps, expected(values))
+
+
+def test_parse_timestamps_missing():
+    values = pd.Series(['2017-03-01 10:00:00', np.nan, None, '2017-03-02 11:00:00'], dtype=object)
+    timestamps = bikeshare.parse_timestamps(values)
+    np.testing.assert_array_equal(np.isnat(timestamps), [False, True, True, False])
+    np.testing.assert_array_equal(timestamps[[0, 3]], expected(['2017-03-01 10:00:00', '2017-03-02 11:00:00']))
+
+
+def test_parse_timestamps_empty():
+    timestamps = bikeshare.parse_timestamps(pd.Series([], dtype=object))
+    assert len(timestamps) == 0
+    assert timestamps.dtype == np.dtype('M8[s]')
+
+
+def test_parse_timestamps_categorical():
+    values = LEAP_DAYS + OUT_OF_RANGE + LEAP_DAYS
+    timestamps = bikeshare.parse_timestamps(pd.Series(values, dtype='category'))
+    np.testing.assert_array_equal(timestamps, expected(values))
+
+
+def test_time_fields():
+    values = VALID + LEAP_DAYS + ['2017-02-29 08:00:00', 'not a time']
+    timestamps = bikeshare.parse_timestamps(pd.Series(values, dtype=object))
+    month, day, hour = bikeshare.time_fields(timestamps)
+
+    want = pd.Series(expected(values).astype('M8[ns]'))
+    assert list(month.astype(object)) == [np.nan if pd.isna(t) else t for t in want.dt.month_name()]
+    assert list(day.astype(object)) == [np.nan if pd.isna(t) else t for t in want.dt.day_name()]
+    np.testing.assert_array_equal(hour, want.dt.hour.fillna(-1).astype(int))
+    assert hour.dtype == np.dtype(bikeshare.HOUR_TYPE)
@@ -0,0 +1,74 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import bikeshare_zj_v3 as bikeshare
+
+
+def check_guarantees(summary, errors, bound, exact):
+    """
+        Check the guarantees of a top-k summary against the exact frequency table.
+
+        Args:
+            (Series) summary, (Series) errors, (int) bound - top-k summary, see merge_topk().
+            (Series) exact - exact frequency table (value -> count).
+
+        Returns: NONE
+    """
+    true = exact.reindex(summary.index, fill_value=0)
+    assert (summary - errors <= true).all()
+    assert (true <= summary).all()
+    dropped = exact.drop(summary.index)
+    assert (dropped <= bound).all()
+
+
+def split_tables(values, parts):
+    """Exact frequency tables of the parts of the values (as the statistics of chunks)."""
+    return [bikeshare.sort_frequency_table(pd.Series(part).value_counts()) for part in np.array_split(values, parts)]
+
+
+@pytest.mark.parametrize('k', [1, 3, 10, 100])
+@pytest.mark.parametrize('seed', range(5))
+def test_merge_topk(k, seed):
+    rng = np.random.default_rng(seed)
+    # skewed values, and the frequent values differ between the parts.
+    values = np.concatenate([rng.zipf(1.3, 4000) % 200, rng.integers(150, 250, 2000), rng.zipf(1.6, 3000) % 50 + 100])
+    exact = pd.Series(values).value_counts()
+
+    summaries = [bikeshare.topk_table(table, k) for table in split_tables(values, 7)]
+    for table, (summary, errors, bound) in zip(split_tables(values, 7), summaries):
+        check_guarantees(summary, errors, bound, table)
+        assert len(summary) == min(k, len(table))
+
+    merged = summaries[0]
+    for summary in summaries[1:]:
+        merged = bikeshare.merge_topk(*merged, *summary, k)
+        assert len(merged[0]) <= k
+    check_guarantees(*merged, exact)
+
+
+def test_merge_topk_exact():
+    # nothing is dropped while the number of values stays within k: the counts are exact.
+    tables = split_tables(np.arange(30) % 6, 3)
+    merged = bikeshare.topk_table(tables[0], 10)
+    for table in tables[1:]:
+        merged = bikeshare.merge_topk(*merged, *bikeshare.topk_table(table, 10), 10)
+    summary, errors, bound = merged
+    assert summary.to_dict() == {value: 5 for value in range(6)}
+    assert (errors == 0).all() and bound == 0
+
+
+def test_stream_stats_topk(city):
+    csv_path = bikeshare.CITY_DATA[city]
+    schema = bikeshare.city_schema(city)
+    exact = bikeshare.compute_stats(bikeshare.prepare_data(pd.read_csv(csv_path, dtype=schema)))
+    stats = bikeshare.stream_stats(csv_path, 'all', 'all', schema, chunksize=250, topk=5)
+
+    for key in bikeshare.TOPK_KEYS:
+        summary, errors, bound = stats[key], stats['topk_errors'][key], stats['topk_bounds'][key]
+        table = exact[key]
+        if key == 'route':
+            summary = pd.Series(summary.to_numpy(), index=bikeshare.decode_routes(stats, summary.index))
+            errors = pd.Series(errors.to_numpy(), index=summary.index)
+            table = pd.Series(table.to_numpy(), index=bikeshare.decode_routes(exact, table.index))
+        check_guarantees(summary, errors, bound, table)
@@ -0,0 +1,54 @@
+import os
+
+import pytest
+
+import bikeshare_zj_v3 as bikeshare
+
+STAT_SPANS = {'stat_month', 'stat_day', 'stat_hour', 'stat_start', 'stat_end', 'stat_route', 'stat_duration',
+              'stat_user_type', 'stat_gender', 'stat_birth_year'}
+
+
+@pytest.fixture
+def tracing(monkeypatch):
+    """Record spans into a trace of the test only; yields the recorded spans."""
+    monkeypatch.setattr(bikeshare, 'TRACE_SETTINGS', dict(bikeshare.TRACE_SETTINGS))
+    monkeypatch.setattr(bikeshare, 'TRACE_EVENTS', [])
+    monkeypatch.setattr(bikeshare, 'TRACE_STACK', [])
+    bikeshare.enable_tracing()
+    return bikeshare.TRACE_EVENTS
+
+
+def test_compute_stats_spans(city, tracing):
+    df = bikeshare.load_data(city, 'all', 'all', __file__)
+    bikeshare.compute_stats(df, topk=5)
+
+    names = [event['name'] for event in tracing]
+    assert STAT_SPANS | {'stat_topk'} <= set(names)
+    outer = next(event for event in tracing if event['name'] == 'compute_stats')
+    for event in tracing:
+        if event['name'].startswith('stat_'):
+            assert event['depth'] == outer['depth'] + 1
+            assert outer['start_ns'] <= event['start_ns']
+            assert event['start_ns'] + event['duration_ns'] <= outer['start_ns'] + outer['duration_ns']
+
+
+def test_parallel_stats_worker_spans(city, tracing):
+    bikeshare.parallel_stats([city], 'all', 'all', workers=2, chunksize=1000)
+
+    worker_spans = [event for event in tracing if event['pid'] != os.getpid()]
+    assert {'compute_stats', 'parse_timestamps'} | STAT_SPANS <= {event['name'] for event in worker_spans}
+    # one compute_stats span per chunk of 1000 rows of each byte range.
+    assert len([event for event in worker_spans if event['name'] == 'compute_stats']) >= 3
+
+
+def test_batch_stats_worker_spans(city, tracing, tmp_path, monkeypatch):
+    other = str(tmp_path / 'other.csv')
+    with open(bikeshare.CITY_DATA[city]) as src, open(other, 'w') as dst:
+        dst.write(src.read())
+    monkeypatch.setitem(bikeshare.CITY_DATA, 'other city', other)
+
+    bikeshare.batch_stats([city, 'other city'], ['all'], ['all'], __file__, workers=2)
+
+    loads = [event for event in tracing if event['name'] == 'load_data']
+    assert {event['args']['city'] for event in loads} == {city, 'other city'}
+    assert all(event['pid'] != os.getpid() for event in loads)